@@ -1,25 +1,28 @@
 import os
+import sys
 
 import psycopg2
 
-from dbconfig.config import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER, load_sql
-
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "../db/create.sql")
+DB_PATH = os.path.join(BASE_DIR, "../db/v1/create.sql")
+
+# Add the repository root to path to import dbconfig
+sys.path.append(os.path.join(BASE_DIR, "../.."))
+
+from dbconfig.config import load_sql  # noqa: E402
+from dbconfig.pool import connect  # noqa: E402
 
 
 def init_db():
     if not os.path.exists(DB_PATH):
         print(f"Error: SQL file not found at {DB_PATH}")
-        print("Please create the create.sql file in the db directory.")
+        print("Please create the create.sql file in the db/v1 directory.")
         return
 
     print("Connecting to database")
 
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD, port=DB_PORT
-        )
+        conn = connect("create_db")
     except psycopg2.Error as e:
         print(f"Error connecting to database: {e}")
         return
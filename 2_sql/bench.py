@@ -0,0 +1,187 @@
+"""
+Benchmark each base Task 2 query against its optimized variant
+Used by: python run_queries.py bench [--iterations N] [--concurrency N]
+"""
+
+import re
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# Query file name suffixes of the faster variants of a base query, such as
+# query2_optimized.sql; files with any other suffix are the base query
+VARIANTS = ["optimized", "incremental"]
+# Tables whose sizes describe the dataset a benchmark ran against
+DATASET_TABLES = [
+    "course_instance",
+    "employee",
+    "employee_course_instance",
+    "planned_activity",
+]
+
+
+def query_variants(queries_dir):
+    """Group query files by query number into their base file and VARIANTS"""
+    variants = {}
+    for path in sorted(queries_dir.glob("query*_*.sql")):
+        match = re.fullmatch(r"query(\d+)_(\w+)", path.stem)
+        if match is None:
+            continue
+        variant = match[2] if match[2] in VARIANTS else "base"
+        variants.setdefault(int(match[1]), {})[variant] = path
+
+    return dict(sorted(variants.items()))
+
+
+def query_pairs(queries_dir, variants=VARIANTS):
+    """Each base query file with its files of the given variants, for queries that have any"""
+    pairs = {}
+    for num, files in query_variants(queries_dir).items():
+        pair = {variant: path for variant, path in files.items() if variant in variants}
+        if "base" in files and pair:
+            pairs[num] = {"base": files["base"], **pair}
+    return pairs
+
+
+def dataset_counts(conn):
+    """Count the rows of the tables in DATASET_TABLES"""
+    counts = {}
+    with conn.cursor() as cursor:
+        for table in DATASET_TABLES:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cursor.fetchone()[0]
+    conn.rollback()
+    return counts
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of already sorted values"""
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+def time_query(pool, sql, params):
+    """Run sql once on a pooled connection and return (seconds, rows)"""
+    conn = pool.getconn()
+    try:
+        start = time.perf_counter()
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = len(cursor.fetchall())
+        elapsed = time.perf_counter() - start
+        conn.rollback()
+        return elapsed, rows
+    finally:
+        pool.putconn(conn)
+
+
+def bench_query(pool, sql, params, iterations, warmup, concurrency):
+    """Time iterations runs of sql at the given concurrency, after warmup runs
+
+    Returns latency percentiles in milliseconds, rows per run and
+    throughput in queries per second.
+    """
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(lambda _: time_query(pool, sql, params), range(warmup)))
+
+        start = time.perf_counter()
+        results = list(executor.map(lambda _: time_query(pool, sql, params), range(iterations)))
+        wall = time.perf_counter() - start
+
+    latencies = sorted(elapsed * 1000 for elapsed, _ in results)
+    return {
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.fmean(latencies),
+        "rows": results[0][1],
+        "throughput_qps": iterations / wall if wall > 0 else 0,
+    }
+
+
+def result_set(pool, sql, params):
+    """Fetch the result of sql as a multiset of rows, ignoring row order"""
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = Counter(cursor.fetchall())
+        conn.rollback()
+        return rows
+    finally:
+        pool.putconn(conn)
+
+
+def run_bench(pool, pairs, iterations, warmup, concurrency, params):
+    """Benchmark every base query and its variants from query_pairs(), returning a report
+
+    params fill in the named parameters of the queries. Each variant is
+    compared with the base query for speed and for returning the same rows.
+
+    The optimized variants read materialized views, so they only match the
+    base queries when the views have been refreshed since the data changed.
+    """
+    conn = pool.getconn()
+    try:
+        dataset = dataset_counts(conn)
+    finally:
+        pool.putconn(conn)
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "dataset": dataset,
+        "settings": {"iterations": iterations, "warmup": warmup, "concurrency": concurrency},
+        "params": params,
+        "queries": [],
+    }
+    for num, pair in pairs.items():
+        entry = {"query": num}
+        for variant, path in pair.items():
+            entry[variant] = {
+                "file": path.name,
+                **bench_query(pool, path.read_text(), params, iterations, warmup, concurrency),
+            }
+
+        base_rows = result_set(pool, pair["base"].read_text(), params)
+        base_p50 = entry["base"]["p50_ms"]
+        for variant in VARIANTS:
+            if variant in pair:
+                stats = entry[variant]
+                rows = result_set(pool, pair[variant].read_text(), params)
+                stats["identical"] = rows == base_rows
+                stats["speedup_p50"] = base_p50 / stats["p50_ms"] if stats["p50_ms"] > 0 else None
+        report["queries"].append(entry)
+
+    return report
+
+
+def format_bench(report):
+    """Format a report from run_bench() as summary lines"""
+    settings = report["settings"]
+    yield (
+        f"{settings['iterations']} iterations after {settings['warmup']} warmup runs, "
+        f"concurrency {settings['concurrency']}"
+    )
+    yield "Dataset: " + ", ".join(f"{table} {rows}" for table, rows in report["dataset"].items())
+    yield ""
+    yield (
+        f"{'query':<6} {'variant':<11} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+        f"{'rows':>8} {'qps':>9}"
+    )
+    for entry in report["queries"]:
+        for variant in ["base", *VARIANTS]:
+            if variant not in entry:
+                continue
+            stats = entry[variant]
+            line = (
+                f"{entry['query']:<6} {variant:<11} {stats['p50_ms']:>9.2f} "
+                f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['rows']:>8} "
+                f"{stats['throughput_qps']:>9.1f}"
+            )
+            if variant != "base":
+                speedup = f"{stats['speedup_p50']:.1f}x" if stats["speedup_p50"] else "n/a"
+                status = "identical" if stats["identical"] else "DIFFERENT RESULTS"
+                line += f"  p50 speedup {speedup}, {status}"
+            yield line
@@ -0,0 +1,238 @@
+"""
+Cache Task 2 query results until the tables they read change
+Used by: python run_queries.py --cache [--cache-dir DIR] [--cache-size MB]
+         python run_queries.py serve, which caches in memory until notified of writes
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+
+# Relation names following FROM or JOIN; names that are not tables, such as
+# CTEs or words in comments, are dropped by looking them up in pg_class
+RELATION = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)", re.IGNORECASE)
+# Cached results kept on disk before the least recently used are evicted
+CACHE_SIZE_MB = 64
+# Channel on which the name of each written table is sent with NOTIFY
+INVALIDATE_CHANNEL = "run_queries_invalidate"
+
+# Statement trigger of task2_change_tracking.sql counting each write to a
+# table in run_queries_changes and notifying INVALIDATE_CHANNEL of it
+TRACKING_TRIGGER = "run_queries_table_changed"
+# Tables among names, and whether each has the tracking trigger
+TRACKED_SQL = f"""
+    SELECT c.relname, EXISTS (
+        SELECT 1 FROM pg_trigger t WHERE t.tgrelid = c.oid AND t.tgname = '{TRACKING_TRIGGER}'
+    )
+    FROM pg_class c
+    WHERE c.relname = ANY(%s)
+      AND c.relkind IN ('r', 'p')
+      AND pg_table_is_visible(c.oid)
+    ORDER BY c.relname
+"""
+
+# A REFRESH or TRUNCATE gives a table a new relfilenode, and each write
+# bumps its change count, so together they change whenever its data may have.
+# Write counts come from run_queries_changes, which is exact, for tables with
+# the tracking trigger, and otherwise from the statistics views, which lag
+# the writing sessions' commits
+STATISTICS_CHANGES = "COALESCE(s.n_tup_ins + s.n_tup_upd + s.n_tup_del, 0)"
+TRACKED_CHANGES = f"""
+    CASE WHEN EXISTS (
+        SELECT 1 FROM pg_trigger t
+        WHERE t.tgrelid = c.oid AND t.tgname = '{TRACKING_TRIGGER}'
+    )
+    THEN (SELECT COALESCE(SUM(changes), 0) FROM run_queries_changes WHERE table_name = c.relname)
+    ELSE {STATISTICS_CHANGES} END
+"""
+VERSION_SQL = """
+    SELECT c.relname, c.relfilenode, {changes}
+    FROM pg_class c
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    WHERE c.relname = ANY(%s)
+      AND c.relkind IN ('r', 'm', 'p')
+      AND pg_table_is_visible(c.oid)
+    ORDER BY c.relname
+"""
+
+
+def flush_stats(conn):
+    """Commit, publishing the session's pending statistics to other sessions right away
+
+    A session reports its write counters once idle after a transaction, at
+    most once a second unless a flush is forced, which PostgreSQL 15 and
+    later support. Other sessions' writes may still take a moment to show.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regprocedure('pg_stat_force_next_flush()') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT pg_stat_force_next_flush()")
+    conn.commit()
+
+
+def tracked_tables(conn, names):
+    """Map each table among names to whether task2_change_tracking.sql tracks its writes"""
+    with conn.cursor() as cursor:
+        cursor.execute(TRACKED_SQL, (sorted(names),))
+        return dict(cursor.fetchall())
+
+
+def compact_changes(conn):
+    """Fold the change counts of exited backends into one row per table, if tracking is installed"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regprocedure('compact_run_queries_changes()') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT compact_run_queries_changes()")
+    conn.commit()
+
+
+def relations(sql):
+    """Names that sql reads from or joins, some of which may not be tables"""
+    return sorted({name.lower() for name in RELATION.findall(sql)})
+
+
+def table_version(conn, names):
+    """Token that changes whenever one of the named tables or materialized views is written
+
+    It changes with the commit for tables task2_change_tracking.sql
+    tracks. Other write counters reach the statistics views when the
+    writing session reports them, which can lag its commit by a few seconds.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('run_queries_changes') IS NOT NULL")
+        tracked = cursor.fetchone()[0]
+        changes = TRACKED_CHANGES if tracked else STATISTICS_CHANGES
+        cursor.execute(VERSION_SQL.format(changes=changes), (sorted(names),))
+        return cursor.fetchall()
+
+
+def data_version(conn, sql):
+    """Token that changes whenever a table or materialized view sql reads is written"""
+    return table_version(conn, relations(sql))
+
+
+def result_key(sql, params, version):
+    """Cache key for the result of sql run with params against a data version"""
+    text = json.dumps([sql, params, version], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class FileCache:
+    """Query results pickled to files in a directory, up to max_bytes in total
+
+    Reading an entry marks it as recently used; writing one evicts the least
+    recently used entries until the directory fits in max_bytes again.
+    Entries for old data versions are never read again and age out this way.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_SIZE_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return self.directory / f"{key}.pickle"
+
+    def get(self, key):
+        """Return the entry stored under key, or None"""
+        path = self.path(key)
+        try:
+            with path.open("rb") as f:
+                entry = pickle.load(f)
+            path.touch()
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        """Store entry under key, unless it alone is larger than the cache"""
+        data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+
+        # Write to a temporary file first so readers never see half an entry
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        temporary = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+        temporary.write_bytes(data)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries beyond max_bytes"""
+        entries = []
+        for path in self.directory.glob("*.pickle"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+class MemoryCache:
+    """Query results held in memory, up to max_bytes in total, until a table they read changes
+
+    Each entry is stored with the tables its query reads, and invalidate()
+    drops every entry reading a given table. A result computed while an
+    invalidation happened may predate the write behind it, so put() only
+    stores results whose generation, read before running the query, is
+    still current. Entries are evicted least recently used first.
+    """
+
+    def __init__(self, max_bytes=CACHE_SIZE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # Key -> (entry, tables, size in bytes)
+        self.size = 0
+        self.generation = 0  # Bumped by every invalidation
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the entry stored under key, or None"""
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            self.entries.move_to_end(key)
+            return item[0]
+
+    def put(self, key, entry, tables, generation):
+        """Store entry under key unless the cache was invalidated since generation"""
+        size = len(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            self.discard(key)
+            self.entries[key] = (entry, frozenset(tables), size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        """Drop the entry under key, if any; the caller holds the lock"""
+        item = self.entries.pop(key, None)
+        if item is not None:
+            self.size -= item[2]
+
+    def invalidate(self, table):
+        """Drop the entries whose query reads table"""
+        with self.lock:
+            self.generation += 1
+            for key in [key for key, (_, tables, _) in self.entries.items() if table in tables]:
+                self.discard(key)
+
+    def clear(self):
+        """Drop every entry, as when writes may have gone unnoticed"""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.size = 0
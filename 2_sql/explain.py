@@ -0,0 +1,208 @@
+"""
+Capture EXPLAIN ANALYZE plans of the Task 2 queries and diff them against a baseline
+Used by: python run_queries.py --explain [--save-baseline]
+"""
+
+import hashlib
+import json
+from collections import Counter
+from datetime import datetime, timezone
+
+from bench import dataset_counts
+
+# Flag plan nodes whose row estimate is off by more than this factor
+ROW_ERROR_THRESHOLD = 10.0
+# Flag queries touching more than this many times the baseline's buffers
+BUFFER_GROWTH_THRESHOLD = 1.5
+# Flag queries whose planner cost grows by more than this factor
+COST_GROWTH_THRESHOLD = 1.5
+# Ignore buffer growth smaller than this many blocks, which is noise on small plans
+MIN_BUFFER_GROWTH = 100
+
+
+def explain(conn, sql, params):
+    """Run sql under EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) and return its plan"""
+    with conn.cursor() as cursor:
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+        document = cursor.fetchone()[0]
+    # EXPLAIN ANALYZE executes the query, so nothing it did is kept
+    conn.rollback()
+    if isinstance(document, str):
+        document = json.loads(document)
+    return document[0]
+
+
+def dataset_fingerprint(conn):
+    """Describe the dataset plans are captured on, with a short hash to compare by"""
+    counts = dataset_counts(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SHOW server_version")
+        version = cursor.fetchone()[0]
+    conn.rollback()
+
+    digest = hashlib.sha256(json.dumps([version, counts], sort_keys=True).encode()).hexdigest()
+    return {"server_version": version, "tables": counts, "hash": digest[:12]}
+
+
+def capture_plans(conn, queries, params):
+    """Explain each query, keyed by file name, with a timestamp and dataset fingerprint"""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "fingerprint": dataset_fingerprint(conn),
+        "params": params,
+        "plans": {query["file"]: explain(conn, query["sql"], params) for query in queries},
+    }
+
+
+def walk(node):
+    """Yield a plan node and all nodes below it, depth first"""
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+def node_label(node):
+    """Name a plan node by its type and the relation it reads, if any"""
+    if "Relation Name" in node:
+        return f"{node['Node Type']} on {node['Relation Name']}"
+    return node["Node Type"]
+
+
+def scan_types(plan):
+    """Map each relation in a plan to the sorted node types that scan it"""
+    scans = {}
+    for node in walk(plan["Plan"]):
+        if "Relation Name" in node:
+            scans.setdefault(node["Relation Name"], []).append(node["Node Type"])
+    return {relation: sorted(types) for relation, types in scans.items()}
+
+
+def buffers(plan):
+    """Shared buffers hit or read by the whole plan"""
+    top = plan["Plan"]
+    return top.get("Shared Hit Blocks", 0) + top.get("Shared Read Blocks", 0)
+
+
+def estimate_errors(plan, threshold=ROW_ERROR_THRESHOLD):
+    """Describe executed nodes whose estimated rows are off by more than threshold times"""
+    errors = []
+    for node in walk(plan["Plan"]):
+        if not node.get("Actual Loops"):
+            continue
+        estimated, actual = node["Plan Rows"], node["Actual Rows"]
+        ratio = max(estimated, actual) / max(min(estimated, actual), 1)
+        if ratio > threshold:
+            errors.append(
+                f"{node_label(node)}: estimated {estimated} rows, "
+                f"actual {actual} ({ratio:.0f}x off)"
+            )
+    return errors
+
+
+def total_cost(plan):
+    """Planner's estimated total cost of the whole plan"""
+    return plan["Plan"].get("Total Cost", 0)
+
+
+def worst_estimate_error(plan):
+    """Largest factor by which an executed node's row estimate is off, 1 if none is"""
+    ratios = [
+        max(node["Plan Rows"], node["Actual Rows"])
+        / max(min(node["Plan Rows"], node["Actual Rows"]), 1)
+        for node in walk(plan["Plan"])
+        if node.get("Actual Loops")
+    ]
+    return max(ratios, default=1)
+
+
+def compare_plans(
+    baseline,
+    plan,
+    buffer_growth=BUFFER_GROWTH_THRESHOLD,
+    row_error_threshold=ROW_ERROR_THRESHOLD,
+):
+    """Compare plan with baseline
+
+    Returns the regressions, which describe what got worse (the planner's
+    cost, the buffers touched or the row estimates), and the changes of
+    scans and plan nodes, with the cost before and after to tell whether
+    they helped. Changed plans are only regressions when one of those got
+    worse.
+    """
+    regressions, changes = [], []
+
+    before, after = scan_types(baseline), scan_types(plan)
+    for relation in sorted(before.keys() | after.keys()):
+        if before.get(relation) != after.get(relation):
+            old = ", ".join(before.get(relation, ["not scanned"]))
+            new = ", ".join(after.get(relation, ["not scanned"]))
+            changes.append(f"{relation}: {old} -> {new}")
+
+    # Joins, sorts and aggregates, whose changes the scans above do not show
+    def other_nodes(plan):
+        return Counter(n["Node Type"] for n in walk(plan["Plan"]) if "Relation Name" not in n)
+
+    nodes_before, nodes_after = other_nodes(baseline), other_nodes(plan)
+    added, removed = nodes_after - nodes_before, nodes_before - nodes_after
+    if added or removed:
+        nodes = [f"+{node}" for node in sorted(added.elements())]
+        nodes += [f"-{node}" for node in sorted(removed.elements())]
+        changes.append("plan nodes: " + " ".join(nodes))
+
+    old_cost, new_cost = total_cost(baseline), total_cost(plan)
+    cost = f"cost {old_cost:.2f} -> {new_cost:.2f} ({new_cost / max(old_cost, 1):.2f}x)"
+    if new_cost > old_cost * COST_GROWTH_THRESHOLD:
+        regressions.append(cost)
+    elif changes:
+        changes.append(cost)
+
+    old_buffers, new_buffers = buffers(baseline), buffers(plan)
+    if new_buffers > old_buffers * buffer_growth and new_buffers - old_buffers >= MIN_BUFFER_GROWTH:
+        regressions.append(
+            f"buffers {old_buffers} -> {new_buffers} ({new_buffers / max(old_buffers, 1):.1f}x)"
+        )
+
+    old_error, new_error = worst_estimate_error(baseline), worst_estimate_error(plan)
+    if new_error > row_error_threshold and new_error > old_error:
+        regressions.append(f"row estimates off by up to {new_error:.0f}x, from {old_error:.0f}x")
+
+    return regressions, changes
+
+
+def format_explain(
+    capture,
+    baseline=None,
+    row_error_threshold=ROW_ERROR_THRESHOLD,
+    buffer_growth=BUFFER_GROWTH_THRESHOLD,
+):
+    """Summarize captured plans as lines, flagging regressions against baseline
+
+    Returns the lines and the number of regressions found. Plan changes, and
+    estimate errors no worse than the baseline's, are reported without
+    counting as regressions.
+    """
+    lines = [f"Dataset fingerprint: {capture['fingerprint']['hash']}"]
+    if baseline is None:
+        lines.append("No baseline to compare against")
+    else:
+        lines.append(f"Baseline from {baseline['timestamp']}")
+        if baseline["fingerprint"]["hash"] != capture["fingerprint"]["hash"]:
+            lines.append("Note: the baseline was captured on a different dataset or server version")
+
+    count = 0
+    for file, plan in capture["plans"].items():
+        lines.append("")
+        lines.append(
+            f"{file}: {plan['Execution Time']:.2f} ms execution, {plan['Planning Time']:.2f} ms "
+            f"planning, {buffers(plan)} buffers, top node {node_label(plan['Plan'])}"
+        )
+        if baseline is not None and file in baseline["plans"]:
+            regressions, changes = compare_plans(
+                baseline["plans"][file], plan, buffer_growth, row_error_threshold
+            )
+            count += len(regressions)
+            lines.extend(f"  REGRESSION {regression}" for regression in regressions)
+            lines.extend(f"  changed {change}" for change in changes)
+        lines.extend(f"  warning {error}" for error in estimate_errors(plan, row_error_threshold))
+
+    return lines, count
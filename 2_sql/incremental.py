@@ -0,0 +1,53 @@
+"""
+Check the trigger-maintained summary tables of task2_incremental.sql against a full recompute
+Used by: python run_queries.py verify [--rebuild]
+"""
+
+# Each summary table with the view recomputing it from the source tables
+SUMMARY_TABLES = {
+    "teacher_workload_summary": "teacher_workload_recompute",
+    "teacher_course_count": "teacher_course_count_recompute",
+}
+
+# Rows in the table, recomputed rows missing from it and rows it has that
+# the recompute does not, counting duplicates
+DIFFERENCE_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM {table}),
+        (SELECT COUNT(*) FROM (SELECT * FROM {recompute} EXCEPT ALL SELECT * FROM {table}) d),
+        (SELECT COUNT(*) FROM (SELECT * FROM {table} EXCEPT ALL SELECT * FROM {recompute}) d)
+"""
+
+
+def verify_summaries(conn):
+    """Compare each summary table with its full recompute
+
+    Both run in one snapshot, so writes committed meanwhile cannot show up
+    as differences. Returns {table: {"rows", "missing", "extra"}}.
+    """
+    results = {}
+    with conn.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        for table, recompute in SUMMARY_TABLES.items():
+            cursor.execute(DIFFERENCE_SQL.format(table=table, recompute=recompute))
+            rows, missing, extra = cursor.fetchone()
+            results[table] = {"rows": rows, "missing": missing, "extra": extra}
+    conn.rollback()
+    return results
+
+
+def rebuild_summaries(conn):
+    """Replace the summary tables' contents with a full recompute"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT rebuild_teacher_summaries()")
+    conn.commit()
+
+
+def format_verify(results):
+    """Format results from verify_summaries() as one line per table"""
+    for table, result in results.items():
+        status = "OK" if not result["missing"] and not result["extra"] else "MISMATCH"
+        yield (
+            f"{table}: {result['rows']} rows, {result['missing']} missing, "
+            f"{result['extra']} extra - {status}"
+        )
@@ -0,0 +1,239 @@
+"""
+Record what each Task 2 query execution cost to a JSON lines log, and summarize the log
+Used by: python run_queries.py --metrics [--metrics-log FILE]
+         python run_queries.py metrics [--log FILE]
+"""
+
+import json
+import statistics
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import psycopg2
+
+from bench import percentile
+from cache import relations
+
+# Cumulative pg_stat_statements counters recorded for each execution
+STATEMENT_COUNTERS = [
+    "calls",
+    "total_exec_time",
+    "total_plan_time",
+    "rows",
+    "shared_blks_hit",
+    "shared_blks_read",
+    "temp_blks_read",
+    "temp_blks_written",
+]
+# Statements of the current user in the current database, leaving out the
+# snapshots themselves and the data version lookups of the result cache
+STATEMENTS_SQL = f"""
+    SELECT queryid, {", ".join(f"SUM({counter})" for counter in STATEMENT_COUNTERS)}
+    FROM pg_stat_statements
+    WHERE userid = (SELECT oid FROM pg_roles WHERE rolname = current_user)
+      AND dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND query NOT LIKE '%pg_stat%'
+    GROUP BY queryid
+"""
+
+# Cumulative scan and block counters recorded for each table a query reads
+TABLE_COUNTERS = [
+    "seq_scan",
+    "seq_tup_read",
+    "idx_scan",
+    "idx_tup_fetch",
+    "heap_blks_hit",
+    "heap_blks_read",
+    "idx_blks_hit",
+    "idx_blks_read",
+]
+TABLES_SQL = """
+    SELECT s.relname,
+           s.seq_scan, s.seq_tup_read, COALESCE(s.idx_scan, 0), COALESCE(s.idx_tup_fetch, 0),
+           COALESCE(io.heap_blks_hit, 0), COALESCE(io.heap_blks_read, 0),
+           COALESCE(io.idx_blks_hit, 0), COALESCE(io.idx_blks_read, 0)
+    FROM pg_stat_user_tables s
+    JOIN pg_statio_user_tables io USING (relid)
+    WHERE s.relname = ANY(%s)
+"""
+
+
+def row_bytes(row):
+    """Size of a row's values as text, roughly what the server sent for it"""
+    return sum(len(str(val).encode()) for val in row if val is not None)
+
+
+def difference(before, after):
+    """Counters of each key that changed between two snapshots, as after minus before"""
+    changed = {}
+    for key, counters in after.items():
+        previous = before.get(key, [0] * len(counters))
+        delta = [float(now) - float(then) for now, then in zip(counters, previous)]
+        if any(delta):
+            changed[key] = delta
+    return changed
+
+
+class MetricsRecorder:
+    """Appends one JSON line per query execution to a log file
+
+    Each line has the wall time, rows and result bytes of the run and the
+    differences in server counters between snapshots taken before and
+    after it: pg_stat_user_tables and pg_statio_user_tables for the tables
+    the query reads, and pg_stat_statements where the extension is loaded.
+    Those counters are shared by every session of the user, so concurrent
+    work shows up in them too. files maps query text to its file name.
+    """
+
+    def __init__(self, path, conn, files=None):
+        self.path = path
+        self.files = files or {}
+        self.lock = threading.Lock()
+
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regprocedure('pg_stat_force_next_flush()') IS NOT NULL")
+            self.force_flush = cursor.fetchone()[0]
+            # Querying the view fails unless the library is preloaded
+            try:
+                cursor.execute(STATEMENTS_SQL)
+                self.statements = True
+            except psycopg2.Error:
+                self.statements = False
+        conn.rollback()
+
+    def snapshot(self, conn, sql):
+        """Server counters for sql, or None if they cannot be read
+
+        Ends the connection's transaction. A session publishes its table
+        statistics once idle after a transaction, at most once a second
+        unless a flush is forced, as it is where the server supports it.
+        """
+        try:
+            if self.force_flush:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_stat_force_next_flush()")
+            conn.rollback()
+
+            with conn.cursor() as cursor:
+                cursor.execute(TABLES_SQL, (relations(sql),))
+                tables = {name: counters for name, *counters in cursor.fetchall()}
+                statements = None
+                if self.statements:
+                    cursor.execute(STATEMENTS_SQL)
+                    statements = {queryid: counters for queryid, *counters in cursor.fetchall()}
+            conn.rollback()
+        except psycopg2.Error:
+            if not conn.closed:
+                conn.rollback()
+            return None
+        return {"tables": tables, "statements": statements}
+
+    def record(self, conn, name, sql, params, before, wall, rows, result_bytes, cached, error):
+        """Append the metrics of a run that started with the snapshot before"""
+        entry = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "query": name,
+            "file": self.files.get(sql),
+            "params": params,
+            "wall_ms": wall * 1000,
+            "rows": rows,
+            "result_bytes": result_bytes,
+            "cached": cached,
+        }
+        if error is not None:
+            entry["error"] = error
+
+        after = self.snapshot(conn, sql) if before is not None else None
+        if after is not None:
+            entry["tables"] = {
+                table: dict(zip(TABLE_COUNTERS, delta))
+                for table, delta in difference(before["tables"], after["tables"]).items()
+            }
+            if after["statements"] is not None:
+                changed = difference(before["statements"], after["statements"]).values()
+                totals = [sum(column) for column in zip(*changed)] or [0] * len(STATEMENT_COUNTERS)
+                entry["statements"] = dict(zip(STATEMENT_COUNTERS, totals))
+
+        line = json.dumps(entry, default=str)
+        with self.lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+def read_metrics(path):
+    """Records from a metrics log, skipping lines cut short by an interrupted write"""
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def mean(values):
+    """Mean of values, or None if there are none"""
+    values = list(values)
+    return statistics.fmean(values) if values else None
+
+
+def summarize(records):
+    """Aggregate records by day and query file, oldest day first
+
+    Days are UTC. Returns one dict per group with run counts, wall time
+    percentiles and means of rows, bytes and server counters, the latter
+    over the runs that have them.
+    """
+    groups = defaultdict(list)
+    for record in records:
+        query = record.get("file") or record["query"].split(" [", 1)[0]
+        groups[(record["timestamp"][:10], query)].append(record)
+
+    summary = []
+    for (day, query), runs in sorted(groups.items()):
+        walls = sorted(run["wall_ms"] for run in runs)
+        statements = [run["statements"] for run in runs if "statements" in run]
+        tables = [run["tables"].values() for run in runs if "tables" in run]
+        summary.append(
+            {
+                "day": day,
+                "query": query,
+                "runs": len(runs),
+                "cached": sum(run["cached"] for run in runs),
+                "errors": sum("error" in run for run in runs),
+                "p50_ms": percentile(walls, 50),
+                "p95_ms": percentile(walls, 95),
+                "rows": statistics.fmean(run["rows"] for run in runs),
+                "result_bytes": statistics.fmean(run["result_bytes"] for run in runs),
+                "exec_ms": mean(s["total_exec_time"] for s in statements),
+                "blks_hit": mean(
+                    sum(t["heap_blks_hit"] + t["idx_blks_hit"] for t in run) for run in tables
+                ),
+                "blks_read": mean(
+                    sum(t["heap_blks_read"] + t["idx_blks_read"] for t in run) for run in tables
+                ),
+            }
+        )
+    return summary
+
+
+def format_summary(summary):
+    """Format groups from summarize() as a table, one line per day and query"""
+
+    def optional(value, width, precision=1):
+        return f"{value:>{width}.{precision}f}" if value is not None else f"{'-':>{width}}"
+
+    yield (
+        f"{'day':<10} {'query':<36} {'runs':>5} {'cached':>6} {'errors':>6} {'p50 ms':>9} "
+        f"{'p95 ms':>9} {'rows':>8} {'KB':>8} {'exec ms':>9} {'blks hit':>9} {'read':>7}"
+    )
+    for group in summary:
+        query = group["query"].removesuffix(".sql")
+        yield (
+            f"{group['day']:<10} {query:<36} {group['runs']:>5} {group['cached']:>6} "
+            f"{group['errors']:>6} {group['p50_ms']:>9.2f} {group['p95_ms']:>9.2f} "
+            f"{group['rows']:>8.0f} {group['result_bytes'] / 1024:>8.1f} "
+            f"{optional(group['exec_ms'], 9, 2)} {optional(group['blks_hit'], 9, 0)} "
+            f"{optional(group['blks_read'], 7, 0)}"
+        )
@@ -2,7 +2,8 @@
 -- QUERY 1: Planned Hours Calculations per Course Instance
 -- ========================================================================
 -- Description: Calculate total planned hours (with multiplication factors)
--- and breakdown for each activity for all current year's course instances
+-- and breakdown for each activity for all course instances of the requested
+-- study year (run_queries.py --year, default current year)
 --
 -- Expected columns: Course Code, Instance ID, HP, Period, # Students,
 -- Lecture Hours, Tutorial Hours, Lab Hours, Seminar Hours, Other Overhead,
@@ -33,6 +34,6 @@ JOIN course_layout cl ON ci.course_code = cl.course_code
 JOIN study_period sp ON ci.study_period = sp.code
 LEFT JOIN planned_activity pa ON ci.instance_id = pa.instance_id
 LEFT JOIN teaching_activity ta ON pa.activity_name = ta.activity_name
-WHERE ci.study_year = EXTRACT(YEAR FROM CURRENT_DATE)  -- Filter for current year
+WHERE ci.study_year = %(year)s  -- Filter for the requested year (--year, default current year)
 GROUP BY cl.course_code, ci.instance_id, cl.hp, sp.code, ci.num_students
 ORDER BY cl.course_code, ci.instance_id;
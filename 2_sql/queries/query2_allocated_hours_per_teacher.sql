@@ -2,7 +2,8 @@
 -- QUERY 2: Actual Allocated Hours per Teacher per Course Instance
 -- ========================================================================
 -- Description: Calculate total allocated hours (with multiplication factors)
--- with breakdown for each activity and each teacher for current year's courses
+-- with breakdown for each activity and each teacher for the courses of the
+-- requested study year (run_queries.py --year, default current year)
 --
 -- Expected columns: Course Code, Instance ID, HP, Teacher's Name, Designation,
 -- Lecture Hours, Tutorial Hours, Lab Hours, Seminar Hours, Other Overhead,
@@ -38,6 +39,6 @@ JOIN person p ON e.personal_number = p.personal_number
 LEFT JOIN planned_activity pa ON ci.instance_id = pa.instance_id
     AND e.employee_id = pa.employee_id  -- Links each teacher to their specific activities
 LEFT JOIN teaching_activity ta ON pa.activity_name = ta.activity_name
-WHERE ci.study_year = EXTRACT(YEAR FROM CURRENT_DATE)  -- Filter for current year
+WHERE ci.study_year = %(year)s  -- Filter for the requested year (--year, default current year)
 GROUP BY cl.course_code, ci.instance_id, cl.hp, p.first_name, p.last_name, e.job_title, e.employee_id
 ORDER BY cl.course_code, ci.instance_id, p.last_name;
@@ -6,7 +6,7 @@
 -- Frequency: 12×/day (second most frequent query)
 -- ========================================================================
 
--- Query 2: Show allocated hours for each teacher for each course in current year
+-- Query 2: Show allocated hours for each teacher for each course in the requested year
 SELECT
     course_code AS "Course Code",
     instance_id AS "Course Instance ID",
@@ -22,5 +22,5 @@ SELECT
     exam_hours AS "Exam",
     total_hours AS "Total"
 FROM mv_teacher_workload_summary
-WHERE study_year = EXTRACT(YEAR FROM CURRENT_DATE)
+WHERE study_year = %(year)s  -- --year, default current year
 ORDER BY course_code, instance_id, last_name;
@@ -0,0 +1,27 @@
+-- ========================================================================
+-- QUERY 3 (INCREMENTAL): Total Teacher Workload
+-- ========================================================================
+-- Description: Optimized version reading the trigger-maintained table
+-- teacher_workload_summary (task2_incremental.sql), which is never stale
+--
+-- Frequency: 5×/day
+-- ========================================================================
+
+-- Query 3: Show complete workload for each teacher (all courses in the requested year)
+SELECT
+    course_code AS "Course Code",
+    instance_id AS "Course Instance ID",
+    hp AS "HP",
+    period_code AS "Period",
+    teacher_name AS "Teacher's Name",
+    lecture_hours AS "Lecture Hours",
+    tutorial_hours AS "Tutorial Hours",
+    lab_hours AS "Lab Hours",
+    seminar_hours AS "Seminar Hours",
+    other_overhead_hours AS "Other Overhead Hours",
+    admin_hours AS "Admin",
+    exam_hours AS "Exam",
+    total_hours AS "Total"
+FROM teacher_workload_summary
+WHERE study_year = %(year)s  -- --year, default current year
+ORDER BY last_name, first_name, course_code;
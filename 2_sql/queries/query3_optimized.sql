@@ -6,7 +6,7 @@
 -- Frequency: 5×/day
 -- ========================================================================
 
--- Query 3: Show complete workload for each teacher (all courses)
+-- Query 3: Show complete workload for each teacher (all courses in the requested year)
 SELECT
     course_code AS "Course Code",
     instance_id AS "Course Instance ID",
@@ -22,5 +22,5 @@ SELECT
     exam_hours AS "Exam",
     total_hours AS "Total"
 FROM mv_teacher_workload_summary
-WHERE study_year = EXTRACT(YEAR FROM CURRENT_DATE)
+WHERE study_year = %(year)s  -- --year, default current year
 ORDER BY last_name, first_name, course_code;
@@ -2,7 +2,8 @@
 -- QUERY 3: Total Allocated Hours per Teacher (All Courses)
 -- ========================================================================
 -- Description: Calculate total allocated hours (with multiplication factors)
--- for each teacher across all their course instances in the current year
+-- for each teacher across all their course instances in the requested study
+-- year (run_queries.py --year, default current year)
 --
 -- Expected columns: Course Code, Instance ID, HP, Period, Teacher's Name,
 -- Lecture Hours, Tutorial Hours, Lab Hours, Seminar Hours, Other Overhead,
@@ -37,6 +38,6 @@ JOIN person p ON e.personal_number = p.personal_number
 LEFT JOIN planned_activity pa ON ci.instance_id = pa.instance_id
     AND e.employee_id = pa.employee_id
 LEFT JOIN teaching_activity ta ON pa.activity_name = ta.activity_name
-WHERE ci.study_year = EXTRACT(YEAR FROM CURRENT_DATE)  -- Filter for current year
+WHERE ci.study_year = %(year)s  -- Filter for the requested year (--year, default current year)
 GROUP BY cl.course_code, ci.instance_id, cl.hp, sp.code, p.first_name, p.last_name, e.employee_id
 ORDER BY p.last_name, p.first_name, cl.course_code;
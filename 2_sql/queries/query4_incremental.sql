@@ -0,0 +1,21 @@
+-- ========================================================================
+-- QUERY 4 (INCREMENTAL): Teachers with High Course Load
+-- ========================================================================
+-- Description: Optimized version reading the trigger-maintained table
+-- teacher_course_count (task2_incremental.sql), which is never stale
+--
+-- Frequency: 20×/day (HIGHEST frequency - optimization critical!)
+-- ========================================================================
+
+-- Query 4: Find teachers with more than N courses in a specific period
+-- Parameters: year, period and threshold (run_queries.py --year, --period, --threshold)
+SELECT
+    employee_id AS "Employment ID",
+    teacher_name AS "Teacher's Name",
+    period_code AS "Period",
+    course_count AS "No of courses"
+FROM teacher_course_count
+WHERE study_year = %(year)s
+    AND period_code = %(period)s
+    AND course_count > %(threshold)s
+ORDER BY course_count DESC, last_name;
@@ -1,8 +1,8 @@
 -- ========================================================================
--- QUERY 4: Teachers Allocated to More Than N Courses in Current Period
+-- QUERY 4: Teachers Allocated to More Than N Courses in a Period
 -- ========================================================================
 -- Description: List employee IDs and names of teachers allocated to more than
--- a specific number of course instances during the current period
+-- a specific number of course instances during the requested study period
 --
 -- Expected columns: Employment ID, Teacher's Name, Period, No of courses
 --
@@ -10,12 +10,12 @@
 -- which may indicate workload imbalance. This is the most frequently run query
 -- (20×/day) so performance is critical.
 --
--- Usage: Adjust the HAVING clause threshold and WHERE period code as needed
+-- Usage: Pass the period and threshold with run_queries.py --period and
+-- --threshold (defaults P2 and 1), and the year with --year (default current year)
 -- ========================================================================
 
--- Version 1: Specific Period (e.g., P2)
--- Change 'P2' to desired period (P1, P2, P3, P4)
--- Change threshold (> 1) to desired minimum course count
+-- Version 1: Specific Period, given by the period parameter
+-- Teachers with more than threshold course instances in the given year
 
 SELECT
     e.employee_id AS "Employment ID",
@@ -27,10 +27,10 @@ JOIN person p ON e.personal_number = p.personal_number
 JOIN employee_course_instance eci ON e.employee_id = eci.employee_id
 JOIN course_instance ci ON eci.instance_id = ci.instance_id
 JOIN study_period sp ON ci.study_period = sp.code
-WHERE ci.study_year = EXTRACT(YEAR FROM CURRENT_DATE)  -- Current year
-    AND sp.code = 'P2'  -- Specify the period (P1, P2, P3, P4)
+WHERE ci.study_year = %(year)s  -- Requested year
+    AND sp.code = %(period)s  -- Requested period (P1, P2, P3, P4, ...)
 GROUP BY e.employee_id, p.first_name, p.last_name, sp.code
-HAVING COUNT(DISTINCT ci.instance_id) > 1  -- Change this threshold as needed
+HAVING COUNT(DISTINCT ci.instance_id) > %(threshold)s  -- Requested threshold
 ORDER BY "No of courses" DESC, p.last_name;
 
 
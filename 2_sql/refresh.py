@@ -0,0 +1,214 @@
+"""
+Refresh the Task 2 materialized views concurrently, and only when their sources changed
+Used by: python run_queries.py refresh [--force] [--blocking] [--views VIEW ...]
+"""
+
+import json
+import math
+import time
+
+from cache import INVALIDATE_CHANNEL, flush_stats, table_version
+
+# In dependency order: mv_teacher_course_count is built from mv_teacher_workload_summary
+MATERIALIZED_VIEWS = ["mv_teacher_workload_summary", "mv_teacher_course_count"]
+
+# REFRESH ... CONCURRENTLY needs a unique index covering every row of the
+# view, and the status table records each refresh; both match task2_views.sql
+SETUP_SQL = """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_workload_unique
+        ON mv_teacher_workload_summary(instance_id, employee_id);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_course_count_unique
+        ON mv_teacher_course_count(employee_id, study_year, period_code);
+    CREATE TABLE IF NOT EXISTS mv_refresh_status (
+        view_name TEXT PRIMARY KEY,
+        refreshed_at TIMESTAMPTZ NOT NULL,
+        duration_ms DOUBLE PRECISION NOT NULL,
+        concurrent BOOLEAN NOT NULL,
+        source_version TEXT NOT NULL
+    );
+"""
+
+# Tables and views a materialized view's query reads, from its rewrite rule
+SOURCES_SQL = """
+    SELECT DISTINCT d.refobjid::regclass::text
+    FROM pg_rewrite r
+    JOIN pg_depend d ON d.classid = 'pg_rewrite'::regclass AND d.objid = r.oid
+    WHERE r.ev_class = %s::regclass
+      AND d.refclassid = 'pg_class'::regclass
+      AND d.refobjid <> r.ev_class
+"""
+
+RECORD_SQL = """
+    INSERT INTO mv_refresh_status (view_name, refreshed_at, duration_ms, concurrent, source_version)
+    VALUES (%s, now(), %s, %s, %s)
+    ON CONFLICT (view_name) DO UPDATE
+    SET refreshed_at = EXCLUDED.refreshed_at,
+        duration_ms = EXCLUDED.duration_ms,
+        concurrent = EXCLUDED.concurrent,
+        source_version = EXCLUDED.source_version
+"""
+
+
+def setup(conn):
+    """Create the unique indexes and status table refreshes need, if missing"""
+    with conn.cursor() as cursor:
+        cursor.execute(SETUP_SQL)
+    conn.commit()
+
+
+def refresh_status(conn, views=MATERIALIZED_VIEWS):
+    """Map each view to its last refresh, with refreshed_at and age_seconds, or None"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT view_name, refreshed_at, duration_ms, concurrent, source_version,
+                   EXTRACT(EPOCH FROM now() - refreshed_at)
+            FROM mv_refresh_status
+            WHERE view_name = ANY(%s)
+            """,
+            (list(views),),
+        )
+        rows = cursor.fetchall()
+    conn.rollback()
+
+    status = dict.fromkeys(views)
+    for name, refreshed_at, duration_ms, concurrent, version, age in rows:
+        status[name] = {
+            "refreshed_at": refreshed_at,
+            "duration_ms": duration_ms,
+            "concurrent": concurrent,
+            "source_version": version,
+            "age_seconds": float(age),
+        }
+    return status
+
+
+def view_sources(conn, view):
+    """Names of the tables and views a materialized view is built from"""
+    with conn.cursor() as cursor:
+        cursor.execute(SOURCES_SQL, (view,))
+        return [name for (name,) in cursor.fetchall()]
+
+
+def source_version(conn, sources):
+    """Data version of a view's sources, as recorded in mv_refresh_status
+
+    Materialized views among the sources are versioned by their last
+    recorded refresh, since their write counters lag the refresh itself,
+    and the other sources by table_version().
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT view_name, refreshed_at FROM mv_refresh_status WHERE view_name = ANY(%s)",
+            (list(sources),),
+        )
+        refreshed = dict(cursor.fetchall())
+    tables = [source for source in sources if source not in refreshed]
+    version = {"tables": table_version(conn, tables), "views": refreshed}
+    return json.dumps(version, sort_keys=True, default=str)
+
+
+def view_staleness(conn, views=MATERIALIZED_VIEWS):
+    """Map each view to how many seconds it may lag behind its sources
+
+    That is 0 when no source has changed since the view's last refresh,
+    the time since that refresh when one has, and infinity when no refresh
+    is recorded. A view built from another view is as stale as that one.
+    """
+    flush_stats(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('mv_refresh_status')")
+        tracked = cursor.fetchone()[0] is not None
+    if not tracked:
+        conn.rollback()
+        return dict.fromkeys(views, math.inf)
+
+    status = refresh_status(conn, views)
+    staleness = {}
+    for view in views:
+        sources = view_sources(conn, view)
+        if status[view] is None:
+            lag = math.inf
+        elif status[view]["source_version"] == source_version(conn, sources):
+            lag = 0
+        else:
+            lag = status[view]["age_seconds"]
+        staleness[view] = max([lag, *(staleness[s] for s in sources if s in staleness)])
+    conn.rollback()
+    return staleness
+
+
+def refresh_views(conn, views=MATERIALIZED_VIEWS, force=False, concurrently=True):
+    """Refresh each view whose sources changed since its last refresh, in order
+
+    A view built from one refreshed just before it is refreshed too, as
+    that changes its source version. Views refresh concurrently, without
+    blocking readers, unless concurrently is false or the view has never
+    been populated. Each refresh is committed with its row in
+    mv_refresh_status and a notification to caches of the view, publishing
+    the refresh's write counters at once.
+
+    Returns one dict per view with whether and why it was refreshed.
+    """
+    # Writes this session made count in the source versions read below
+    flush_stats(conn)
+    status = refresh_status(conn, views)
+    refreshed = set()
+    results = []
+    for view in views:
+        sources = view_sources(conn, view)
+        version = source_version(conn, sources)
+        upstream = refreshed.intersection(sources)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT relispopulated FROM pg_class WHERE oid = %s::regclass", (view,))
+            populated = cursor.fetchone()[0]
+
+        if force:
+            reason = "forced"
+        elif status[view] is None:
+            reason = "no recorded refresh"
+        elif upstream:
+            reason = f"{', '.join(sorted(upstream))} refreshed"
+        elif status[view]["source_version"] != version:
+            reason = "sources changed"
+        else:
+            conn.rollback()
+            results.append({"view": view, "refreshed": False, "reason": "up to date"})
+            continue
+
+        concurrent = concurrently and populated
+        start = time.perf_counter()
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrent else ''}{view}"
+            )
+            duration_ms = (time.perf_counter() - start) * 1000
+            cursor.execute(RECORD_SQL, (view, duration_ms, concurrent, version))
+            cursor.execute("SELECT pg_notify(%s, %s)", (INVALIDATE_CHANNEL, view))
+        flush_stats(conn)
+
+        refreshed.add(view)
+        results.append(
+            {
+                "view": view,
+                "refreshed": True,
+                "reason": reason,
+                "concurrent": concurrent,
+                "duration_ms": duration_ms,
+            }
+        )
+
+    return results
+
+
+def format_refresh(results):
+    """Format results from refresh_views() as one line per view"""
+    for result in results:
+        if result["refreshed"]:
+            how = "concurrently" if result["concurrent"] else "with an exclusive lock"
+            yield (
+                f"{result['view']}: refreshed {how} in {result['duration_ms']:.1f} ms "
+                f"({result['reason']})"
+            )
+        else:
+            yield f"{result['view']}: {result['reason']}"
@@ -0,0 +1,281 @@
+"""
+Replay the documented Task 2 query mix as load from concurrent clients
+Used by: python run_queries.py replay [--days N] [--speedup X] [--scale F] [--clients N]
+"""
+
+import random
+import re
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from operator import itemgetter
+
+from bench import dataset_counts, percentile, query_variants
+from refresh import refresh_views
+
+# Daily frequency in a query file's header comments, such as "Frequency: 12×/day"
+FREQUENCY = re.compile(r"(\d+)×/day")
+SECONDS_PER_DAY = 86400
+# Keys of each table sampled at start for the churn to write to
+CHURN_KEY_SAMPLE = 10000
+# Seconds between samples of which clients are waiting on a lock
+LOCK_SAMPLE_INTERVAL = 0.05
+# Marks the replay's connections in pg_stat_activity
+APPLICATION_NAME = "run_queries replay"
+
+ASSIGNMENT_SQL = """
+    INSERT INTO employee_course_instance (instance_id, employee_id)
+    VALUES (%s, %s)
+    ON CONFLICT DO NOTHING
+"""
+PLANNED_HOURS_SQL = """
+    UPDATE planned_activity
+    SET planned_hours = GREATEST(planned_hours + %s, 0)
+    WHERE instance_id = %s AND employee_id = %s AND activity_name = %s
+"""
+LOCK_WAITERS_SQL = """
+    SELECT pid FROM pg_stat_activity
+    WHERE application_name = %s AND wait_event_type = 'Lock'
+"""
+
+
+def query_mix(queries_dir, variant="optimized"):
+    """Map each query number to its daily frequency and the file to run for it
+
+    Frequencies come from the query files' headers; queries that document
+    none are left out. The variant's file is run where the query has one,
+    and the base file otherwise.
+    """
+    mix = {}
+    for num, files in query_variants(queries_dir).items():
+        found = [FREQUENCY.search(path.read_text()) for path in files.values()]
+        per_day = [int(match[1]) for match in found if match]
+        if per_day:
+            mix[num] = {"file": files.get(variant, files.get("base")), "per_day": per_day[0]}
+    return mix
+
+
+def churn_keys(conn):
+    """Sample the course instances, employees and planned activities churn writes to"""
+    samples = {
+        "instances": "SELECT instance_id FROM course_instance",
+        "employees": "SELECT employee_id FROM employee",
+        "activities": "SELECT instance_id, employee_id, activity_name FROM planned_activity",
+    }
+    keys = {}
+    with conn.cursor() as cursor:
+        for name, sql in samples.items():
+            cursor.execute(f"{sql} ORDER BY random() LIMIT %s", (CHURN_KEY_SAMPLE,))
+            keys[name] = cursor.fetchall()
+    conn.rollback()
+    return keys
+
+
+def build_schedule(
+    mix, params, periods, days, scale, speedup, churn=0, refreshes=0, keys=None, seed=42
+):
+    """Spread each operation's daily count over the replay at random times
+
+    A simulated day lasts SECONDS_PER_DAY / speedup seconds. Queries run
+    scale times their documented frequency, each with a random period out
+    of periods; churn writes scale times churn per day, half of them new
+    assignments and half planned hours changes to rows sampled into keys.
+    refreshes per day refresh the materialized views concurrently through
+    refresh_views(), as run_queries.py refresh does, and are not scaled.
+
+    Returns (seconds from start, kind, sql, params) events in time order,
+    where sql may instead be a function to call with the connection.
+    """
+    rng = random.Random(seed)
+    span = days * SECONDS_PER_DAY / speedup
+
+    def times(per_day):
+        return [rng.uniform(0, span) for _ in range(round(per_day * days))]
+
+    events = []
+    for num, query in mix.items():
+        sql = query["file"].read_text()
+        for offset in times(query["per_day"] * scale):
+            events.append((offset, f"query {num}", sql, {**params, "period": rng.choice(periods)}))
+
+    for offset in times(churn * scale):
+        if rng.random() < 0.5:
+            (instance_id,) = rng.choice(keys["instances"])
+            (employee_id,) = rng.choice(keys["employees"])
+            events.append((offset, "assignment", ASSIGNMENT_SQL, (instance_id, employee_id)))
+        else:
+            delta = rng.choice([-2, -1, 1, 2])
+            activity = rng.choice(keys["activities"])
+            events.append((offset, "planned hours", PLANNED_HOURS_SQL, (delta, *activity)))
+
+    # Forced, so each one refreshes whether or not the churn changed anything,
+    # and recorded in mv_refresh_status with a notification to caches
+    refresh = partial(refresh_views, force=True)
+    for offset in times(refreshes):
+        events.append((offset, "refresh", refresh, None))
+
+    events.sort(key=itemgetter(0))
+    return events
+
+
+def run_replay(connect, events, clients, settings, prepared_factory=None):
+    """Run events on clients concurrent connections, each at its scheduled time
+
+    connect opens a connection. An event waits for its time and for a free
+    client, so when every client is busy it starts late; that lag is
+    reported with the latency of each kind of operation. Queries run as
+    prepared statements from prepared_factory when given. A separate
+    connection samples which clients are waiting on locks, to attribute
+    lock wait time to the operations that suffered it.
+
+    Returns the report as a dict, with settings recorded in it.
+    """
+    pending = iter(events)
+    guard = threading.Lock()
+    timings = defaultdict(list)  # Kind -> (latency, lag) of each successful run
+    errors = defaultdict(list)  # Kind -> error messages
+    running = {}  # Backend pid -> kind of the operation it is running
+    lock_waits = defaultdict(float)  # Kind -> seconds spent waiting on locks
+    peak_waiters = 0
+    finished = threading.Event()
+
+    def client():
+        conn = connect()
+        conn.autocommit = True
+        pid = conn.get_backend_pid()
+        prepared = prepared_factory() if prepared_factory else None
+        try:
+            while True:
+                with guard:
+                    event = next(pending, None)
+                if event is None:
+                    return
+                offset, kind, sql, params = event
+
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                began = time.perf_counter()
+                running[pid] = kind
+                try:
+                    if callable(sql):
+                        # It runs and commits its own transactions
+                        conn.autocommit = False
+                        try:
+                            sql(conn)
+                        finally:
+                            conn.rollback()
+                            conn.autocommit = True
+                    else:
+                        with conn.cursor() as cursor:
+                            if prepared is not None and kind.startswith("query"):
+                                prepared.execute(cursor, sql, params)
+                            else:
+                                cursor.execute(sql, params)
+                            if cursor.description is not None:
+                                cursor.fetchall()
+                except Exception as e:
+                    with guard:
+                        errors[kind].append(str(e).strip())
+                    continue
+                finally:
+                    running.pop(pid, None)
+                with guard:
+                    timings[kind].append((time.perf_counter() - began, began - start - offset))
+        finally:
+            conn.close()
+
+    def sample_lock_waits(conn):
+        nonlocal peak_waiters
+        last = time.perf_counter()
+        with conn.cursor() as cursor:
+            while not finished.wait(LOCK_SAMPLE_INTERVAL):
+                cursor.execute(LOCK_WAITERS_SQL, (APPLICATION_NAME,))
+                waiting = [running.get(pid) for (pid,) in cursor.fetchall()]
+                now = time.perf_counter()
+                for kind in filter(None, waiting):
+                    lock_waits[kind] += now - last
+                peak_waiters = max(peak_waiters, len(waiting))
+                last = now
+
+    monitor = connect()
+    monitor.autocommit = True
+    try:
+        dataset = dataset_counts(monitor)
+        sampler = threading.Thread(target=sample_lock_waits, args=(monitor,))
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            with ThreadPoolExecutor(clients) as executor:
+                for future in [executor.submit(client) for _ in range(clients)]:
+                    future.result()
+        finally:
+            finished.set()
+            sampler.join()
+        wall = time.perf_counter() - start
+    finally:
+        monitor.close()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "dataset": dataset,
+        "settings": settings,
+        "wall_seconds": wall,
+        "operations": len(events),
+        "throughput_ops": len(events) / wall if wall > 0 else 0,
+        "peak_lock_waiters": peak_waiters,
+        "kinds": {},
+    }
+    for kind in sorted(timings.keys() | errors.keys()):
+        latencies = sorted(latency * 1000 for latency, _ in timings[kind])
+        lags = [lag * 1000 for _, lag in timings[kind]]
+        entry = {"count": len(latencies), "errors": len(errors[kind])}
+        if latencies:
+            entry.update(
+                p50_ms=percentile(latencies, 50),
+                p95_ms=percentile(latencies, 95),
+                p99_ms=percentile(latencies, 99),
+                max_ms=latencies[-1],
+                mean_lag_ms=statistics.fmean(lags),
+                max_lag_ms=max(lags),
+            )
+        entry["lock_wait_s"] = lock_waits[kind]
+        if errors[kind]:
+            entry["first_error"] = errors[kind][0]
+        report["kinds"][kind] = entry
+
+    return report
+
+
+def format_replay(report):
+    """Format a report from run_replay() as summary lines"""
+    settings = report["settings"]
+    yield (
+        f"{settings['days']:g} simulated day(s) at scale {settings['scale']:g}, replayed in "
+        f"{report['wall_seconds']:.1f} s by {settings['clients']} clients"
+    )
+    yield "Dataset: " + ", ".join(f"{table} {rows}" for table, rows in report["dataset"].items())
+    yield (
+        f"{report['operations']} operations, {report['throughput_ops']:.1f} ops/s, "
+        f"at most {report['peak_lock_waiters']} clients waiting on locks at once"
+    )
+    yield ""
+    yield (
+        f"{'operation':<14} {'runs':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'p99 ms':>9} {'max ms':>9} {'lag ms':>9} {'lock s':>8}"
+    )
+    for kind, entry in report["kinds"].items():
+        if entry["count"]:
+            yield (
+                f"{kind:<14} {entry['count']:>6} {entry['errors']:>6} {entry['p50_ms']:>9.2f} "
+                f"{entry['p95_ms']:>9.2f} {entry['p99_ms']:>9.2f} {entry['max_ms']:>9.2f} "
+                f"{entry['mean_lag_ms']:>9.2f} {entry['lock_wait_s']:>8.2f}"
+            )
+        else:
+            yield f"{kind:<14} {0:>6} {entry['errors']:>6}"
+        if entry["errors"]:
+            yield f"{'':<14} first error: {entry['first_error']}"
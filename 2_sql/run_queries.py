@@ -1,20 +1,102 @@
 #!/usr/bin/env python3
 """
 Run all Task 2 queries and output results in a formatted way
-Usage: python run_queries.py [--format {table|csv|markdown}]
+Usage: python run_queries.py [--format {table|csv|markdown|jsonl}] [--stream [--itersize N]]
+                             [--parallel N] [--explain [--save-baseline]]
+                             [--year YEAR] [--period P [P ...]] [--threshold N] [--no-prepare]
+                             [--cache [--cache-dir DIR] [--cache-size MB]]
+                             [--export FILE [--gzip]]
+                             [--route {auto,base,optimized,incremental}]
+                             [--max-staleness SECONDS] [--refresh-stale]
+                             [--metrics [--metrics-log FILE]]
+       python run_queries.py bench [--iterations N] [--warmup N] [--concurrency N] [-o FILE]
+       python run_queries.py replay [--days N] [--speedup X] [--scale F] [--clients N]
+                                    [--churn N] [--refreshes N] [--no-prepare] [-o FILE]
+       python run_queries.py refresh [--force] [--blocking] [--views VIEW ...]
+       python run_queries.py verify [--rebuild]
+       python run_queries.py metrics [--log FILE]
+       python run_queries.py serve [--host HOST] [--port PORT | --socket PATH] [--connections N]
+                                   [--variant VARIANT] [--cache-size MB | --no-cache]
+       bench, replay and serve also take --year, --period and --threshold
 """
 
 import argparse
+import csv
+import gzip
+import io
+import json
+import math
+import os
+import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import date
+from decimal import Decimal
+from functools import partial
+from itertools import chain, islice
 from pathlib import Path
 
 # Add parent directory to path to import dbconfig
 sys.path.append(str(Path(__file__).parent.parent))
 QUERIES_DIR = Path(__file__).parent / "queries"
+PLANS_DIR = Path(__file__).parent / "plans"
+CACHE_DIR = Path(__file__).parent / "cache"
+METRICS_LOG = Path(__file__).parent / "metrics.jsonl"
+# Rows fetched per round trip from a server-side cursor when streaming
+ITERSIZE = 2000
+# Rows the table format sizes its columns from, and the widest column it prints
+TABLE_SAMPLE_ROWS = 100
+TABLE_MAX_WIDTH = 50
+# Named query parameters, written %(name)s in the query files
+PARAMETER = re.compile(r"%\((\w+)\)s")
+# A statement's final semicolon followed by a comment on the same line
+SEMICOLON_COMMENT = re.compile(r";\s*--[^\n]*$")
+DEFAULT_PERIOD = "P2"
+DEFAULT_THRESHOLD = 1
+# Seconds the materialized views may lag their source tables before queries
+# are routed to the base query instead
+MAX_STALENESS = 3600
 try:
     import psycopg2
 
-    from dbconfig.config import get_db_config
+    from bench import VARIANTS, format_bench, query_pairs, query_variants, run_bench
+    from cache import (
+        CACHE_SIZE_MB,
+        FileCache,
+        MemoryCache,
+        compact_changes,
+        data_version,
+        relations,
+        result_key,
+    )
+    from explain import (
+        BUFFER_GROWTH_THRESHOLD,
+        ROW_ERROR_THRESHOLD,
+        capture_plans,
+        format_explain,
+    )
+    from incremental import format_verify, rebuild_summaries, verify_summaries
+    from metrics import MetricsRecorder, format_summary, read_metrics, row_bytes, summarize
+    from refresh import (
+        MATERIALIZED_VIEWS,
+        format_refresh,
+        refresh_views,
+        setup,
+        view_staleness,
+    )
+    from replay import (
+        APPLICATION_NAME,
+        build_schedule,
+        churn_keys,
+        format_replay,
+        query_mix,
+        run_replay,
+    )
+    from serve import DEFAULT_HOST, DEFAULT_PORT, ReportService, make_server
+    from dbconfig.pool import ConnectionPool, connect
 except ImportError as e:
     print(f"Error importing required modules: {e}")
     print("Make sure psycopg2 is installed: pip install psycopg2-binary")
@@ -24,162 +106,1282 @@ except ImportError as e:
 def connect_db():
     """Establish database connection"""
     try:
-        config = get_db_config()
-        conn = psycopg2.connect(**config)
-        return conn
+        return connect()
     except Exception as e:
         print(f"Error connecting to database: {e}")
         sys.exit(1)
 
 
-def format_table(headers, rows):
-    """Format results as ASCII table"""
-    if not rows:
-        return "No results"
+def fit(text, width):
+    """Truncate text to width, marking the cut with an ellipsis"""
+    if len(text) <= width:
+        return text
+    return text[: width - 1] + "…"
+
+
+def connect_pool(size):
+    """Open a pool of up to size connections for running queries in parallel"""
+    try:
+        return ConnectionPool(1, size)
+    except Exception as e:
+        print(f"Error connecting to database: {e}")
+        sys.exit(1)
+
+
+def to_positional(sql):
+    """Rewrite %(name)s parameters as $1, $2, ... for PREPARE
+
+    Returns the rewritten SQL and the parameter names in position order.
+    """
+    names = []
+
+    def number(match):
+        if match[1] not in names:
+            names.append(match[1])
+        return f"${names.index(match[1]) + 1}"
+
+    return PARAMETER.sub(number, sql), names
+
+
+class PreparedStatements:
+    """Server-side prepared statements of one connection, prepared on first use
+
+    Repeated runs of the same query text, with any parameters, then skip
+    parsing and planning it again for the rest of the session.
+    """
+
+    def __init__(self):
+        self.statements = {}  # Query text -> (statement name, parameter names)
+
+    def prepare(self, cursor, sql):
+        """Prepare sql unless it already is, returning its statement and parameter names"""
+        if sql not in self.statements:
+            name = f"run_queries_{len(self.statements) + 1}"
+            text, names = to_positional(sql)
+            cursor.execute(f"PREPARE {name} AS {text}")
+            self.statements[sql] = (name, names)
+        return self.statements[sql]
+
+    def execute(self, cursor, sql, params):
+        name, names = self.prepare(cursor, sql)
+        if names:
+            placeholders = ", ".join(["%s"] * len(names))
+            cursor.execute(f"EXECUTE {name} ({placeholders})", [params[n] for n in names])
+        else:
+            cursor.execute(f"EXECUTE {name}")
+
+
+def format_table(headers, rows, sample_rows=TABLE_SAMPLE_ROWS, max_width=TABLE_MAX_WIDTH):
+    """Format results as ASCII table lines, streaming rows after a sample
+
+    Column widths come from the headers and the first sample_rows rows,
+    capped at max_width; without a sample, from the headers alone. Values
+    wider than their column are truncated, so every cell is converted to a
+    string once and only the sample is held in memory.
+    """
+    rows = iter(rows)
+    sample = [[str(val) for val in row] for row in islice(rows, sample_rows)]
 
     # Calculate column widths
-    col_widths = [len(str(h)) for h in headers]
-    for row in rows:
-        for i, val in enumerate(row):
-            col_widths[i] = max(col_widths[i], len(str(val)))
+    col_widths = []
+    for i, h in enumerate(headers):
+        widest = max((len(row[i]) for row in sample), default=0)
+        col_widths.append(max(len(str(h)), min(widest, max_width)))
+
+    def format_row(cells):
+        return "|" + "|".join(f" {fit(cell, w):<{w}} " for cell, w in zip(cells, col_widths)) + "|"
 
     # Create separator
     separator = "+" + "+".join("-" * (w + 2) for w in col_widths) + "+"
 
-    # Format header
-    header_row = (
-        "|"
-        + "|".join(f" {str(h):<{col_widths[i]}} " for i, h in enumerate(headers))
-        + "|"
-    )
+    yield separator
+    yield format_row(str(h) for h in headers)
+    yield separator
 
     # Format data rows
-    data_rows = []
+    for cells in sample:
+        yield format_row(cells)
     for row in rows:
-        data_row = (
-            "|"
-            + "|".join(f" {str(val):<{col_widths[i]}} " for i, val in enumerate(row))
-            + "|"
-        )
-        data_rows.append(data_row)
-
-    # Combine all
-    result = [separator, header_row, separator]
-    result.extend(data_rows)
-    result.append(separator)
+        yield format_row(str(val) for val in row)
 
-    return "\n".join(result)
+    yield separator
 
 
 def format_markdown(headers, rows):
-    """Format results as Markdown table"""
-    if not rows:
-        return "No results"
-
+    """Format results as Markdown table lines, one row at a time"""
     # Header row
-    header = "| " + " | ".join(str(h) for h in headers) + " |"
-    separator = "|" + "|".join("---" for _ in headers) + "|"
+    yield "| " + " | ".join(str(h) for h in headers) + " |"
+    yield "|" + "|".join("---" for _ in headers) + "|"
 
     # Data rows
-    data_rows = []
     for row in rows:
-        data_row = "| " + " | ".join(str(val) for val in row) + " |"
-        data_rows.append(data_row)
-
-    result = [header, separator] + data_rows
-    return "\n".join(result)
+        yield "| " + " | ".join(str(val) for val in row) + " |"
 
 
 def format_csv(headers, rows):
-    """Format results as CSV"""
-    if not rows:
-        return "No results"
+    """Format results as CSV lines, one row at a time, quoting every value"""
+    buffer = io.StringIO()
 
-    result = [",".join(str(h) for h in headers)]
+    def line(writer, values):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    yield line(csv.writer(buffer, lineterminator=""), headers)
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator="")
     for row in rows:
-        result.append(",".join(f'"{val}"' for val in row))
+        yield line(writer, row)
 
-    return "\n".join(result)
 
+def json_value(val):
+    """Convert a value json cannot serialize, such as NUMERIC hours or dates"""
+    if isinstance(val, Decimal):
+        return float(val)
+    return str(val)
 
-def run_query(conn, query_name, query_text, output_format="table"):
-    """Run a single query and format output"""
-    print(f"\n{'=' * 80}")
-    print(f"{query_name}")
-    print(f"{'=' * 80}\n")
 
-    try:
+def format_jsonl(headers, rows):
+    """Format results as JSON lines, one object per row"""
+    for row in rows:
+        yield json.dumps(dict(zip(headers, row)), default=json_value, ensure_ascii=False)
+
+
+def format_json(headers, rows):
+    """Format results as a single JSON array of row objects"""
+    rows = [dict(zip(headers, row)) for row in rows]
+    yield json.dumps(rows, default=json_value, ensure_ascii=False)
+
+
+FORMATTERS = {
+    "table": format_table,
+    "csv": format_csv,
+    "markdown": format_markdown,
+    "jsonl": format_jsonl,
+}
+# Formats of serve mode responses, with their content types
+SERVE_FORMATS = {
+    "json": ("application/json", format_json),
+    "csv": ("text/csv; charset=utf-8", format_csv),
+}
+
+
+def execute(conn, query_text, params, prepared=None, stream=False, itersize=ITERSIZE):
+    """Execute a query and return its cursor
+
+    With stream the cursor is server-side, reading itersize rows per round
+    trip; otherwise the query runs as a prepared statement when given one.
+    """
+    if stream:
+        cursor = conn.cursor(name="run_queries_stream")
+        cursor.itersize = itersize
+        cursor.execute(query_text, params)
+    elif prepared is not None:
         cursor = conn.cursor()
-        cursor.execute(query_text)
+        prepared.execute(cursor, query_text, params)
+    else:
+        cursor = conn.cursor()
+        cursor.execute(query_text, params)
+    return cursor
 
-        # Get results
-        rows = cursor.fetchall()
+
+def cached_result(conn, cache, query_text, params, prepared=None):
+    """Return (headers, rows, hit) for a query, from cache if still current
+
+    The cache key includes the data version of the tables the query reads,
+    so a result is only reused while none of them has been written.
+    """
+    key = result_key(query_text, params, data_version(conn, query_text))
+    entry = cache.get(key)
+    if entry is not None:
+        return (*entry, True)
+
+    with execute(conn, query_text, params, prepared) as cursor:
         headers = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchall()
+    cache.put(key, (headers, rows))
+    return headers, rows, False
+
+
+def run_query(
+    conn,
+    query_name,
+    query_text,
+    output_format="table",
+    params=None,
+    prepared=None,
+    stream=False,
+    itersize=ITERSIZE,
+    sample_rows=TABLE_SAMPLE_ROWS,
+    max_width=TABLE_MAX_WIDTH,
+    cache=None,
+    metrics=None,
+    out=None,
+):
+    """Run a single query and format output to out, stdout by default
+
+    params fill in the query's named parameters. With prepared, the query
+    runs as a statement prepared once per connection.
+
+    With stream, rows are read through a server-side cursor itersize rows
+    at a time and printed as they arrive, so memory stays flat and the
+    first rows show up before the query has been read to the end. Such a
+    cursor cannot be declared over EXECUTE, so streamed queries are not
+    prepared. sample_rows and max_width size the columns of table output.
+
+    With cache, results are read from and saved to it, and served from it
+    without running the query until the tables it reads change.
+
+    With metrics, a MetricsRecorder, the run's cost is appended to its log.
+    """
+    out = out or sys.stdout
+    print(f"\n{'=' * 80}", file=out)
+    print(f"{query_name}", file=out)
+    print(f"{'=' * 80}\n", file=out)
+
+    before = metrics.snapshot(conn, query_text) if metrics is not None else None
+    start = time.perf_counter()
+    cursor = None
+    hit = False
+    num_rows = 0
+    result_bytes = 0
+    error = None
+    try:
+        if cache is not None:
+            headers, rows, hit = cached_result(
+                conn, cache, query_text, params, prepared
+            )
+            rows = iter(rows)
+        else:
+            cursor = execute(conn, query_text, params, prepared, stream, itersize)
+            rows = iter(cursor)
+        cached = " (cached)" if hit else ""
+
+        # A server-side cursor has no description until rows are fetched
+        first = next(rows, None)
+        if first is None:
+            print("No results", file=out)
+            print(f"\nRows returned: 0{cached}\n", file=out)
+            return
+        if cursor is not None:
+            headers = [desc[0] for desc in cursor.description]
+
+        def counted(rows):
+            nonlocal num_rows, result_bytes
+            for num_rows, row in enumerate(rows, start=1):
+                if metrics is not None:
+                    result_bytes += row_bytes(row)
+                yield row
+                # Flush each batch once its last row is printed, before the next is
+                # fetched, not only when stdout's buffer fills
+                if stream and num_rows % itersize == 0:
+                    out.flush()
+
+        formatter = FORMATTERS[output_format]
+        if output_format == "table":
+            formatter = partial(format_table, sample_rows=sample_rows, max_width=max_width)
 
         # Format output
-        if output_format == "markdown":
-            result = format_markdown(headers, rows)
-        elif output_format == "csv":
-            result = format_csv(headers, rows)
-        else:  # table
-            result = format_table(headers, rows)
+        for line in formatter(headers, counted(chain([first], rows))):
+            print(line, file=out)
+        print(f"\nRows returned: {num_rows}{cached}\n", file=out)
+
+    except BrokenPipeError:
+        # The reader of the output went away; main() exits quietly
+        raise
+    except Exception as e:
+        print(f"Error executing query: {e}", file=sys.stderr)
+        error = str(e).strip()
+        # Leave the connection usable for the next query
+        conn.rollback()
+    finally:
+        if cursor is not None:
+            cursor.close()
+        if metrics is not None:
+            metrics.record(
+                conn,
+                query_name,
+                query_text,
+                params,
+                before,
+                time.perf_counter() - start,
+                num_rows,
+                result_bytes,
+                hit,
+                error,
+            )
+
+
+def copy_query(query_text):
+    """Strip the trailing semicolon and comments of a query file, to nest it in COPY"""
+    query = query_text.rstrip()
+    while True:
+        last_line = query.rsplit("\n", 1)[-1]
+        if query.endswith("*/") and "/*" in query:
+            query = query[: query.rindex("/*")].rstrip()
+        elif last_line.lstrip().startswith("--"):
+            query = query[: len(query) - len(last_line)].rstrip()
+        elif SEMICOLON_COMMENT.search(last_line):
+            query = query[: SEMICOLON_COMMENT.search(query).start()]
+        else:
+            return query.rstrip(";")
+
+
+def export_query(conn, query_text, params, path, compress=False):
+    """Export a query's result as CSV with a header, serialized by the server
+
+    The query runs under COPY ... TO STDOUT, whose output is copied to path,
+    or to stdout for "-", as it arrives, gzip-compressed with compress.
+    Rows are never parsed or held in Python.
+    """
+    with conn.cursor() as cursor, ExitStack() as stack:
+        query = cursor.mogrify(copy_query(query_text), params).decode()
+        if path == "-":
+            out = sys.stdout.buffer
+        else:
+            out = stack.enter_context(open(path, "wb"))
+        if compress:
+            out = stack.enter_context(gzip.GzipFile(fileobj=out, mode="wb"))
+        # The newline ends any comment on the query's last line before the parenthesis
+        cursor.copy_expert(f"COPY (\n{query}\n) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+    conn.rollback()
+
+
+def describe_seconds(seconds):
+    """Format a duration in the largest unit it reaches"""
+    for unit, size in (("d", 86400), ("h", 3600), ("min", 60)):
+        if seconds >= size:
+            return f"{seconds / size:.1f} {unit}"
+    return f"{seconds:.0f} s"
+
+
+def describe_staleness(seconds):
+    """Describe how far materialized views may lag behind their sources"""
+    if seconds == 0:
+        return "current"
+    if math.isinf(seconds):
+        return "never refreshed"
+    return f"up to {describe_seconds(seconds)} stale"
+
+
+def route_queries(conn, queries, route="auto", max_staleness=MAX_STALENESS, refresh_stale=False):
+    """Pick the variant of each query to run, naming the route taken
+
+    A route other than auto runs that variant of every query that has one,
+    and the base query otherwise. auto runs the optimized variant if the
+    materialized views it reads lag their sources by at most max_staleness
+    seconds, and otherwise the base query, or with refresh_stale refreshes
+    the views first.
+
+    Returns queries with a name, file and sql, ready for query_runs().
+    """
+    staleness = view_staleness(conn) if route == "auto" else {}
+
+    def lag(sql):
+        return max((staleness[view] for view in relations(sql) if view in staleness), default=0)
+
+    routed = []
+    for query in queries:
+        variants = query["variants"]
+        chosen = route if route in variants else "base"
+        note = f"route {chosen}"
+
+        if route == "auto" and "optimized" in variants:
+            stale = lag(variants["optimized"]["sql"])
+            if stale > max_staleness and refresh_stale:
+                try:
+                    refresh_views(conn)
+                except Exception as e:
+                    print(f"Error refreshing materialized views: {e}", file=sys.stderr)
+                    conn.rollback()
+                staleness = view_staleness(conn)
+                stale = lag(variants["optimized"]["sql"])
+            chosen = "optimized" if stale <= max_staleness else "base"
+            note = f"route {chosen}, views {describe_staleness(stale)}"
+            if chosen == "base":
+                note += f", over the {describe_seconds(max_staleness)} budget"
+
+        routed.append({**variants[chosen], "name": f"{query['name']} [{note}]"})
+    return routed
+
+
+def query_runs(queries, params, periods):
+    """Expand queries into (name, sql, params) runs, one per period for queries taking one"""
+    runs = []
+    for query in queries:
+        if "%(period)s" in query["sql"] and len(periods) > 1:
+            runs.extend(
+                (f"{query['name']} [{period}]", query["sql"], {**params, "period": period})
+                for period in periods
+            )
+        else:
+            runs.append((query["name"], query["sql"], {**params, "period": periods[0]}))
+    return runs
+
+
+def run_parallel(runs, output_format, workers, **options):
+    """Run queries concurrently on a pool of connections, printing results in order
 
-        print(result)
-        print(f"\nRows returned: {len(rows)}\n")
+    Each query's output is collected in memory and printed once it and every
+    query before it have finished, so the report reads as a sequential run.
+    """
+    pool = connect_pool(workers)
 
-        cursor.close()
+    def run(query_run):
+        name, sql, params = query_run
+        conn = pool.getconn()
+        try:
+            out = io.StringIO()
+            run_query(conn, name, sql, output_format, params, out=out, **options)
+            return out.getvalue()
+        finally:
+            pool.putconn(conn)
 
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            for output in executor.map(run, runs):
+                sys.stdout.write(output)
+                sys.stdout.flush()
+    finally:
+        pool.closeall()
+
+
+def query_params(args):
+    """Named query parameters from the command line, for the first requested period"""
+    return {"year": args.year, "period": args.period[0], "threshold": args.threshold}
+
+
+def bench(parser, args, queries):
+    """Benchmark base queries against their optimized variants and save the report"""
+    if args.iterations < 1 or args.warmup < 0 or args.concurrency < 1:
+        parser.error("--iterations and --concurrency must be at least 1, --warmup at least 0")
+
+    pairs = query_pairs(QUERIES_DIR, args.variants)
+    if args.queries:
+        pairs = {num: pair for num, pair in pairs.items() if num in args.queries}
+    if not pairs:
+        print("No queries with optimized variants to benchmark")
+        sys.exit(1)
+
+    pool = connect_pool(args.concurrency)
+    try:
+        report = run_bench(
+            pool, pairs, args.iterations, args.warmup, args.concurrency, query_params(args)
+        )
+    finally:
+        pool.closeall()
+
+    for line in format_bench(report):
+        print(line)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"\nBenchmark report written to: {args.output}")
+
+
+def replay(parser, args, queries):
+    """Replay the documented query mix from concurrent clients and save the report"""
+    if args.days <= 0 or args.speedup <= 0 or args.scale < 0 or args.clients < 1:
+        parser.error(
+            "--days and --speedup must be positive, --scale not negative "
+            "and --clients at least 1"
+        )
+    if args.churn < 0 or args.refreshes < 0:
+        parser.error("--churn and --refreshes must not be negative")
+
+    mix = query_mix(QUERIES_DIR, args.variant)
+    if not mix:
+        print("No query documents how often it runs")
+        sys.exit(1)
+
+    keys = None
+    if args.churn:
+        conn = connect_db()
+        keys = churn_keys(conn)
+        conn.close()
+        if not all(keys.values()):
+            print("Churn needs course instances, employees and planned activities to write to")
+            sys.exit(1)
+    if args.refreshes:
+        # Refreshes are recorded in mv_refresh_status, as by the refresh command
+        conn = connect_db()
+        try:
+            setup(conn)
+        except psycopg2.Error as e:
+            print(f"Error setting up materialized view refreshes: {e}")
+            sys.exit(1)
+        finally:
+            conn.close()
+
+    events = build_schedule(
+        mix,
+        query_params(args),
+        args.period,
+        args.days,
+        args.scale,
+        args.speedup,
+        args.churn,
+        args.refreshes,
+        keys,
+        args.seed,
+    )
+    settings = {
+        "days": args.days,
+        "speedup": args.speedup,
+        "scale": args.scale,
+        "clients": args.clients,
+        "churn_per_day": args.churn,
+        "refreshes_per_day": args.refreshes,
+        "variant": args.variant,
+        "params": query_params(args),
+        "periods": args.period,
+        "seed": args.seed,
+    }
+    mix_description = ", ".join(
+        f"query {num} {query['file'].name} {query['per_day']}×/day" for num, query in mix.items()
+    )
+    print(f"Replaying {len(events)} operations, query mix: {mix_description}")
+
+    prepared = None if args.no_prepare else PreparedStatements
+    try:
+        report = run_replay(
+            lambda: connect(APPLICATION_NAME), events, args.clients, settings, prepared
+        )
+    except psycopg2.OperationalError as e:
+        print(f"Error connecting to database: {e}")
+        sys.exit(1)
+
+    for line in format_replay(report):
+        print(line)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"\nReplay report written to: {args.output}")
+
+
+def refresh(parser, args, queries):
+    """Refresh the materialized views whose source tables changed since their last refresh"""
+    # Keep dependency order whatever order the views were given in
+    views = [view for view in MATERIALIZED_VIEWS if view in args.views]
+
+    conn = connect_db()
+    try:
+        setup(conn)
+        results = refresh_views(conn, views, args.force, not args.blocking)
+        compact_changes(conn)
     except Exception as e:
-        print(f"Error executing query: {e}\n")
+        print(f"Error refreshing materialized views: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    for line in format_refresh(results):
+        print(line)
+
+
+def verify(parser, args, queries):
+    """Check the incrementally maintained summary tables against a full recompute
+
+    Exits with status 1 if they differ, after rebuilding them with rebuild.
+    """
+    conn = connect_db()
+    try:
+        results = verify_summaries(conn)
+        for line in format_verify(results):
+            print(line)
+        mismatched = any(result["missing"] or result["extra"] for result in results.values())
+        if mismatched and args.rebuild:
+            rebuild_summaries(conn)
+            print("\nRebuilt the summary tables from a full recompute")
+    except Exception as e:
+        print(f"Error verifying summary tables: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    if mismatched:
+        sys.exit(1)
+
+
+def metrics(parser, args, queries):
+    """Summarize the metrics log by day and query"""
+    try:
+        records = read_metrics(args.log)
+    except FileNotFoundError:
+        print(f"No metrics log at {args.log}; record one with --metrics")
+        sys.exit(1)
+    if not records:
+        print(f"No metrics recorded in {args.log}")
+        return
+
+    for line in format_summary(summarize(records)):
+        print(line)
+
+
+def serve(parser, args, queries):
+    """Answer query requests over HTTP until interrupted
+
+    Each query's variant is read and prepared once at startup. Results are
+    cached in memory until the tables they read are written, as reported
+    by the triggers of task2_change_tracking.sql, for the queries whose
+    tables all have them.
+    """
+    if args.connections < 1 or args.cache_size < 1:
+        parser.error("--connections and --cache-size must be at least 1")
+
+    selected = {}
+    for num, query in queries.items():
+        variant = query["variants"].get(args.variant, query["variants"]["base"])
+        selected[num] = {**variant, "name": query["name"]}
+    cache = None if args.no_cache else MemoryCache(args.cache_size * 1024 * 1024)
+    stopped = threading.Event()
+    try:
+        service = ReportService(
+            selected, query_params(args), PreparedStatements, args.connections, cache
+        )
+    except psycopg2.Error as e:
+        print(f"Error connecting to database: {e}")
+        sys.exit(1)
+
+    try:
+        service.warm()
+        if cache is not None:
+            untracked = service.check_tracking()
+            if untracked:
+                print(
+                    f"Not caching queries reading {', '.join(untracked)}, whose writes are not "
+                    "tracked; install task2_change_tracking.sql to cache them",
+                    file=sys.stderr,
+                )
+            threading.Thread(target=service.listen, args=(stopped,), daemon=True).start()
+        server = make_server(service, SERVE_FORMATS, args.host, args.port, args.socket)
+    except (psycopg2.Error, OSError) as e:
+        print(f"Error starting the report service: {e}")
+        service.pool.closeall()
+        sys.exit(1)
+
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"Serving {len(selected)} queries on {where}, /query/N?format=json|csv")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stopped.set()
+        service.pool.closeall()
+        if args.socket:
+            Path(args.socket).unlink(missing_ok=True)
+
+
+def explain_queries(conn, queries, args):
+    """Capture query plans, compare them with the baseline and save them
+
+    Every capture is kept in the plans directory under its timestamp.
+    Returns the number of regressions found against the baseline.
+    """
+    capture = capture_plans(conn, queries, query_params(args))
+
+    baseline_path = args.plans_dir / "baseline.json"
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else None
+    lines, regressions = format_explain(
+        capture, baseline, args.row_error_threshold, args.buffer_growth
+    )
+    for line in lines:
+        print(line)
+
+    args.plans_dir.mkdir(parents=True, exist_ok=True)
+    stamp = capture["timestamp"].replace(":", "").split(".")[0]
+    capture_path = args.plans_dir / f"explain-{stamp}.json"
+    capture_path.write_text(json.dumps(capture, indent=2) + "\n")
+    print(f"\nPlans written to: {capture_path}")
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(capture, indent=2) + "\n")
+        print(f"Baseline saved to: {baseline_path}")
+
+    return regressions
 
 
 def load_queries():
-    """Load all .sql files in the queries directory."""
+    """Load the .sql files in the queries directory, grouped by query number
+
+    Each query has its base file and any optimized or incremental variants.
+    """
     queries = {}
 
-    for i, filepath in enumerate(sorted(QUERIES_DIR.glob("*.sql")), start=1):
-        queries[i] = {
-            "name": f"Query {i}: {filepath.stem.replace('_', ' ').title()}",
-            "sql": filepath.read_text(),
+    for num, files in query_variants(QUERIES_DIR).items():
+        title = files["base"].stem.split("_", 1)[1].replace("_", " ").title()
+        queries[num] = {
+            "name": f"Query {num}: {title}",
+            "variants": {
+                variant: {"file": path.name, "sql": path.read_text()}
+                for variant, path in files.items()
+            },
         }
 
     return queries
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Run Task 2 SQL queries")
+def run(parser, args, queries):
+    """Run the selected queries and print, export or explain their results"""
+    if args.itersize < 1:
+        parser.error("--itersize must be at least 1")
+    if args.sample_rows < 0 or args.max_width < 2:
+        parser.error("--sample-rows must not be negative and --max-width must be at least 2")
+    if args.parallel is not None and (args.parallel < 1 or args.query):
+        parser.error("--parallel must be at least 1 and cannot be combined with --query")
+    if args.explain and (args.parallel or args.stream):
+        parser.error("--explain cannot be combined with --parallel or --stream")
+    if args.save_baseline and not args.explain:
+        parser.error("--save-baseline only applies with --explain")
+    if args.cache and (args.stream or args.explain):
+        parser.error("--cache cannot be combined with --stream or --explain")
+    if args.cache_size < 1:
+        parser.error("--cache-size must be at least 1")
+    if args.export and (args.parallel or args.explain or args.stream or args.cache):
+        parser.error("--export cannot be combined with --parallel, --explain, --stream or --cache")
+    if args.export and (not args.query or len(args.period) > 1):
+        parser.error("--export writes a single result; select it with --query and one --period")
+    if args.gzip and not args.export:
+        parser.error("--gzip only applies with --export")
+    if args.metrics and (args.explain or args.export):
+        parser.error("--metrics cannot be combined with --explain or --export")
+    if args.route != "auto" and (args.refresh_stale or args.max_staleness != MAX_STALENESS):
+        parser.error("--max-staleness and --refresh-stale only apply with --route auto")
+
+    options = {
+        "stream": args.stream,
+        "itersize": args.itersize,
+        "sample_rows": args.sample_rows,
+        "max_width": args.max_width,
+        "cache": FileCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache else None,
+    }
+    params = query_params(args)
+    selected = [queries[args.query]] if args.query else [queries[n] for n in sorted(queries)]
+
+    # Connect to database
+    conn = connect_db()
+
+    if args.explain:
+        # Every file of the selected queries, for baselines that do not depend
+        # on the route, leaving out incremental ones unless they were asked for
+        explained = [
+            variant
+            for query in selected
+            for name, variant in query["variants"].items()
+            if name != "incremental" or args.route == "incremental"
+        ]
+        regressions = explain_queries(conn, explained, args)
+        conn.close()
+        if regressions:
+            print(f"\n{regressions} plan regression(s) against the baseline")
+            sys.exit(1)
+        return
+
+    routed = route_queries(conn, selected, args.route, args.max_staleness, args.refresh_stale)
+    runs = query_runs(routed, params, args.period)
+    if args.metrics:
+        files = {query["sql"]: query["file"] for query in routed}
+        options["metrics"] = MetricsRecorder(args.metrics_log, conn, files)
+
+    if args.parallel:
+        conn.close()
+        run_parallel(runs, args.format, args.parallel, **options)
+        print("\nDone!")
+        return
+
+    if args.export:
+        name, sql, run_params = runs[0]
+        compress = args.gzip or args.export.endswith(".gz")
+        try:
+            export_query(conn, sql, run_params, args.export, compress)
+        except BrokenPipeError:
+            # Exits quietly at the entry point, as when printing results
+            raise
+        except Exception as e:
+            print(f"Error exporting query: {e}", file=sys.stderr)
+            sys.exit(1)
+        finally:
+            conn.close()
+        if args.export != "-":
+            print(f"{name} exported to: {args.export}")
+        return
+
+    # Run specified query or all queries, once per requested period where
+    # they take one, reusing each prepared statement across the runs
+    prepared = None if args.no_prepare else PreparedStatements()
+    for name, sql, run_params in runs:
+        run_query(conn, name, sql, args.format, run_params, prepared, **options)
+
+    # Close connection
+    conn.close()
+    print("\nDone!")
+
+
+def query_options(prepare=True, suppress=False):
+    """Parent parser of the query parameter options shared by the commands running queries
+
+    With suppress, an option left out of a subcommand's arguments keeps
+    any value given before the subcommand instead of resetting it.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+
+    def default(value):
+        return argparse.SUPPRESS if suppress else value
+
+    parser.add_argument(
+        "--year",
+        type=int,
+        default=default(date.today().year),
+        help="Study year the queries report on (default: current year)",
+    )
+    parser.add_argument(
+        "--period",
+        nargs="+",
+        default=default([DEFAULT_PERIOD]),
+        help="Study periods for query 4; with several, it runs once per period "
+        f"(default: {DEFAULT_PERIOD})",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=default(DEFAULT_THRESHOLD),
+        help="Query 4 lists teachers with more than this many courses in the period "
+        f"(default: {DEFAULT_THRESHOLD})",
+    )
+    if prepare:
+        parser.add_argument(
+            "--no-prepare",
+            action="store_true",
+            default=default(False),
+            help="Send each query as plain SQL instead of a server-side prepared statement",
+        )
+    return parser
+
+
+def add_run_arguments(parser, queries):
+    """Options of a run of the queries, the command when no subcommand is given"""
     parser.add_argument(
         "--format",
-        choices=["table", "csv", "markdown"],
+        choices=FORMATTERS,
         default="table",
-        help="Output format (default: table)",
+        help="Output format, jsonl being one JSON object per row (default: table)",
     )
     parser.add_argument(
         "--query",
         type=int,
-        choices=[1, 2, 3, 4],
-        help="Run only specified query (default: run all)",
+        choices=sorted(queries),
+        help="Run only specified query (default: run all): "
+        + ", ".join(query["name"] for _, query in sorted(queries.items())),
+    )
+    parser.add_argument(
+        "--route",
+        choices=["auto", "base", *VARIANTS],
+        default="auto",
+        help="Variant of each query to run: auto runs the optimized one while the "
+        "materialized views it reads are fresh enough and the base query otherwise; "
+        "incremental needs task2_incremental.sql installed (default: auto)",
+    )
+    parser.add_argument(
+        "--max-staleness",
+        type=float,
+        default=MAX_STALENESS,
+        metavar="SECONDS",
+        help="With --route auto, how long the materialized views may have lagged their "
+        f"source tables and still be read (default: {MAX_STALENESS})",
+    )
+    parser.add_argument(
+        "--refresh-stale",
+        action="store_true",
+        help="With --route auto, refresh materialized views that are too stale instead "
+        "of running the base query",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        metavar="N",
+        help="Run all queries at once on a pool of N connections, "
+        "printing results in their usual order",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Run the queries under EXPLAIN (ANALYZE, BUFFERS) instead, and compare the plans "
+        "with the saved baseline; exits with status 1 if any plan's cost, buffers or row "
+        "estimates got worse",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="With --explain, save the captured plans as the new baseline",
+    )
+    parser.add_argument(
+        "--plans-dir",
+        type=Path,
+        default=PLANS_DIR,
+        help="Directory for captured plans and baseline.json (default: 2_sql/plans)",
+    )
+    parser.add_argument(
+        "--row-error-threshold",
+        type=float,
+        default=ROW_ERROR_THRESHOLD,
+        help="Warn about plan nodes whose row estimate is off by more than this factor, "
+        "and flag plans whose estimates get worse past it "
+        f"(default: {ROW_ERROR_THRESHOLD:g})",
+    )
+    parser.add_argument(
+        "--buffer-growth",
+        type=float,
+        default=BUFFER_GROWTH_THRESHOLD,
+        help="Flag queries touching more than this many times the baseline's buffers "
+        f"(default: {BUFFER_GROWTH_THRESHOLD:g})",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read rows through a server-side cursor and print them as they arrive, "
+        "using constant memory",
+    )
+    parser.add_argument(
+        "--itersize",
+        type=int,
+        default=ITERSIZE,
+        help=f"Rows fetched per round trip when streaming (default: {ITERSIZE})",
+    )
+    parser.add_argument(
+        "--sample-rows",
+        type=int,
+        default=TABLE_SAMPLE_ROWS,
+        help="Rows the table format sizes its columns from; later values that do not fit "
+        f"are truncated, and 0 sizes columns from the headers alone (default: {TABLE_SAMPLE_ROWS})",
+    )
+    parser.add_argument(
+        "--max-width",
+        type=int,
+        default=TABLE_MAX_WIDTH,
+        help=f"Widest column in table format (default: {TABLE_MAX_WIDTH})",
+    )
+    parser.add_argument(
+        "--export",
+        metavar="FILE",
+        help="Export the result of the one query selected by --query to FILE as CSV, "
+        "through COPY on the server; - writes to stdout",
+    )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Gzip-compress the export, as is done for any FILE ending in .gz",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse saved results of queries whose tables have not been written since",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=CACHE_DIR,
+        help="Directory for cached results (default: 2_sql/cache)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=CACHE_SIZE_MB,
+        metavar="MB",
+        help="Evict the least recently used results beyond this size "
+        f"(default: {CACHE_SIZE_MB})",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Append each query run's wall time, rows, result size and server-side "
+        "statistics to the metrics log, summarized by the metrics command",
     )
+    parser.add_argument(
+        "--metrics-log",
+        type=Path,
+        default=METRICS_LOG,
+        metavar="FILE",
+        help="JSON lines file metrics are appended to (default: 2_sql/metrics.jsonl)",
+    )
+    parser.set_defaults(handler=run)
 
-    args = parser.parse_args()
 
-    # Connect to database
-    conn = connect_db()
+def add_bench_parser(subparsers):
+    parser = subparsers.add_parser(
+        "bench",
+        parents=[query_options(prepare=False, suppress=True)],
+        help="Benchmark each base query against its optimized variant",
+        description="Time each base query and its optimized variant, check that both "
+        "return the same rows and write the results to a JSON report",
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=20,
+        help="Timed runs of each query (default: 20)",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=3,
+        help="Untimed runs of each query before timing (default: 3)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Runs in flight at once, each on its own connection (default: 1)",
+    )
+    parser.add_argument(
+        "--queries",
+        type=int,
+        nargs="+",
+        help="Query numbers to benchmark (default: every query with an optimized variant)",
+    )
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        choices=VARIANTS,
+        default=["optimized"],
+        help="Variants to compare with the base queries; incremental needs "
+        "task2_incremental.sql installed (default: optimized)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=Path("bench.json"),
+        help="JSON report path (default: bench.json)",
+    )
+    parser.set_defaults(handler=bench)
 
-    queries = load_queries()
-    # Run specified query or all queries
-    if args.query:
-        query = queries[args.query]
-        run_query(conn, query["name"], query["sql"], args.format)
-    else:
-        for query_num in sorted(queries.keys()):
-            query = queries[query_num]
-            run_query(conn, query["name"], query["sql"], args.format)
 
-    # Close connection
-    conn.close()
-    print("\nDone!")
+def add_replay_parser(subparsers):
+    parser = subparsers.add_parser(
+        "replay",
+        parents=[query_options(suppress=True)],
+        help="Replay the documented daily query mix as load from concurrent clients",
+        description="Replay each query at the daily frequency documented in its header, "
+        "time-compressed, optionally with write churn and materialized view refreshes, "
+        "and report latency, lock waits and throughput. Churn and refreshes are committed, "
+        "so replay them against a copy of the data.",
+    )
+    parser.add_argument(
+        "--days",
+        type=float,
+        default=1,
+        help="Simulated days of traffic to replay (default: 1)",
+    )
+    parser.add_argument(
+        "--speedup",
+        type=float,
+        default=1440,
+        help="Time compression, 1440 replaying a day in a minute (default: 1440)",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1,
+        help="Multiply the documented query frequencies and the churn by this factor "
+        "(default: 1)",
+    )
+    parser.add_argument(
+        "--clients",
+        type=int,
+        default=4,
+        help="Concurrent clients, each on its own connection (default: 4)",
+    )
+    parser.add_argument(
+        "--churn",
+        type=int,
+        default=0,
+        help="Writes per day interleaved with the queries, half new teacher assignments "
+        "and half planned hours changes (default: 0)",
+    )
+    parser.add_argument(
+        "--refreshes",
+        type=int,
+        default=0,
+        help="Forced refreshes of the materialized views per day, recorded as by the refresh "
+        "command and not scaled (default: 0)",
+    )
+    parser.add_argument(
+        "--variant",
+        choices=["base", *VARIANTS],
+        default="optimized",
+        help="Run each query's base or optimized file, where it has both (default: optimized)",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        default=42,
+        help="Random seed for the schedule (default: 42)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=Path("replay.json"),
+        help="JSON report path (default: replay.json)",
+    )
+    parser.set_defaults(handler=replay)
+
+
+def add_refresh_parser(subparsers):
+    parser = subparsers.add_parser(
+        "refresh",
+        help="Refresh the materialized views whose source tables changed",
+        description="Refresh each materialized view whose source tables have changed since "
+        "its last refresh, concurrently so queries reading it are not blocked, and record "
+        "the refresh in mv_refresh_status. Adds the unique indexes concurrent refreshes "
+        "need and the status table if they are missing.",
+    )
+    parser.add_argument(
+        "--views",
+        nargs="+",
+        choices=MATERIALIZED_VIEWS,
+        default=MATERIALIZED_VIEWS,
+        help="Views to refresh, in dependency order (default: all)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Refresh even views whose sources have not changed",
+    )
+    parser.add_argument(
+        "--blocking",
+        action="store_true",
+        help="Refresh with an exclusive lock instead of concurrently, which is faster "
+        "when most rows change but blocks queries reading the view",
+    )
+    parser.set_defaults(handler=refresh)
+
+
+def add_verify_parser(subparsers):
+    parser = subparsers.add_parser(
+        "verify",
+        help="Check the incrementally maintained summary tables against a full recompute",
+        description="Compare teacher_workload_summary and teacher_course_count, kept current "
+        "by the triggers of task2_incremental.sql, with a full recompute from the source "
+        "tables. Exits with status 1 if any row differs.",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Replace the tables' contents with the full recompute if they differ",
+    )
+    parser.set_defaults(handler=verify)
+
+
+def add_metrics_parser(subparsers):
+    parser = subparsers.add_parser(
+        "metrics",
+        help="Summarize the recorded query metrics by day and query",
+        description="Aggregate the runs recorded with --metrics by UTC day and query file: "
+        "run counts, wall time percentiles, mean rows and result size, and the mean "
+        "server execution time and blocks hit and read where they were captured. "
+        "Execution time needs the pg_stat_statements extension.",
+    )
+    parser.add_argument(
+        "--log",
+        type=Path,
+        default=METRICS_LOG,
+        metavar="FILE",
+        help="Metrics log to summarize (default: 2_sql/metrics.jsonl)",
+    )
+    parser.set_defaults(handler=metrics)
+
+
+def add_serve_parser(subparsers):
+    parser = subparsers.add_parser(
+        "serve",
+        parents=[query_options(prepare=False, suppress=True)],
+        help="Answer query requests over HTTP from warm, prepared connections",
+        description="Keep a pool of connections with every query prepared and answer "
+        "GET /query/N?year=Y&period=P&threshold=T&format=json|csv with the query's result, "
+        "parameters defaulting to --year, --period and --threshold. Results are cached in "
+        "memory until LISTEN/NOTIFY reports a write to a table they read, for queries whose "
+        "tables task2_change_tracking.sql tracks. GET /health reports the queries and cache.",
+    )
+    parser.add_argument(
+        "--host",
+        default=DEFAULT_HOST,
+        help=f"Address to listen on (default: {DEFAULT_HOST})",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help=f"Port to listen on (default: {DEFAULT_PORT})",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Listen on a Unix socket at PATH instead of a TCP port",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=4,
+        help="Pooled connections, and so queries run at once (default: 4)",
+    )
+    parser.add_argument(
+        "--variant",
+        choices=["base", *VARIANTS],
+        default="base",
+        help="Run each query's base file or its variant, where it has one; optimized "
+        "results are as fresh as the materialized views (default: base)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=CACHE_SIZE_MB,
+        metavar="MB",
+        help=f"Memory for cached results (default: {CACHE_SIZE_MB})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Run every request's query instead of caching results",
+    )
+    parser.set_defaults(handler=serve)
+
+
+def build_parser(queries):
+    """Command line parser, setting handler to the function running the chosen command
+
+    Handlers are called as handler(parser, args, queries).
+    """
+    parser = argparse.ArgumentParser(
+        description="Run Task 2 SQL queries", parents=[query_options()]
+    )
+    add_run_arguments(parser, queries)
+
+    subparsers = parser.add_subparsers(dest="command")
+    add_bench_parser(subparsers)
+    add_replay_parser(subparsers)
+    add_refresh_parser(subparsers)
+    add_verify_parser(subparsers)
+    add_metrics_parser(subparsers)
+    add_serve_parser(subparsers)
+    return parser
+
+
+def main():
+    queries = load_queries()
+    parser = build_parser(queries)
+    args = parser.parse_args()
+    args.handler(parser, args, queries)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except BrokenPipeError:
+        # Output was piped to a reader that stopped early, as with | head. Point
+        # stdout at devnull so flushing it at exit does not fail a second time
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
@@ -0,0 +1,287 @@
+"""
+Serve Task 2 query results from warm connections with every query prepared
+Used by: python run_queries.py serve [--host HOST] [--port PORT | --socket PATH] [--connections N]
+"""
+
+import json
+import re
+import select
+import socketserver
+import sys
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import psycopg2
+
+from cache import INVALIDATE_CHANNEL, relations, result_key, table_version, tracked_tables
+from dbconfig.pool import ConnectionPool, PoolTimeout, connect
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8351
+# Marks the service's connections in pg_stat_activity
+APPLICATION_NAME = "run_queries serve"
+# Seconds a request waits for a free connection before it is answered with 503
+CHECKOUT_TIMEOUT = 5.0
+# Seconds the listener waits for notifications between checks for shutdown
+LISTEN_INTERVAL = 1.0
+# Seconds before the listener reconnects after losing its connection
+RECONNECT_DELAY = 5.0
+# Request paths answered with a query's result, such as /query/2
+QUERY_PATH = re.compile(r"/query/(\d+)")
+# Query parameters a request may set, with the type each is parsed as
+PARAMETER_TYPES = {"year": int, "period": str, "threshold": int}
+# Materialized views among names
+VIEWS_SQL = "SELECT matviewname FROM pg_matviews WHERE matviewname = ANY(%s) ORDER BY 1"
+
+
+def request_params(fields, defaults):
+    """Query parameters from a request's parsed query string, over defaults"""
+    params = dict(defaults)
+    for name, values in fields.items():
+        if name not in PARAMETER_TYPES:
+            raise ValueError(f"unknown parameter {name!r}")
+        try:
+            params[name] = PARAMETER_TYPES[name](values[-1])
+        except ValueError:
+            expected = PARAMETER_TYPES[name].__name__
+            raise ValueError(f"{name} must be {expected}, not {values[-1]!r}") from None
+    return params
+
+
+class ReportService:
+    """Runs queries on a pool of connections, each with every query prepared, caching results
+
+    queries maps each query number to a dict with its name and sql, and
+    defaults fill in the parameters a request leaves out. Cached results
+    are only served while listen() keeps the cache current, and only for
+    queries every table of which check_tracking() found tracked. Those
+    reading materialized views are also keyed by the views' versions, as
+    only refreshes by run_queries.py refresh are notified.
+    """
+
+    def __init__(self, queries, defaults, prepared_factory, connections, cache=None):
+        self.queries = queries
+        self.defaults = defaults
+        self.prepared_factory = prepared_factory
+        self.cache = cache
+        self.pool = ConnectionPool(connections, connections, application_name=APPLICATION_NAME)
+        self.prepared = {}  # (connection id, backend pid) -> its prepared statements
+        self.parameters = {}  # Query number -> names of the parameters it takes
+        self.cacheable = set()  # Numbers of the queries whose results are cached
+        self.views = {}  # Query number -> materialized views it reads
+        self.guard = threading.Lock()
+        self.listening = threading.Event()  # Set while notifications keep the cache current
+
+    def statements(self, conn):
+        """Prepared statements of a pooled connection, new if the pool replaced it"""
+        key = (id(conn), conn.get_backend_pid())
+        with self.guard:
+            if key not in self.prepared:
+                self.prepared[key] = self.prepared_factory()
+            return self.prepared[key]
+
+    def warm(self):
+        """Prepare every query on every pooled connection"""
+        conns = [self.pool.getconn() for _ in range(self.pool.maxconn)]
+        try:
+            for conn in conns:
+                prepared = self.statements(conn)
+                with conn.cursor() as cursor:
+                    for num, query in self.queries.items():
+                        _, self.parameters[num] = prepared.prepare(cursor, query["sql"])
+                conn.rollback()
+        finally:
+            for conn in conns:
+                self.pool.putconn(conn)
+
+    def check_tracking(self):
+        """Find the queries whose tables all notify INVALIDATE_CHANNEL of writes
+
+        task2_change_tracking.sql installs the triggers sending the
+        notifications. Materialized views cannot have triggers;
+        run_queries.py refresh notifies of the views it refreshes instead.
+        Returns the tables the queries read that are not tracked.
+        """
+        names = {name for query in self.queries.values() for name in relations(query["sql"])}
+        with self.pool.connection() as conn:
+            tracked = tracked_tables(conn, names)
+            with conn.cursor() as cursor:
+                cursor.execute(VIEWS_SQL, (sorted(names),))
+                views = {name for (name,) in cursor.fetchall()}
+        self.views = {
+            num: sorted(views.intersection(relations(query["sql"])))
+            for num, query in self.queries.items()
+        }
+        self.cacheable = {
+            num
+            for num, query in self.queries.items()
+            if all(tracked.get(name, True) for name in relations(query["sql"]))
+        }
+        return sorted(name for name, is_tracked in tracked.items() if not is_tracked)
+
+    def listen(self, stopped):
+        """Invalidate cached results as tables are written, until stopped is set
+
+        Runs on its own connection. Notifications may be missed while it is
+        down, so losing it clears the cache and stops caching until it is
+        back.
+        """
+        while not stopped.is_set():
+            conn = None
+            try:
+                conn = connect(APPLICATION_NAME)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {INVALIDATE_CHANNEL}")
+                self.listening.set()
+                while not stopped.is_set():
+                    if select.select([conn], [], [], LISTEN_INTERVAL)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self.cache.invalidate(conn.notifies.pop(0).payload)
+            except psycopg2.Error as e:
+                print(f"Error listening for table changes: {e}".strip(), file=sys.stderr)
+                stopped.wait(RECONNECT_DELAY)
+            finally:
+                self.listening.clear()
+                self.cache.clear()
+                if conn is not None:
+                    conn.close()
+
+    def result(self, num, params):
+        """Return (headers, rows, cached) for query num run with params
+
+        A cached result of a query reading materialized views is only
+        served after looking up the views' versions, so a refresh that was
+        not notified, such as one run by hand, is noticed once its write
+        counters are reported, and a non-concurrent one at once.
+        """
+        query = self.queries[num]
+        params = {name: params[name] for name in self.parameters[num]}
+        caching = self.cache is not None and self.listening.is_set() and num in self.cacheable
+        if caching:
+            generation = self.cache.generation
+            version = None
+            if self.views[num]:
+                with self.pool.connection(CHECKOUT_TIMEOUT) as conn:
+                    version = table_version(conn, self.views[num])
+            key = result_key(query["sql"], params, version)
+            entry = self.cache.get(key)
+            if entry is not None:
+                return (*entry, True)
+
+        with self.pool.connection(CHECKOUT_TIMEOUT) as conn:
+            with conn.cursor() as cursor:
+                self.statements(conn).execute(cursor, query["sql"], params)
+                headers = [column.name for column in cursor.description]
+                rows = cursor.fetchall()
+        if caching:
+            self.cache.put(key, (headers, rows), relations(query["sql"]), generation)
+        return headers, rows, False
+
+    def health(self):
+        """Status of the service, as served at /health"""
+        status = {
+            "queries": {num: query["name"] for num, query in self.queries.items()},
+            "connections": self.pool.maxconn,
+        }
+        if self.cache is not None:
+            status["cache"] = {
+                "listening": self.listening.is_set(),
+                "queries": sorted(self.cacheable),
+                "entries": len(self.cache.entries),
+                "bytes": self.cache.size,
+            }
+        return status
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    """Answers GET /query/N?year=Y&period=P&threshold=T&format=F and GET /health
+
+    The server has the ReportService as service and maps each format to its
+    content type and formatter as formats.
+    """
+
+    server_version = "run_queries"
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def send_body(self, status, content_type, body, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, value):
+        body = (json.dumps(value, default=str) + "\n").encode()
+        self.send_body(status, "application/json", body)
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlsplit(self.path)
+        if url.path == "/health":
+            self.send_json(HTTPStatus.OK, service.health())
+            return
+        match = QUERY_PATH.fullmatch(url.path)
+        if match is None or int(match[1]) not in service.queries:
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": f"no query at {url.path}"})
+            return
+
+        fields = parse_qs(url.query)
+        output_format = fields.pop("format", ["json"])[-1]
+        if output_format not in self.server.formats:
+            error = f"format must be one of {', '.join(self.server.formats)}"
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": error})
+            return
+        try:
+            params = request_params(fields, service.defaults)
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+
+        start = time.perf_counter()
+        try:
+            headers, rows, cached = service.result(int(match[1]), params)
+        except PoolTimeout as e:
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)})
+            return
+        except psycopg2.Error as e:
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e).strip()})
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        content_type, formatter = self.server.formats[output_format]
+        body = "".join(f"{line}\n" for line in formatter(headers, rows)).encode()
+        self.send_body(
+            HTTPStatus.OK,
+            content_type,
+            body,
+            [("X-Cache", "hit" if cached else "miss"), ("X-Elapsed-Ms", f"{elapsed_ms:.2f}")],
+        )
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, formats, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """HTTP server answering requests with service, on a Unix socket if socket_path is given"""
+    if socket_path is not None:
+        # Replace the socket a previous run left behind
+        if Path(socket_path).is_socket():
+            Path(socket_path).unlink()
+        server = UnixHTTPServer(str(socket_path), ReportHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ReportHandler)
+    server.service = service
+    server.formats = formats
+    return server
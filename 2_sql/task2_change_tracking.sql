@@ -0,0 +1,124 @@
+-- ========================================================================
+-- Task 2: Change Tracking for Cached Query Results
+-- ========================================================================
+-- run_queries.py --cache and run_queries.py serve reuse a query's result
+-- until a table it reads is written. Without this file they tell writes
+-- apart by the n_tup_ins/upd/del counters of pg_stat_user_tables, which a
+-- writing session only reports some time after it commits, so a result
+-- can be served for a few seconds after the data behind it changed.
+--
+-- This file adds a statement trigger to each source table of the Task 2
+-- queries that, in the writing transaction:
+-- - counts the statement in run_queries_changes, which the caches read
+--   instead of the statistics views, so versions change with the commit
+-- - sends the table's name on the run_queries_invalidate channel, which
+--   serve LISTENs on to drop the cached results reading it
+--
+-- Every INSERT, UPDATE, DELETE and TRUNCATE on those tables then pays for
+-- one upsert and one NOTIFY, so install it only where results are cached:
+--     psql -d university -f task2_change_tracking.sql
+-- Tables without the trigger keep using the statistics views. Installing
+-- locks each source table against writes until COMMIT.
+--
+-- Counts are kept per table and backend, so concurrent writers never wait
+-- on each other's rows. python run_queries.py refresh folds the rows of
+-- backends that have exited into one per table with
+-- compact_run_queries_changes().
+-- ========================================================================
+
+BEGIN;
+
+
+-- ========================================================================
+-- DROP existing tables and functions if they exist
+-- ========================================================================
+-- run_queries_notify() is the notification trigger serve used to install
+-- ========================================================================
+DROP FUNCTION IF EXISTS run_queries_notify() CASCADE;
+DROP FUNCTION IF EXISTS run_queries_table_changed() CASCADE;
+DROP FUNCTION IF EXISTS compact_run_queries_changes() CASCADE;
+DROP TABLE IF EXISTS run_queries_changes CASCADE;
+
+
+-- ========================================================================
+-- Change counts
+-- ========================================================================
+-- backend_pid 0 holds the counts of backends that have exited
+-- ========================================================================
+
+CREATE TABLE run_queries_changes (
+    table_name TEXT NOT NULL,
+    backend_pid INT NOT NULL,
+    changes BIGINT NOT NULL,
+    PRIMARY KEY (table_name, backend_pid)
+);
+
+CREATE FUNCTION run_queries_table_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO run_queries_changes VALUES (TG_TABLE_NAME, pg_backend_pid(), 1)
+    ON CONFLICT (table_name, backend_pid) DO UPDATE
+    SET changes = run_queries_changes.changes + 1;
+
+    -- Delivered on commit, once per table and transaction
+    PERFORM pg_notify('run_queries_invalidate', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Move the counts of backends that have exited into their table's row for
+-- backend 0, leaving each table's total, and so its version, unchanged
+CREATE FUNCTION compact_run_queries_changes()
+RETURNS VOID AS $$
+BEGIN
+    WITH exited AS (
+        DELETE FROM run_queries_changes
+        WHERE backend_pid <> 0
+          AND backend_pid NOT IN (SELECT pid FROM pg_stat_activity)
+        RETURNING table_name, changes
+    )
+    INSERT INTO run_queries_changes
+    SELECT table_name, 0, SUM(changes) FROM exited GROUP BY table_name
+    ON CONFLICT (table_name, backend_pid) DO UPDATE
+    SET changes = run_queries_changes.changes + EXCLUDED.changes;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- ========================================================================
+-- Triggers
+-- ========================================================================
+-- The source tables of every query variant, including the summary tables
+-- of task2_incremental.sql where it is installed. Materialized views
+-- cannot have triggers; run_queries.py refresh notifies of its refreshes.
+-- ========================================================================
+
+DO $$
+DECLARE
+    source TEXT;
+BEGIN
+    FOREACH source IN ARRAY ARRAY[
+        'course_instance',
+        'course_layout',
+        'employee',
+        'employee_course_instance',
+        'person',
+        'planned_activity',
+        'study_period',
+        'teaching_activity',
+        'teacher_workload_summary',
+        'teacher_course_count'
+    ] LOOP
+        IF to_regclass(source) IS NOT NULL THEN
+            EXECUTE format(
+                'CREATE TRIGGER run_queries_table_changed
+                 AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I
+                 FOR EACH STATEMENT EXECUTE FUNCTION run_queries_table_changed()',
+                source
+            );
+        END IF;
+    END LOOP;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,386 @@
+-- ========================================================================
+-- Task 2: Incrementally Maintained Summary Tables
+-- ========================================================================
+-- An alternative to the materialized views in task2_views.sql. Refreshing
+-- mv_teacher_workload_summary re-runs its whole join and aggregation, so
+-- its cost grows with the full history, not with what changed.
+--
+-- This file creates the same summaries as ordinary tables:
+-- - teacher_workload_summary: one row per (course instance, teacher)
+-- - teacher_course_count: one row per (teacher, study year, period)
+--
+-- Statement-level triggers keep the tables current. After each statement
+-- on a source table, the trigger reads the changed rows from the
+-- transition tables and recomputes only the summary rows of the course
+-- instances and teachers they touch. Queries 2, 3 and 4 read them in
+-- queries/query*_incremental.sql, always fresh and without refreshes.
+--
+-- Check the tables against a full recompute with:
+--     python run_queries.py verify [--rebuild]
+--
+-- Source tables must be written in READ COMMITTED transactions (the
+-- default), so each recompute sees the writes committed before it.
+-- Writers lock only the course instances and teachers they touch, so
+-- writers of unrelated courses maintain the summaries concurrently.
+-- ========================================================================
+
+BEGIN;
+
+
+-- ========================================================================
+-- DROP existing tables, views and functions if they exist
+-- ========================================================================
+DROP FUNCTION IF EXISTS teacher_summary_sync() CASCADE;
+DROP FUNCTION IF EXISTS refresh_teacher_summaries(VARCHAR[], INT[]) CASCADE;
+DROP FUNCTION IF EXISTS rebuild_teacher_summaries() CASCADE;
+DROP FUNCTION IF EXISTS lock_teacher_summaries(TEXT, TEXT[]) CASCADE;
+DROP FUNCTION IF EXISTS teacher_summary_lock_space() CASCADE;
+DROP TABLE IF EXISTS teacher_course_count CASCADE;
+DROP TABLE IF EXISTS teacher_workload_summary CASCADE;
+DROP VIEW IF EXISTS teacher_course_count_recompute CASCADE;
+DROP VIEW IF EXISTS teacher_workload_recompute CASCADE;
+
+
+-- ========================================================================
+-- Full recomputes
+-- ========================================================================
+-- The same query as mv_teacher_workload_summary. Filters on instance_id
+-- and employee_id, which are grouping columns, are pushed down into the
+-- join, so the triggers can recompute a few rows through this view.
+-- ========================================================================
+
+CREATE VIEW teacher_workload_recompute AS
+SELECT
+    ci.study_year,
+    sp.code AS period_code,
+    cl.course_code,
+    ci.instance_id,
+    cl.hp,
+    e.employee_id,
+    p.first_name || ' ' || p.last_name AS teacher_name,
+    p.first_name,
+    p.last_name,
+    e.job_title AS designation,
+    COALESCE(SUM(pa.planned_hours * ta.factor) FILTER (WHERE ta.activity_name = 'Lecture'), 0) AS lecture_hours,
+    COALESCE(SUM(pa.planned_hours * ta.factor) FILTER (WHERE ta.activity_name = 'Tutorial'), 0) AS tutorial_hours,
+    COALESCE(SUM(pa.planned_hours * ta.factor) FILTER (WHERE ta.activity_name = 'Lab'), 0) AS lab_hours,
+    COALESCE(SUM(pa.planned_hours * ta.factor) FILTER (WHERE ta.activity_name = 'Seminar'), 0) AS seminar_hours,
+    COALESCE(SUM(pa.planned_hours * ta.factor) FILTER (WHERE ta.activity_name = 'Project supervision'), 0) AS other_overhead_hours,
+    COALESCE(SUM(pa.planned_hours * ta.factor) FILTER (WHERE ta.activity_name = 'Course administration'), 0) AS admin_hours,
+    COALESCE(SUM(pa.planned_hours * ta.factor) FILTER (WHERE ta.activity_name = 'Exam grading'), 0) AS exam_hours,
+    COALESCE(SUM(pa.planned_hours * ta.factor), 0) AS total_hours
+FROM course_instance ci
+JOIN course_layout cl ON ci.course_code = cl.course_code
+    AND ci.layout_version = cl.layout_version
+JOIN study_period sp ON ci.study_period = sp.code
+JOIN employee_course_instance eci ON ci.instance_id = eci.instance_id
+JOIN employee e ON eci.employee_id = e.employee_id
+JOIN person p ON e.personal_number = p.personal_number
+LEFT JOIN planned_activity pa ON ci.instance_id = pa.instance_id
+    AND e.employee_id = pa.employee_id
+LEFT JOIN teaching_activity ta ON pa.activity_name = ta.activity_name
+GROUP BY
+    ci.study_year,
+    sp.code,
+    cl.course_code,
+    ci.instance_id,
+    cl.hp,
+    e.employee_id,
+    p.first_name,
+    p.last_name,
+    e.job_title;
+
+CREATE VIEW teacher_course_count_recompute AS
+SELECT
+    employee_id,
+    teacher_name,
+    first_name,
+    last_name,
+    study_year,
+    period_code,
+    COUNT(*) AS course_count
+FROM teacher_workload_recompute
+GROUP BY
+    employee_id,
+    teacher_name,
+    first_name,
+    last_name,
+    study_year,
+    period_code;
+
+
+-- ========================================================================
+-- Summary tables
+-- ========================================================================
+-- Created empty with the recompute views' columns, and filled once the
+-- triggers are in place (see the end of this file).
+-- ========================================================================
+
+CREATE TABLE teacher_workload_summary AS
+SELECT * FROM teacher_workload_recompute WITH NO DATA;
+
+ALTER TABLE teacher_workload_summary ADD PRIMARY KEY (instance_id, employee_id);
+CREATE INDEX idx_workload_summary_employee_id ON teacher_workload_summary(employee_id);
+CREATE INDEX idx_workload_summary_year_period ON teacher_workload_summary(study_year, period_code);
+
+CREATE TABLE teacher_course_count AS
+SELECT * FROM teacher_course_count_recompute WITH NO DATA;
+
+ALTER TABLE teacher_course_count ADD PRIMARY KEY (employee_id, study_year, period_code);
+CREATE INDEX idx_course_count_year_period ON teacher_course_count(study_year, period_code);
+
+
+-- ========================================================================
+-- Maintenance functions
+-- ========================================================================
+
+-- Advisory lock space of the summary maintenance. Recomputes lock the
+-- pair (space, hashtext(kind || ' ' || key)) of each course instance and
+-- teacher they write, and share the single-key lock (space), which a
+-- rebuild takes exclusively. The locks last until the transaction commits,
+-- so a recompute waiting on one sees the changes of the transaction that
+-- held it. Hash collisions only serialize unrelated writers.
+CREATE FUNCTION teacher_summary_lock_space()
+RETURNS INT AS $$
+    SELECT 1351
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Lock the summary rows of the course instances ('instance') or teachers
+-- ('employee') in ids. Keys are locked in sorted order so writers locking
+-- overlapping sets queue up instead of deadlocking.
+CREATE FUNCTION lock_teacher_summaries(kind TEXT, ids TEXT[])
+RETURNS VOID AS $$
+DECLARE
+    key INT;
+BEGIN
+    FOR key IN
+        SELECT DISTINCT hashtext(kind || ' ' || id) FROM unnest(ids) AS id ORDER BY 1
+    LOOP
+        PERFORM pg_advisory_xact_lock(teacher_summary_lock_space(), key);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replace both summary tables with a full recompute, for TRUNCATEs and
+-- bulk loads that touch too many rows to recompute piecewise
+CREATE FUNCTION rebuild_teacher_summaries()
+RETURNS VOID AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(teacher_summary_lock_space());
+
+    DELETE FROM teacher_workload_summary;
+    INSERT INTO teacher_workload_summary SELECT * FROM teacher_workload_recompute;
+
+    DELETE FROM teacher_course_count;
+    INSERT INTO teacher_course_count SELECT * FROM teacher_course_count_recompute;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recompute the summary rows of the teachers in employee_ids on the course
+-- instances in instance_ids, and the course counts of those teachers. A
+-- NULL instance_ids means every course instance of those teachers, and a
+-- NULL employee_ids every teacher of those course instances.
+CREATE FUNCTION refresh_teacher_summaries(instance_ids VARCHAR[], employee_ids INT[])
+RETURNS VOID AS $$
+BEGIN
+    IF instance_ids IS NULL AND employee_ids IS NULL THEN
+        RETURN;
+    END IF;
+
+    PERFORM pg_advisory_xact_lock_shared(teacher_summary_lock_space());
+
+    -- Every pair's summary row is written under the locks of its course
+    -- instance and teacher, instances first. The given side is locked
+    -- before looking up the other, so the lookup sees the pairs added by
+    -- writers that held those locks. Writers of an instance lock its
+    -- teachers too, which orders them against writers of those teachers;
+    -- writers of a teacher alone leave the instances unlocked, since every
+    -- other writer of the teacher's rows waits on the teacher's lock.
+    IF instance_ids IS NOT NULL THEN
+        PERFORM lock_teacher_summaries('instance', instance_ids::TEXT[]);
+    END IF;
+    IF employee_ids IS NOT NULL THEN
+        PERFORM lock_teacher_summaries('employee', employee_ids::TEXT[]);
+    END IF;
+
+    -- Look up the other side of the course instance/teacher pairs both in
+    -- the current assignments and in the summary, which still holds the
+    -- pairs of assignments that were just removed
+    IF instance_ids IS NULL THEN
+        SELECT array_agg(DISTINCT instance_id) INTO instance_ids
+        FROM (
+            SELECT instance_id FROM employee_course_instance WHERE employee_id = ANY(employee_ids)
+            UNION ALL
+            SELECT instance_id FROM teacher_workload_summary WHERE employee_id = ANY(employee_ids)
+        ) AS assigned;
+    ELSIF employee_ids IS NULL THEN
+        SELECT array_agg(DISTINCT employee_id) INTO employee_ids
+        FROM (
+            SELECT employee_id FROM employee_course_instance WHERE instance_id = ANY(instance_ids)
+            UNION ALL
+            SELECT employee_id FROM teacher_workload_summary WHERE instance_id = ANY(instance_ids)
+        ) AS assigned;
+        PERFORM lock_teacher_summaries('employee', employee_ids::TEXT[]);
+    END IF;
+
+    IF instance_ids IS NULL OR employee_ids IS NULL THEN
+        RETURN;
+    END IF;
+
+    -- Past this many keys, recomputing everything at once is cheaper
+    IF cardinality(instance_ids) > 5000 OR cardinality(employee_ids) > 5000 THEN
+        PERFORM rebuild_teacher_summaries();
+        RETURN;
+    END IF;
+
+    DELETE FROM teacher_workload_summary
+    WHERE instance_id = ANY(instance_ids) AND employee_id = ANY(employee_ids);
+
+    INSERT INTO teacher_workload_summary
+    SELECT * FROM teacher_workload_recompute
+    WHERE instance_id = ANY(instance_ids) AND employee_id = ANY(employee_ids);
+
+    -- Course counts have the workload summary's grain coarsened to the
+    -- teacher, year and period, so they are recounted from it
+    DELETE FROM teacher_course_count WHERE employee_id = ANY(employee_ids);
+
+    INSERT INTO teacher_course_count
+    SELECT
+        employee_id,
+        teacher_name,
+        first_name,
+        last_name,
+        study_year,
+        period_code,
+        COUNT(*)
+    FROM teacher_workload_summary
+    WHERE employee_id = ANY(employee_ids)
+    GROUP BY employee_id, teacher_name, first_name, last_name, study_year, period_code;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level trigger function for every source table. The changed
+-- rows are read from the old_rows and new_rows transition tables, which
+-- exist depending on the operation, so the key query runs dynamically.
+CREATE FUNCTION teacher_summary_sync()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed TEXT;
+    keys TEXT;
+    instance_ids VARCHAR[];
+    employee_ids INT[];
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM rebuild_teacher_summaries();
+        RETURN NULL;
+    END IF;
+
+    changed := CASE TG_OP
+        WHEN 'INSERT' THEN 'new_rows'
+        WHEN 'DELETE' THEN 'old_rows'
+        ELSE '(SELECT * FROM old_rows UNION ALL SELECT * FROM new_rows)'
+    END;
+
+    -- Course instances and teachers whose summary rows the change affects,
+    -- NULL standing for every one related to the other
+    keys := CASE TG_TABLE_NAME
+        WHEN 'planned_activity' THEN
+            'SELECT instance_id, employee_id FROM %s AS changed'
+        WHEN 'employee_course_instance' THEN
+            'SELECT instance_id, employee_id FROM %s AS changed'
+        WHEN 'teaching_activity' THEN
+            'SELECT pa.instance_id, pa.employee_id FROM %s AS changed
+             JOIN planned_activity pa ON pa.activity_name = changed.activity_name'
+        WHEN 'course_instance' THEN
+            'SELECT instance_id, NULL::INT FROM %s AS changed'
+        WHEN 'course_layout' THEN
+            'SELECT ci.instance_id, NULL::INT FROM %s AS changed
+             JOIN course_instance ci ON ci.course_code = changed.course_code
+                AND ci.layout_version = changed.layout_version'
+        WHEN 'employee' THEN
+            'SELECT NULL::VARCHAR, employee_id FROM %s AS changed'
+        WHEN 'person' THEN
+            'SELECT NULL::VARCHAR, e.employee_id FROM %s AS changed
+             JOIN employee e ON e.personal_number = changed.personal_number'
+    END;
+
+    EXECUTE format(
+        'SELECT array_agg(DISTINCT instance_id) FILTER (WHERE instance_id IS NOT NULL),
+                array_agg(DISTINCT employee_id) FILTER (WHERE employee_id IS NOT NULL)
+         FROM (' || keys || ') AS k(instance_id, employee_id)',
+        changed
+    ) INTO instance_ids, employee_ids;
+
+    -- Rows keyed by both sides identify exact pairs; one-sided keys, such
+    -- as a renamed teacher, cover every pair on that side
+    IF TG_TABLE_NAME IN ('course_instance', 'course_layout') THEN
+        PERFORM refresh_teacher_summaries(instance_ids, NULL);
+    ELSIF TG_TABLE_NAME IN ('employee', 'person') THEN
+        PERFORM refresh_teacher_summaries(NULL, employee_ids);
+    ELSE
+        PERFORM refresh_teacher_summaries(instance_ids, employee_ids);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- ========================================================================
+-- Triggers
+-- ========================================================================
+-- A trigger with transition tables fires for one kind of operation, so
+-- each source table has one per operation, plus one for TRUNCATE.
+-- ========================================================================
+
+DO $$
+DECLARE
+    source TEXT;
+BEGIN
+    FOREACH source IN ARRAY ARRAY[
+        'planned_activity',
+        'employee_course_instance',
+        'teaching_activity',
+        'course_instance',
+        'course_layout',
+        'employee',
+        'person'
+    ] LOOP
+        EXECUTE format(
+            'CREATE TRIGGER trg_%1$s_summary_ai AFTER INSERT ON %1$I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION teacher_summary_sync()',
+            source
+        );
+        EXECUTE format(
+            'CREATE TRIGGER trg_%1$s_summary_au AFTER UPDATE ON %1$I
+             REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION teacher_summary_sync()',
+            source
+        );
+        EXECUTE format(
+            'CREATE TRIGGER trg_%1$s_summary_ad AFTER DELETE ON %1$I
+             REFERENCING OLD TABLE AS old_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION teacher_summary_sync()',
+            source
+        );
+        EXECUTE format(
+            'CREATE TRIGGER trg_%1$s_summary_at AFTER TRUNCATE ON %1$I
+             FOR EACH STATEMENT EXECUTE FUNCTION teacher_summary_sync()',
+            source
+        );
+    END LOOP;
+END;
+$$;
+
+
+-- ========================================================================
+-- Initial contents
+-- ========================================================================
+-- Creating the triggers locked the source tables against writes until
+-- COMMIT, so no change can slip in between this and the triggers.
+-- ========================================================================
+
+SELECT rebuild_teacher_summaries();
+
+COMMIT;
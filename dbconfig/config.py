@@ -4,6 +4,13 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Server settings applied to every session, and the variables setting them
+SESSION_SETTINGS = {
+    "statement_timeout": "DB_STATEMENT_TIMEOUT",
+    "work_mem": "DB_WORK_MEM",
+    "jit": "DB_JIT",
+}
+
 
 def get_db_config():
     return {
@@ -15,6 +22,14 @@ def get_db_config():
     }
 
 
+def get_session_settings():
+    return {
+        name: os.environ[variable]
+        for name, variable in SESSION_SETTINGS.items()
+        if os.getenv(variable)
+    }
+
+
 def load_sql(path):
     with open(path, "r") as f:
         return f.read()
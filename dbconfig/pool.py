@@ -0,0 +1,161 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import psycopg2
+import psycopg2.pool
+
+from dbconfig.config import get_db_config, get_session_settings
+
+# Seconds before the first retry of a failed connect; doubles with each retry
+CONNECT_BACKOFF = 0.5
+# Seconds a pooled connection may sit idle before it is checked on checkout
+HEALTH_CHECK_AFTER = 30.0
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """No pooled connection became free in time"""
+
+
+def session_options(settings):
+    """libpq options string setting each server setting at session start"""
+    # Spaces and backslashes in values must be escaped with a backslash
+    escaped = {
+        name: str(value).replace("\\", "\\\\").replace(" ", "\\ ")
+        for name, value in settings.items()
+    }
+    return " ".join(f"-c {name}={value}" for name, value in escaped.items())
+
+
+def connect(application_name=None, retries=None, **settings):
+    """Connect to the database from dbconfig, retrying with backoff while it is unreachable
+
+    Every session gets the server settings from get_session_settings(),
+    with settings given here taking precedence, and is named
+    application_name in pg_stat_activity (DB_APPLICATION_NAME or the
+    script's name by default). Connecting is retried DB_CONNECT_RETRIES
+    times, 3 by default, before the last error is raised.
+    """
+    if application_name is None:
+        application_name = os.getenv("DB_APPLICATION_NAME") or Path(sys.argv[0]).stem
+    if retries is None:
+        retries = int(os.getenv("DB_CONNECT_RETRIES", 3))
+    options = session_options({**get_session_settings(), **settings})
+
+    for attempt in range(retries + 1):
+        try:
+            return psycopg2.connect(
+                **get_db_config(), application_name=application_name, options=options
+            )
+        except psycopg2.OperationalError:
+            if attempt == retries:
+                raise
+            time.sleep(CONNECT_BACKOFF * 2**attempt)
+
+
+class ConnectionPool:
+    """Thread-safe pool of up to maxconn connections opened with connect()
+
+    minconn connections are opened up front. getconn() hands out an idle
+    connection, opening a new one while fewer than maxconn are in use, and
+    otherwise blocks until one is returned. A connection idle for longer
+    than health_check_after seconds is checked with a round trip first and
+    replaced if the server has dropped it. Connections come back from
+    putconn() rolled back, with their other session state as it was left.
+    """
+
+    def __init__(
+        self,
+        minconn=None,
+        maxconn=None,
+        health_check_after=HEALTH_CHECK_AFTER,
+        application_name=None,
+        **settings,
+    ):
+        self.minconn = int(os.getenv("DB_POOL_MIN", 1)) if minconn is None else minconn
+        self.maxconn = int(os.getenv("DB_POOL_MAX", 4)) if maxconn is None else maxconn
+        self.maxconn = max(self.maxconn, self.minconn, 1)
+        self.health_check_after = health_check_after
+        self.application_name = application_name
+        self.settings = settings
+        self.closed = False
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.maxconn)
+        self.idle = []  # (connection, time.monotonic() when it was returned)
+        try:
+            for _ in range(self.minconn):
+                self.idle.append((self.connect(), time.monotonic()))
+        except psycopg2.Error:
+            self.closeall()
+            raise
+
+    def connect(self):
+        return connect(self.application_name, **self.settings)
+
+    def healthy(self, conn, returned):
+        """Whether an idle connection returned at returned is still usable"""
+        if conn.closed:
+            return False
+        if time.monotonic() - returned < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting at most timeout seconds for one to be free"""
+        if self.closed:
+            raise psycopg2.pool.PoolError("connection pool is closed")
+        if not self.slots.acquire(timeout=timeout):
+            raise PoolTimeout(f"no connection free within {timeout} s")
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    conn, returned = self.idle.pop()
+                if self.healthy(conn, returned):
+                    return conn
+                conn.close()
+            return self.connect()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        """Return a connection from getconn(), closing it if close is true"""
+        if not close and not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+        with self.lock:
+            if close or conn.closed or self.closed:
+                conn.close()
+            else:
+                self.idle.append((conn, time.monotonic()))
+        self.slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Check out a connection for the duration of a with block"""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Close the idle connections; ones still checked out close when returned"""
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            conn.close()
@@ -0,0 +1,126 @@
+"""
+Result cache keys and the in-memory and on-disk result caches
+Run: python -m unittest discover tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the Task 2 scripts to path
+sys.path.append(str(Path(__file__).parent.parent / "2_sql"))
+
+from cache import FileCache, MemoryCache, relations, result_key  # noqa: E402
+
+SQL = "SELECT * FROM planned_activity JOIN employee USING (employee_id)"
+
+
+class ResultKeyTest(unittest.TestCase):
+    def test_same_inputs_same_key(self):
+        version = [["planned_activity", 16861, 3]]
+        self.assertEqual(
+            result_key(SQL, {"year": 2024, "period": "P1"}, version),
+            result_key(SQL, {"period": "P1", "year": 2024}, version),
+        )
+
+    def test_key_changes_with_each_input(self):
+        version = [["planned_activity", 16861, 3]]
+        key = result_key(SQL, {"year": 2024}, version)
+        self.assertNotEqual(key, result_key(SQL + " ", {"year": 2024}, version))
+        self.assertNotEqual(key, result_key(SQL, {"year": 2025}, version))
+        self.assertNotEqual(key, result_key(SQL, {"year": 2024}, [["planned_activity", 16861, 4]]))
+
+    def test_relations(self):
+        self.assertEqual(relations(SQL), ["employee", "planned_activity"])
+
+
+class MemoryCacheTest(unittest.TestCase):
+    def test_put_and_get(self):
+        cache = MemoryCache()
+        cache.put("a", (["x"], [(1,)]), ["person"], cache.generation)
+        self.assertEqual(cache.get("a"), (["x"], [(1,)]))
+        self.assertIsNone(cache.get("b"))
+
+    def test_invalidate_drops_entries_reading_table(self):
+        cache = MemoryCache()
+        cache.put("a", "result a", ["person", "employee"], cache.generation)
+        cache.put("b", "result b", ["course_instance"], cache.generation)
+        generation = cache.generation
+
+        cache.invalidate("employee")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), "result b")
+        self.assertEqual(cache.generation, generation + 1)
+
+    def test_put_after_invalidation_is_dropped(self):
+        cache = MemoryCache()
+        generation = cache.generation
+        # A write is notified while the query runs
+        cache.invalidate("person")
+        cache.put("a", "result a", ["course_instance"], generation)
+        self.assertIsNone(cache.get("a"))
+
+    def test_clear(self):
+        cache = MemoryCache()
+        cache.put("a", "result a", ["person"], cache.generation)
+        generation = cache.generation
+        cache.clear()
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.size, cache.generation), (0, generation + 1))
+
+    def test_evicts_least_recently_used(self):
+        entry = "x" * 1000
+        cache = MemoryCache(max_bytes=2500)
+        cache.put("a", entry, [], cache.generation)
+        cache.put("b", entry, [], cache.generation)
+        cache.get("a")
+        cache.put("c", entry, [], cache.generation)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), entry)
+        self.assertEqual(cache.get("c"), entry)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+    def test_entry_larger_than_cache_is_not_stored(self):
+        cache = MemoryCache(max_bytes=100)
+        cache.put("a", "x" * 1000, [], cache.generation)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.size, 0)
+
+
+class FileCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name) / "cache"
+
+    def test_put_and_get(self):
+        cache = FileCache(self.directory)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", (["x"], [(1,)]))
+        self.assertEqual(cache.get("a"), (["x"], [(1,)]))
+
+    def test_evicts_least_recently_used(self):
+        entry = "x" * 1000
+        cache = FileCache(self.directory, max_bytes=2500)
+        cache.put("a", entry)
+        cache.put("b", entry)
+        # Make a the most recently used, whatever the file system's time resolution
+        os.utime(cache.path("a"), (2_000_000_000, 2_000_000_000))
+        os.utime(cache.path("b"), (1_000_000_000, 1_000_000_000))
+        cache.put("c", entry)
+
+        self.assertFalse(cache.path("b").exists())
+        self.assertEqual(cache.get("a"), entry)
+        self.assertEqual(cache.get("c"), entry)
+
+    def test_entry_larger_than_cache_is_not_stored(self):
+        cache = FileCache(self.directory, max_bytes=100)
+        cache.put("a", "x" * 1000)
+        self.assertIsNone(cache.get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
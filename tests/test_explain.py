@@ -0,0 +1,72 @@
+"""
+Plan comparison of run_queries.py --explain against a saved baseline
+Run: python -m unittest discover tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+# Add the Task 2 scripts to path
+sys.path.append(str(Path(__file__).parent.parent / "2_sql"))
+
+from explain import compare_plans  # noqa: E402
+
+
+def plan(scan="Seq Scan", top="Hash Join", cost=100.0, hit=100, read=0, rows=50):
+    """EXPLAIN JSON plan joining two scanned tables, estimated at 50 rows each"""
+    return {
+        "Plan": {
+            "Node Type": top,
+            "Total Cost": cost,
+            "Shared Hit Blocks": hit,
+            "Shared Read Blocks": read,
+            "Plans": [
+                {
+                    "Node Type": scan,
+                    "Relation Name": "planned_activity",
+                    "Plan Rows": 50,
+                    "Actual Rows": rows,
+                    "Actual Loops": 1,
+                },
+                {"Node Type": "Seq Scan", "Relation Name": "employee"},
+            ],
+        }
+    }
+
+
+class ComparePlansTest(unittest.TestCase):
+    def test_same_plan(self):
+        self.assertEqual(compare_plans(plan(), plan()), ([], []))
+
+    def test_cheaper_plan_is_a_change(self):
+        self.assertEqual(
+            compare_plans(plan(), plan(scan="Index Scan", cost=20.0)),
+            ([], ["planned_activity: Seq Scan -> Index Scan", "cost 100.00 -> 20.00 (0.20x)"]),
+        )
+
+    def test_costlier_plan_is_a_regression(self):
+        self.assertEqual(
+            compare_plans(plan(), plan(top="Nested Loop", cost=400.0)),
+            (["cost 100.00 -> 400.00 (4.00x)"], ["plan nodes: +Nested Loop -Hash Join"]),
+        )
+
+    def test_buffer_growth(self):
+        self.assertEqual(
+            compare_plans(plan(hit=1000), plan(hit=1500, read=500)),
+            (["buffers 1000 -> 2000 (2.0x)"], []),
+        )
+
+    def test_small_buffer_growth_is_noise(self):
+        self.assertEqual(compare_plans(plan(hit=10), plan(hit=50)), ([], []))
+
+    def test_worse_row_estimates(self):
+        self.assertEqual(
+            compare_plans(plan(), plan(rows=5000)),
+            (["row estimates off by up to 100x, from 1x"], []),
+        )
+        self.assertEqual(compare_plans(plan(rows=5000), plan(rows=5000)), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
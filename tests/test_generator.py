@@ -0,0 +1,157 @@
+"""
+Value formatting, statement batching and key allocation of tools/generate_fake_data.py
+Run: python -m unittest discover tests
+"""
+
+import random
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the generator to path
+sys.path.append(str(Path(__file__).parent.parent / "tools"))
+
+from generate_fake_data import (  # noqa: E402
+    COURSE_NUMBERS,
+    PROFILES,
+    Keys,
+    allocate_instance_keys,
+    allocate_layout_keys,
+    format_copy_csv,
+    format_copy_text,
+    iter_multi_row_insert,
+    read_manifest,
+    write_manifest,
+)
+
+PERIODS = ["P1", "P2", "P3", "P4"]
+YEARS = range(2020, 2023)
+
+
+class FormatCopyTextTest(unittest.TestCase):
+    def test_null_and_bool(self):
+        self.assertEqual(format_copy_text(None), "\\N")
+        self.assertEqual(format_copy_text(True), "t")
+        self.assertEqual(format_copy_text(False), "f")
+
+    def test_escapes_special_characters(self):
+        self.assertEqual(format_copy_text("a\tb\nc\rd\\e"), "a\\tb\\nc\\rd\\\\e")
+
+    def test_plain_values(self):
+        self.assertEqual(format_copy_text(42), "42")
+        self.assertEqual(format_copy_text("O'Brien"), "O'Brien")
+
+
+class FormatCopyCsvTest(unittest.TestCase):
+    def test_null_and_empty_string_differ(self):
+        self.assertEqual(format_copy_csv(None), "")
+        self.assertEqual(format_copy_csv(""), '""')
+
+    def test_quotes_special_characters(self):
+        self.assertEqual(format_copy_csv("a,b"), '"a,b"')
+        self.assertEqual(format_copy_csv('say "hi"'), '"say ""hi"""')
+        self.assertEqual(format_copy_csv("a\nb"), '"a\nb"')
+        self.assertEqual(format_copy_csv("a\rb"), '"a\rb"')
+
+    def test_quotes_end_of_data_marker(self):
+        self.assertEqual(format_copy_csv("\\."), '"\\."')
+
+    def test_plain_values(self):
+        self.assertEqual(format_copy_csv(True), "t")
+        self.assertEqual(format_copy_csv(3.5), "3.5")
+        self.assertEqual(format_copy_csv("plain"), "plain")
+
+
+class IterMultiRowInsertTest(unittest.TestCase):
+    def statements(self, rows, **kwargs):
+        return "".join(iter_multi_row_insert("t", ["a", "b"], rows, **kwargs)).split(";")
+
+    def test_one_statement_without_batch_rows(self):
+        rows = [[i, f"v{i}"] for i in range(5)]
+        statements = self.statements(rows, chunk_rows=2)
+        self.assertEqual(statements[-1], "")
+        self.assertEqual(len(statements[:-1]), 1)
+        self.assertEqual(statements[0].count("\n("), 5)
+
+    def test_batches_of_batch_rows(self):
+        rows = [[i, None] for i in range(7)]
+        statements = self.statements(rows, chunk_rows=2, batch_rows=3)[:-1]
+        self.assertEqual([s.count("\n(") for s in statements], [3, 3, 1])
+        for statement in statements:
+            self.assertTrue(statement.lstrip("\n").startswith("INSERT INTO t (a, b) VALUES\n"))
+
+    def test_values_are_formatted(self):
+        sql = "".join(iter_multi_row_insert("t", ["a", "b"], [[1, "O'Brien"], [None, True]]))
+        self.assertEqual(sql, "INSERT INTO t (a, b) VALUES\n(1, 'O''Brien'),\n(NULL, TRUE);")
+
+    def test_no_rows(self):
+        self.assertEqual(list(iter_multi_row_insert("t", ["a"], [], batch_rows=2)), [])
+
+
+class AllocateLayoutKeysTest(unittest.TestCase):
+    def test_keys_are_distinct(self):
+        keys = allocate_layout_keys(random.Random(1), 2000, ["CS"])
+        self.assertEqual(len(keys), 2000)
+        self.assertEqual(len(set(keys)), 2000)
+
+    def test_versions_start_once_codes_run_out(self):
+        codes = len(COURSE_NUMBERS)
+        keys = allocate_layout_keys(random.Random(1), codes + 10, ["CS"])
+        versions = [version for _, version in keys]
+        self.assertEqual(versions.count(1), codes)
+        self.assertEqual(versions.count(2), 10)
+
+
+class AllocateInstanceKeysTest(unittest.TestCase):
+    def setUp(self):
+        self.layouts = [(f"CS{number}", 1) for number in range(100, 110)]
+        self.space = len(self.layouts) * len(PERIODS) * len(YEARS)
+
+    def test_keys_are_distinct(self):
+        for profile in PROFILES.values():
+            with self.subTest(profile=profile.name):
+                years = range(2020, 2031)
+                keys = allocate_instance_keys(
+                    random.Random(1), 200, self.layouts, PERIODS, years, profile
+                )
+                self.assertEqual(len(keys), 200)
+                self.assertEqual(len({key[0] for key in keys}), 200)
+
+    def test_whole_key_space(self):
+        keys = allocate_instance_keys(random.Random(1), self.space, self.layouts, PERIODS, YEARS)
+        self.assertEqual(len({key[0] for key in keys}), self.space)
+
+    def test_overflow(self):
+        with self.assertRaises(ValueError):
+            allocate_instance_keys(random.Random(1), self.space + 1, self.layouts, PERIODS, YEARS)
+
+    def test_excluded_keys_are_skipped(self):
+        taken = allocate_instance_keys(random.Random(1), 100, self.layouts, PERIODS, YEARS)
+        exclude = {key[0] for key in taken}
+        keys = allocate_instance_keys(
+            random.Random(2), self.space - 100, self.layouts, PERIODS, YEARS, exclude=exclude
+        )
+        self.assertFalse(exclude & {key[0] for key in keys})
+        with self.assertRaises(ValueError):
+            allocate_instance_keys(
+                random.Random(2), self.space - 99, self.layouts, PERIODS, YEARS, exclude=exclude
+            )
+
+
+class StudyYearsTest(unittest.TestCase):
+    def test_latest_year_is_the_current_year(self):
+        weights = PROFILES["current-year"].year_weights_for(range(2020, 2025))
+        self.assertEqual(weights[-1], 0.4)
+        self.assertAlmostEqual(sum(weights), 1.0)
+
+    def test_manifest_records_years(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "manifest.json"
+            keys = Keys(course_layouts=[("CS100", 1)], study_periods=PERIODS)
+            write_manifest(path, keys, YEARS)
+            self.assertEqual(read_manifest(path), (keys, YEARS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Query routing against a disposable copy of the database, with the Task 2 views installed
+Run: TEST_DB_NAME=university_test python -m unittest discover tests
+
+The test commits writes, which it reverts, and installs the indexes and
+status table of run_queries.py refresh, so it only runs against the
+database named by TEST_DB_NAME, on the server from dbconfig. Create one
+with: CREATE DATABASE university_test TEMPLATE university
+"""
+
+import os
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# Add the repository root and the Task 2 scripts to path
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "2_sql"))
+
+import psycopg2  # noqa: E402
+
+import run_queries  # noqa: E402
+from dbconfig.config import get_db_config  # noqa: E402
+from dbconfig.pool import connect  # noqa: E402
+from refresh import MATERIALIZED_VIEWS, refresh_views, setup, view_staleness  # noqa: E402
+
+
+# Database the test may write to
+TEST_DB_NAME = os.getenv("TEST_DB_NAME")
+
+
+@unittest.skipUnless(TEST_DB_NAME, "set TEST_DB_NAME to a disposable copy of the database")
+class RouteAfterRefreshTest(unittest.TestCase):
+    def setUp(self):
+        if TEST_DB_NAME == get_db_config()["dbname"]:
+            self.skipTest(f"TEST_DB_NAME is the configured database {TEST_DB_NAME}")
+        environment = mock.patch.dict(os.environ, {"DB_NAME": TEST_DB_NAME})
+        environment.start()
+        self.addCleanup(environment.stop)
+        try:
+            self.conn = connect("test_routing", retries=0)
+        except psycopg2.OperationalError as e:
+            self.skipTest(f"database unreachable: {e}")
+        self.addCleanup(self.conn.close)
+
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", (MATERIALIZED_VIEWS[-1],))
+            installed = cursor.fetchone()[0] is not None
+        self.conn.rollback()
+        if not installed:
+            self.skipTest("task2_views.sql is not installed")
+
+    def set_planned_hours(self, key, hours):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE planned_activity SET planned_hours = %s
+                WHERE instance_id = %s AND employee_id = %s AND activity_name = %s
+                """,
+                (hours, *key),
+            )
+        self.conn.commit()
+
+    def test_fresh_views_route_optimized(self):
+        setup(self.conn)
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT instance_id, employee_id, activity_name, planned_hours
+                FROM planned_activity LIMIT 1
+                """
+            )
+            *key, hours = cursor.fetchone()
+        self.conn.rollback()
+        # Put the row back even if an assertion fails halfway
+        self.addCleanup(self.set_planned_hours, key, hours)
+
+        # Change a row and change it back, refreshing in between, so the last
+        # refresh writes to the views and leaves the data as it was
+        self.set_planned_hours(key, hours + 1)
+        refresh_views(self.conn)
+        self.set_planned_hours(key, hours)
+        refresh_views(self.conn)
+
+        again = refresh_views(self.conn)
+        self.assertEqual([result["reason"] for result in again], ["up to date"] * len(again))
+        self.assertEqual(view_staleness(self.conn), dict.fromkeys(MATERIALIZED_VIEWS, 0))
+
+        queries = run_queries.load_queries()
+        selected = [queries[num] for num in sorted(queries)]
+        routed = run_queries.route_queries(self.conn, selected, "auto", max_staleness=0)
+        for query, route in zip(selected, routed):
+            if "optimized" in query["variants"]:
+                self.assertTrue(route["name"].endswith("[route optimized, views current]"))
+                self.assertEqual(route["file"], query["variants"]["optimized"]["file"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+Query text handling of run_queries.py: prepared statement parameters and COPY nesting
+Run: python -m unittest discover tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+# Add the repository root and the Task 2 scripts to path
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "2_sql"))
+
+from run_queries import copy_query, to_positional  # noqa: E402
+
+
+class ToPositionalTest(unittest.TestCase):
+    def test_numbers_parameters_in_order_of_first_use(self):
+        sql, names = to_positional(
+            "SELECT * FROM t WHERE year = %(year)s AND period = %(period)s OR year > %(year)s"
+        )
+        self.assertEqual(sql, "SELECT * FROM t WHERE year = $1 AND period = $2 OR year > $1")
+        self.assertEqual(names, ["year", "period"])
+
+    def test_without_parameters(self):
+        self.assertEqual(to_positional("SELECT 1"), ("SELECT 1", []))
+
+
+class CopyQueryTest(unittest.TestCase):
+    def test_strips_semicolon(self):
+        self.assertEqual(copy_query("SELECT 1;\n"), "SELECT 1")
+
+    def test_strips_trailing_comments(self):
+        sql = "SELECT 1; -- not this\n/* nor\n this */\n-- nor this\n"
+        self.assertEqual(copy_query(sql), "SELECT 1")
+
+    def test_keeps_leading_and_inner_comments(self):
+        sql = "-- header\nSELECT 1 -- one\nFROM t;"
+        self.assertEqual(copy_query(sql), "-- header\nSELECT 1 -- one\nFROM t")
+
+
+if __name__ == "__main__":
+    unittest.main()
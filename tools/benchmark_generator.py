@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark fake data generation throughput for each generation mode.
+
+Generates every table at each requested size and reports rows per second,
+without formatting or writing the rows, so the numbers compare the cost of
+producing the data itself. Each mode's speedup is relative to the sequential
+run at the same size, when that mode is benchmarked too.
+
+Usage: python benchmark_generator.py [-n 10000 100000 1000000] [--modes sequential sharded pooled]
+"""
+
+import argparse
+import time
+from contextlib import ExitStack
+
+from generate_fake_data import ShardPool, generate_tables
+
+MODES = ['sequential', 'sharded', 'pooled']
+
+# Key space wide enough for the course instances of 1M+ records
+COURSE_PREFIXES = ['CS', 'MA', 'PH', 'EE', 'SE']
+STUDY_YEARS = range(2000, 2100)
+
+
+def run(num_records: int, mode: str, seed: int, workers: int) -> tuple[int, float]:
+    """Generate all tables once and return (rows, seconds)."""
+    start = time.perf_counter()
+    rows = 0
+    with ExitStack() as stack:
+        shards = None
+        if mode != 'sequential':
+            shards = stack.enter_context(ShardPool(workers, seed, pooled=mode == 'pooled'))
+        for table in generate_tables(num_records, seed, shards, COURSE_PREFIXES, STUDY_YEARS):
+            rows += sum(1 for _ in table.rows)
+    return rows, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fake data generation')
+    parser.add_argument(
+        '-n', '--num-records',
+        type=int,
+        nargs='+',
+        default=[10_000, 100_000, 1_000_000],
+        help='Record counts to benchmark (default: 10000 100000 1000000)'
+    )
+    parser.add_argument(
+        '--modes',
+        choices=MODES,
+        nargs='+',
+        default=MODES,
+        help=f'Generation modes to compare (default: {" ".join(MODES)})'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=1,
+        help='Worker processes for the sharded and pooled modes (default: 1)'
+    )
+    parser.add_argument(
+        '-s', '--seed',
+        type=int,
+        default=42,
+        help='Random seed (default: 42)'
+    )
+
+    args = parser.parse_args()
+
+    print(f"{'records':>10}  {'mode':<10}  {'rows':>10}  {'seconds':>8}  {'rows/s':>10}  {'speedup':>7}")
+    for num_records in args.num_records:
+        sequential = None
+        # The sequential baseline runs first, so the other modes can be compared with it
+        for mode in sorted(args.modes, key=MODES.index):
+            rows, elapsed = run(num_records, mode, args.seed, args.workers)
+            if mode == 'sequential':
+                sequential = elapsed
+            speedup = f"{sequential / elapsed:.2f}x" if sequential else '-'
+            print(f"{num_records:>10}  {mode:<10}  {rows:>10}  {elapsed:>8.2f}  {rows / elapsed:>10,.0f}  "
+                  f"{speedup:>7}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
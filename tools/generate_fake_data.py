@@ -1,14 +1,205 @@
 #!/usr/bin/env python3
 """
-Generate fake data for the database schema defined in create.sql.
-Uses the Faker library to create realistic test data.
+Generate fake data for the database schema defined in create.sql, or with
+--schema v2 in create_v2.sql. Uses the Faker library to create realistic test data.
+
+Rows are produced lazily, one table at a time, and written to the output in
+bounded chunks so memory stays flat as the number of records grows. With
+--load the rows are streamed straight into the database with COPY instead.
+
+With --append only new course instances, their planned activities and
+assignments are generated against the keys already in the database (or in a
+--manifest written by an earlier run), optionally followed by UPDATE/DELETE
+churn, for benchmarking incremental refreshes.
 """
 
 import argparse
+import json
+import math
+import multiprocessing
 import random
+import sys
+import time
+import unicodedata
+from collections import deque
+from collections.abc import Iterable, Iterator, Sequence
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass, field, replace
+from datetime import date, timedelta
+from itertools import batched, groupby, islice
+from operator import itemgetter
 from pathlib import Path
+from typing import TextIO
+
 from faker import Faker
 
+# Add parent directory to path to import dbconfig
+sys.path.append(str(Path(__file__).parent.parent))
+
+# Number of rows formatted and flushed to the output at a time
+CHUNK_ROWS = 1000
+
+# Rows per shard when large tables are generated in worker processes. Shard
+# boundaries are fixed so the output does not depend on the number of workers
+SHARD_ROWS = 10_000
+
+# Number of values drawn for each Faker value pool in pooled mode
+POOL_SIZE = 10_000
+
+# Output formats: multi-row INSERT statements, or COPY ... FROM STDIN blocks
+# with text or CSV data (COPY scripts must be loaded with psql -f)
+OUTPUT_FORMATS = ['insert', 'copy', 'copy-csv']
+
+# Backslash escapes for special characters in COPY text format
+COPY_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+# Default key space for course codes (prefix + 3 digits) and course
+# instances (course code + study period + 2-digit year), which must fit
+# course_code VARCHAR(6) and instance_id VARCHAR(9). Study years are a
+# fixed six, not relative to today, so a seed gives the same data on any
+# day; the skewed profiles weight the latest of them as the current year
+COURSE_PREFIXES = ('CS',)
+COURSE_NUMBERS = range(100, 1000)
+STUDY_YEARS = range(2021, 2027)
+
+STUDY_PERIODS = [
+    ('P1', 'Period 1 (Sep-Oct)'),
+    ('P2', 'Period 2 (Nov-Jan)'),
+    ('P3', 'Period 3 (Jan-Mar)'),
+    ('P4', 'Period 4 (Mar-Jun)'),
+    ('H1', 'First half (Sep-Jan)'),
+    ('H2', 'Second half (Jan-Jun)'),
+    ('HT', 'Autumn term'),
+    ('VT', 'Spring term'),
+]
+
+# Tables in reverse dependency order, as cleared before loading
+TRUNCATE_ORDER = [
+    'teacher_period_limit',
+    'employee_course_instance',
+    'planned_activity',
+    'course_instance',
+    'employee',
+    'department',
+    'teaching_activity',
+    'person',
+    'job_title',
+    'study_period',
+    'course_layout',
+]
+
+# Schema versions under 1_logical_and_physical_model/db, with the tables each
+# one clears before loading. v2 adds salary_history, which depends on employee
+SCHEMAS = {
+    'v1': TRUNCATE_ORDER,
+    'v2': [table for name in TRUNCATE_ORDER
+           for table in (['salary_history', name] if name == 'employee' else [name])],
+}
+
+# Teaching activity factors from the v2 requirements, where factor is DECIMAL
+V2_ACTIVITY_FACTORS = {'Lecture': 3.6, 'Lab': 2.4, 'Tutorial': 2.4, 'Seminar': 1.8}
+
+
+@dataclass
+class Table:
+    """A table to populate, with its rows produced lazily in insert order."""
+    name: str
+    columns: list[str]
+    rows: Iterator[list]
+    label: str
+    count: int | None = None  # Known row count, None if only known once generated
+    # Statements run just before and after loading the rows
+    before: list[str] = field(default_factory=list)
+    after: list[str] = field(default_factory=list)
+
+
+@dataclass
+class Keys:
+    """Keys of generated or existing rows that new rows can reference."""
+    course_layouts: list[tuple[str, int]] = field(default_factory=list)
+    study_periods: list[str] = field(default_factory=list)
+    employee_ids: list[int] = field(default_factory=list)
+    teaching_activities: list[str] = field(default_factory=list)
+    course_instances: list[str] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class DistributionProfile:
+    """How course instances and assignments are spread over periods, years and teachers."""
+    name: str
+    description: str
+    teacher_zipf: float | None = None  # Zipf exponent of teacher popularity, None for uniform
+    current_year_share: float | None = None  # Share of instances in the latest year, None for uniform
+    period_weights: dict[str, float] | None = None  # Relative weight per study period, 1 if not listed
+
+    def skews_instances(self) -> bool:
+        return self.current_year_share is not None or self.period_weights is not None
+
+    def period_weights_for(self, study_periods: Sequence[str]) -> list[float]:
+        """Relative weight of each study period."""
+        weights = self.period_weights or {}
+        return [weights.get(period, 1.0) for period in study_periods]
+
+    def year_weights_for(self, years: range) -> list[float]:
+        """Relative weight of each study year, the latest standing for the current year."""
+        if self.current_year_share is None or len(years) == 1:
+            return [1.0] * len(years)
+
+        other_share = (1 - self.current_year_share) / (len(years) - 1)
+        return [other_share] * (len(years) - 1) + [self.current_year_share]
+
+
+PROFILES = {profile.name: profile for profile in [
+    DistributionProfile('uniform', 'Teachers, study periods and years drawn uniformly'),
+    DistributionProfile('zipf-teachers', 'Zipf-distributed teacher popularity', teacher_zipf=1.1),
+    DistributionProfile('current-year', '40% of course instances in the latest study year',
+                        current_year_share=0.4),
+    DistributionProfile('p1p2-heavy', 'P1 and P2 four times as likely as other periods',
+                        period_weights={'P1': 4.0, 'P2': 4.0}),
+    DistributionProfile('hotspot', 'Zipf teachers, 40% of instances in the latest study year, P1/P2 heavy',
+                        teacher_zipf=1.1, current_year_share=0.4, period_weights={'P1': 4.0, 'P2': 4.0}),
+]}
+
+
+class ZipfSampler:
+    """
+    Draws employee IDs 1..n with Zipf-distributed popularity.
+
+    Popularity ranks are mapped to IDs through a seeded affine permutation, so
+    the hot teachers are spread over the ID range without storing any table.
+    """
+
+    def __init__(self, n: int, exponent: float, seed: int):
+        rng = random.Random(f"{seed}:zipf")
+        self.n = n
+        self.exponent = exponent
+        self.step = 1
+        while n > 1:
+            self.step = rng.randrange(1, n)
+            if math.gcd(self.step, n) == 1:
+                break
+        self.offset = rng.randrange(n)
+
+    def draw(self, rng: random.Random) -> int:
+        # Inverse CDF of the continuous power law on [1, n + 1)
+        u = rng.random()
+        if self.exponent == 1:
+            x = (self.n + 1) ** u
+        else:
+            e = 1 - self.exponent
+            x = (1 + u * ((self.n + 1) ** e - 1)) ** (1 / e)
+        rank = min(int(x), self.n) - 1
+        return (rank * self.step + self.offset) % self.n + 1
+
+    def sample(self, rng: random.Random, k: int) -> list[int]:
+        """Draw k distinct employee IDs."""
+        chosen = []
+        while len(chosen) < min(k, self.n):
+            employee_id = self.draw(rng)
+            if employee_id not in chosen:
+                chosen.append(employee_id)
+        return chosen
+
 
 def format_value(val) -> str:
     """Format a single value for SQL."""
@@ -24,120 +215,751 @@ def format_value(val) -> str:
         return f"'{escaped}'"
 
 
+def iter_multi_row_insert(table_name: str, columns: list[str], rows: Iterable[list],
+                          chunk_rows: int = CHUNK_ROWS, batch_rows: int | None = None) -> Iterator[str]:
+    """
+    Yield multi-row SQL INSERT statements in pieces of at most chunk_rows rows.
+
+    Each statement holds at most batch_rows rows, or every row when batch_rows
+    is None. Nothing is yielded when there are no rows.
+    """
+    prefix = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES\n"
+    rows = iter(rows)
+    statements = 0
+    while True:
+        statement_rows = islice(rows, batch_rows) if batch_rows else rows
+        started = False
+        for chunk in batched(statement_rows, chunk_rows):
+            values_str = ',\n'.join(f"({', '.join(format_value(val) for val in row)})" for row in chunk)
+            if not started and statements:
+                yield '\n'
+            yield (',\n' if started else prefix) + values_str
+            started = True
+        if not started:
+            break
+        yield ';'
+        statements += 1
+        if not batch_rows:
+            break
+
+
+def format_copy_text(val) -> str:
+    """Format a single value for COPY text format."""
+    if val is None:
+        return '\\N'
+    elif isinstance(val, bool):
+        return 't' if val else 'f'
+    else:
+        return str(val).translate(COPY_TEXT_ESCAPES)
+
+
+def format_copy_csv(val) -> str:
+    """Format a single value for COPY CSV format."""
+    if val is None:
+        return ''
+    elif isinstance(val, bool):
+        return 't' if val else 'f'
+
+    text = str(val)
+    # Quote empty strings so they are not read back as NULL, and the
+    # end-of-data marker so it is not taken as the end of the block
+    if text in ('', '\\.') or any(c in text for c in ',"\n\r'):
+        escaped = text.replace('"', '""')
+        return f'"{escaped}"'
+    return text
+
+
+def iter_copy_data(rows: Iterable[list], csv: bool = False,
+                   chunk_rows: int = CHUNK_ROWS) -> Iterator[str]:
+    """Yield COPY data lines for rows in pieces of at most chunk_rows rows."""
+    if csv:
+        format_copy_value, delimiter = format_copy_csv, ','
+    else:
+        format_copy_value, delimiter = format_copy_text, '\t'
+
+    for chunk in batched(rows, chunk_rows):
+        yield ''.join(delimiter.join(format_copy_value(val) for val in row) + '\n' for row in chunk)
+
+
+def copy_statement(table_name: str, columns: list[str], csv: bool = False) -> str:
+    """Build the COPY ... FROM STDIN statement for a table."""
+    options = ' WITH (FORMAT csv)' if csv else ''
+    return f"COPY {table_name} ({', '.join(columns)}) FROM STDIN{options}"
+
+
+def iter_copy(table_name: str, columns: list[str], rows: Iterable[list], csv: bool = False,
+              chunk_rows: int = CHUNK_ROWS) -> Iterator[str]:
+    """
+    Yield a COPY ... FROM STDIN block with inline data, terminated by \\.
+
+    Nothing is yielded when there are no rows.
+    """
+    started = False
+    for data in iter_copy_data(rows, csv, chunk_rows):
+        if not started:
+            yield copy_statement(table_name, columns, csv) + ';\n'
+            started = True
+        yield data
+    if started:
+        yield '\\.'
+
+
+class ChunkReader:
+    """Read-only file-like object over an iterator of text chunks, for copy_expert."""
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
 def generate_multi_row_insert(table_name: str, columns: list[str], rows: list[list]) -> str:
     """Generate a SQL INSERT statement with multiple rows."""
-    if not rows:
-        return ""
+    return ''.join(iter_multi_row_insert(table_name, columns, rows))
+
+
+SALARY_RANGES = {
+    'Professor': (70000, 90000),
+    'Associate Professor': (60000, 75000),
+    'Assistant Professor': (50000, 65000),
+    'Senior Lecturer': (55000, 70000),
+    'Lecturer': (45000, 60000),
+    'Teaching Assistant': (30000, 40000),
+    'Lab Assistant': (25000, 35000),
+    'Research Assistant': (35000, 45000),
+    'Administrative Staff': (35000, 50000),
+    'Department Head': (75000, 95000)
+}
+
 
-    values_list = []
-    for row in rows:
-        formatted_values = [format_value(val) for val in row]
-        values_list.append(f"({', '.join(formatted_values)})")
+def person_row(fake: Faker, i: int) -> list:
+    """Generate the row for the i-th person."""
+    # Swedish personnummer format: YYYYMMDDXXXX (12 characters)
+    # YYYYMMDD is full birth date, XXXX is a 4-digit serial number
+    # Stored as VARCHAR to properly represent this identifier
+    birth_date = fake.date_of_birth(minimum_age=22, maximum_age=70)
+    date_part = birth_date.strftime('%Y%m%d')  # YYYYMMDD (full year)
+    personal_number = f"{date_part}{i+1:04d}"  # e.g., '196203150001'
+    first_name = fake.first_name()
+    last_name = fake.last_name()
+    phone_number = fake.numerify('07########')  # Swedish mobile format
+    address = fake.street_address()[:100]
+    email = fake.email()
 
-    column_str = ', '.join(columns)
-    values_str = ',\n'.join(values_list)
+    return [personal_number, first_name, last_name, phone_number, address, email]
 
-    return f"INSERT INTO {table_name} ({column_str}) VALUES\n{values_str};"
 
+def employee_row(fake: Faker, rng: random.Random, i: int, personal_number: str,
+                 job_titles: list[str], department_names: list[str]) -> list:
+    """Generate the row for the i-th employee, who is the person with personal_number."""
+    employee_id = i + 1
+    job_title = rng.choice(job_titles)
 
-def generate_fake_data(num_records: int = 50, seed: int = 42) -> str:
+    # Generate skill set based on job title
+    skills = []
+    if 'Professor' in job_title or 'Lecturer' in job_title:
+        skills = [fake.catch_phrase() for _ in range(rng.randint(2, 5))]
+    skill_set = ', '.join(skills)[:500] if skills else None
+
+    # Salary based on job title
+    min_sal, max_sal = SALARY_RANGES.get(job_title, (30000, 60000))
+    salary = rng.randint(min_sal, max_sal)
+
+    department_name = rng.choice(department_names)
+
+    # manager_id should be employee_id of a manager or NULL
+    # For simplicity, 30% chance of having a manager (references earlier employee)
+    if i > 0 and rng.random() < 0.3:
+        manager_id = rng.randint(1, i)  # Reference an existing employee
+    else:
+        manager_id = None
+
+    return [employee_id, personal_number, job_title, skill_set, salary,
+            department_name, manager_id]
+
+
+def course_layout_count(num_records: int) -> int:
+    """Number of course layouts generated for num_records records."""
+    return max(10, num_records // 5)
+
+
+def course_instance_count(num_records: int) -> int:
+    """Number of course instances generated for num_records records."""
+    return max(20, num_records // 2)
+
+
+def course_codes(course_prefixes: Sequence[str]) -> list[str]:
+    """All course codes available for the given two-letter prefixes."""
+    return [f"{prefix}{number}" for prefix in course_prefixes for number in COURSE_NUMBERS]
+
+
+def check_key_space(num_records: int, course_prefixes: Sequence[str], years: range,
+                    profile: DistributionProfile = PROFILES['uniform']):
+    """Raise ValueError if the course instances for num_records do not fit the key space."""
+    codes = min(course_layout_count(num_records), len(course_codes(course_prefixes)))
+    periods = sum(1 for weight in profile.period_weights_for([code for code, _ in STUDY_PERIODS]) if weight > 0)
+    years_used = sum(1 for weight in profile.year_weights_for(years) if weight > 0)
+    space = codes * periods * years_used
+    count = course_instance_count(num_records)
+    if count > space:
+        raise ValueError(
+            f"Cannot generate {count} unique course instances from {codes} course codes x "
+            f"{periods} study periods x {years_used} years ({space} keys). "
+            f"Add course prefixes or years to widen the key space."
+        )
+
+
+def allocate_layout_keys(rng: random.Random, count: int,
+                         course_prefixes: Sequence[str]) -> list[tuple[str, int]]:
     """
-    Generate fake data for all tables in the database.
+    Draw count distinct (course_code, layout_version) keys without replacement.
+
+    Every course code gets a version 1 layout before any code gets a second
+    version, so catalogs larger than the code space become new layout
+    versions of existing courses.
+    """
+    codes = course_codes(course_prefixes)
+    rounds, remainder = divmod(count, len(codes))
+
+    keys = []
+    for version in range(1, rounds + 1):
+        keys.extend((code, version) for code in rng.sample(codes, len(codes)))
+    keys.extend((code, rounds + 1) for code in rng.sample(codes, remainder))
+    return keys
+
+
+def spread_counts(count: int, weights: list[float], capacity: int) -> list[int]:
+    """
+    Split count over cells in proportion to weights, with at most capacity per cell.
+
+    Raises ValueError if the cells with a positive weight cannot hold count.
+    """
+    counts = [0] * len(weights)
+    remaining = count
+    open_cells = [i for i, weight in enumerate(weights) if weight > 0]
+    while remaining and open_cells:
+        # Largest remainder rounding of each open cell's share of what is left
+        total = sum(weights[i] for i in open_cells)
+        shares = {i: remaining * weights[i] / total for i in open_cells}
+        portions = {i: int(share) for i, share in shares.items()}
+        leftover = remaining - sum(portions.values())
+        for i in sorted(open_cells, key=lambda i: portions[i] - shares[i])[:leftover]:
+            portions[i] += 1
+
+        for i in open_cells:
+            added = min(portions[i], capacity - counts[i])
+            counts[i] += added
+            remaining -= added
+        open_cells = [i for i in open_cells if counts[i] < capacity]
+
+    if remaining:
+        raise ValueError(f"Cannot spread {count} keys over {len(open_cells)} cells of {capacity}")
+    return counts
+
+
+def allocate_instance_keys(rng: random.Random, count: int, course_layouts: list[tuple[str, int]],
+                           study_periods: list[str], years: range,
+                           profile: DistributionProfile = PROFILES['uniform'],
+                           exclude: set[str] = frozenset()) -> list[tuple]:
+    """
+    Draw count distinct (instance_id, course_code, layout_version, study_period, study_year)
+    keys without replacement, in O(count).
+
+    Keys are spread uniformly over the key space unless the profile weights
+    study periods or years, in which case each (period, year) cell gets its
+    weighted share of the keys.
+
+    Instance IDs in exclude are skipped, for appending to existing data.
+
+    Raises ValueError if count exceeds course codes x study periods x years,
+    less the excluded keys.
+    """
+    # Each course instance uses one of its course code's layout versions
+    max_versions = {}
+    for course_code, layout_version in course_layouts:
+        max_versions[course_code] = max(layout_version, max_versions.get(course_code, 0))
+    codes = list(max_versions)
+
+    per_code = len(study_periods) * len(years)
+    space = len(codes) * per_code
+    wanted = count
+    # Draw enough extra keys that count remain once excluded ones are dropped
+    count = min(space, count + len(exclude))
+    if wanted > space:
+        raise ValueError(
+            f"Cannot generate {wanted} unique course instances from {len(codes)} course codes x "
+            f"{len(study_periods)} study periods x {len(years)} years ({space} keys). "
+            f"Add course prefixes or years to widen the key space."
+        )
+
+    if profile.skews_instances():
+        period_weights = profile.period_weights_for(study_periods)
+        year_weights = profile.year_weights_for(years)
+        cells = [(p, y) for p in range(len(study_periods)) for y in range(len(years))]
+        counts = spread_counts(count, [period_weights[p] * year_weights[y] for p, y in cells], len(codes))
+        picks = [(code_index, p, y) for (p, y), cell_count in zip(cells, counts)
+                 for code_index in rng.sample(range(len(codes)), cell_count)]
+        rng.shuffle(picks)
+    else:
+        picks = []
+        for index in rng.sample(range(space), count):
+            code_index, rest = divmod(index, per_code)
+            picks.append((code_index, *divmod(rest, len(years))))
+
+    keys = []
+    for code_index, period_index, year_index in picks:
+        course_code = codes[code_index]
+        study_period = study_periods[period_index]
+        study_year = years[year_index]
+        layout_version = rng.randint(1, max_versions[course_code])
+
+        # Instance ID format: CODECODEYY (e.g., CS101P124)
+        instance_id = f"{course_code}{study_period}{str(study_year)[-2:]}"
+        if instance_id in exclude:
+            continue
+        keys.append((instance_id, course_code, layout_version, study_period, study_year))
+        if len(keys) == wanted:
+            break
+
+    if len(keys) < wanted:
+        raise ValueError(f"Only {len(keys)} of {wanted} course instance keys are still unused")
+    return keys
+
+
+def course_instance_row(rng: random.Random, key: tuple) -> list:
+    """Generate the course_instance row for a key from allocate_instance_keys()."""
+    instance_id, course_code, layout_version, study_period, study_year = key
+
+    # Get course layout to determine student limits
+    num_students = rng.randint(10, 45)
+
+    return [instance_id, course_code, layout_version, num_students,
+            study_period, study_year]
+
+
+def instance_planned_activities(rng: random.Random, instance_id: str, teaching_activities: list[str],
+                                teachers: Sequence[int] | None = None) -> list[list]:
+    """
+    Generate the planned_activity rows for one course instance.
+
+    With teachers, each activity is planned for one of the teachers assigned
+    to the instance and the rows include its employee_id, as in the v2 schema.
+    """
+    # Generate 2-4 unique activities per course instance
+    num_activities = rng.randint(2, 4)
+    selected_activities = rng.sample(teaching_activities, min(num_activities, len(teaching_activities)))
+
+    if teachers is not None:
+        # Composite PK: (instance_id, employee_id, activity_name)
+        return [[instance_id, rng.choice(teachers), activity_name, rng.randint(10, 80)]
+                for activity_name in selected_activities]
+
+    # Composite PK: (instance_id, activity_name)
+    return [[instance_id, activity_name, rng.randint(10, 80)] for activity_name in selected_activities]
+
+
+def instance_assignments(rng: random.Random, instance_id: str, employee_ids: Sequence[int],
+                         popularity: ZipfSampler | None = None) -> list[list]:
+    """
+    Generate the employee_course_instance rows for one course instance.
+
+    Teachers are drawn uniformly, or by popularity when a sampler over
+    len(employee_ids) teachers is given.
+    """
+    # Assign 1-3 employees to each course instance
+    num_employees = rng.randint(1, 3)
+    if popularity is not None:
+        assigned_employees = [employee_ids[i - 1] for i in popularity.sample(rng, num_employees)]
+    else:
+        assigned_employees = rng.sample(employee_ids, min(num_employees, len(employee_ids)))
+
+    # Composite PK: (instance_id, employee_id)
+    return [[instance_id, emp_id] for emp_id in assigned_employees]
+
+
+def record_assignments(rows: Iterable[list], assignments: list[tuple[str, tuple[int, ...]]]) -> Iterator[list]:
+    """
+    Pass employee_course_instance rows through, recording each instance's teachers.
+
+    Rows must be grouped by instance, as instance_assignments() produces them.
+    """
+    for instance_id, group in groupby(rows, key=itemgetter(0)):
+        group = list(group)
+        assignments.append((instance_id, tuple(emp_id for _, emp_id in group)))
+        yield from group
+
+
+def salary_history_rows(rng: random.Random, employee_id: int, current_salary: int,
+                        latest_start: date) -> list[list]:
+    """
+    Generate a non-overlapping salary history that ends in current_salary.
+
+    The open-ended current salary starts within the year up to latest_start.
+    Each earlier salary is a few percent lower and valid for one to three
+    years, up to the day before the next one starts.
+    """
+    valid_from = latest_start - timedelta(days=rng.randint(0, 364))
+    rows = [[employee_id, current_salary, valid_from, None]]
+    salary = current_salary
+    for _ in range(rng.randint(0, 3)):
+        valid_to = valid_from - timedelta(days=1)
+        valid_from = valid_to - timedelta(days=rng.randint(365, 3 * 365))
+        salary = max(1, round(salary / (1 + rng.uniform(0.02, 0.08))))
+        rows.append([employee_id, salary, valid_from, valid_to])
+    rows.reverse()
+    return rows
+
+
+def shard_seed(seed: int, table_name: str, index: int) -> int:
+    """Derive a stable seed for one shard of a table from the global seed."""
+    return random.Random(f"{seed}:{table_name}:{index}").getrandbits(64)
+
+
+@dataclass
+class ValuePools:
+    """Faker values drawn once up front, sampled by index when generating rows."""
+    first_names: list[str]
+    last_names: list[str]
+    street_addresses: list[str]
+    email_domains: list[str]
+    catch_phrases: list[str]
+    email_names: dict[str, str]  # Each pooled first and last name as an email address part
+
+
+def email_name(name: str) -> str:
+    """Lowercase ASCII letters and digits of a name, for an email address."""
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return ''.join(char for char in ascii_name.lower() if char.isalnum())
+
+
+def build_value_pools(seed: int, size: int = POOL_SIZE) -> ValuePools:
+    """Draw pools of Faker values, seeded so every worker gets the same pools."""
+    fake = Faker('sv_SE')
+    fake.seed_instance(seed)
+    first_names = [fake.first_name() for _ in range(size)]
+    last_names = [fake.last_name() for _ in range(size)]
+    return ValuePools(
+        first_names=first_names,
+        last_names=last_names,
+        street_addresses=[fake.street_address()[:100] for _ in range(size)],
+        email_domains=[fake.safe_domain_name() for _ in range(size)],
+        catch_phrases=[fake.catch_phrase() for _ in range(size)],
+        email_names={name: email_name(name) for name in first_names + last_names},
+    )
+
+
+def draw_ints(rng: random.Random, low: int, high: int, k: int) -> list[int]:
+    """Draw k integers uniformly from [low, high] in one batch."""
+    return rng.choices(range(low, high + 1), k=k)
+
+
+def pooled_person_rows(rng: random.Random, pools: ValuePools, start: int, stop: int) -> list[list]:
+    """Generate person rows [start, stop) from value pools and batched draws."""
+    k = stop - start
+
+    # Same birth date range as fake.date_of_birth(minimum_age=22, maximum_age=70)
+    today = date.today()
+    oldest = today - timedelta(days=round(71 * 365.25) - 1)
+    youngest = today - timedelta(days=round(22 * 365.25))
+    birth_offsets = draw_ints(rng, 0, (youngest - oldest).days, k)
+
+    # Emails are made from the person's own name, numbered to keep them apart
+    names = pools.email_names
+    return [
+        [f"{(oldest + timedelta(days=offset)).strftime('%Y%m%d')}{i+1:04d}",
+         first_name, last_name, f"07{phone:08d}", address,
+         f"{names[first_name]}.{names[last_name]}{i+1}@{domain}"]
+        for i, offset, first_name, last_name, phone, address, domain in zip(
+            range(start, stop),
+            birth_offsets,
+            rng.choices(pools.first_names, k=k),
+            rng.choices(pools.last_names, k=k),
+            draw_ints(rng, 0, 10**8 - 1, k),
+            rng.choices(pools.street_addresses, k=k),
+            rng.choices(pools.email_domains, k=k),
+        )
+    ]
+
+
+def pooled_employee_rows(rng: random.Random, pools: ValuePools, start: int, stop: int,
+                         personal_numbers: list[str], job_titles: list[str],
+                         department_names: list[str]) -> list[list]:
+    """Generate employee rows [start, stop) from value pools and batched draws."""
+    k = stop - start
+    titles = rng.choices(job_titles, k=k)
+    # One batch of uniform draws per column, scaled into each row's own range
+    salary_draws = [rng.random() for _ in range(k)]
+    manager_draws = [rng.random() for _ in range(k)]
+    skill_counts = draw_ints(rng, 2, 5, k)
+
+    rows = []
+    for i, personal_number, job_title, salary_draw, manager_draw, skill_count, department_name in zip(
+            range(start, stop), personal_numbers, titles, salary_draws, manager_draws, skill_counts,
+            rng.choices(department_names, k=k)):
+        # Generate skill set based on job title
+        skill_set = None
+        if 'Professor' in job_title or 'Lecturer' in job_title:
+            skill_set = ', '.join(rng.choices(pools.catch_phrases, k=skill_count))[:500]
+
+        # Salary based on job title
+        min_sal, max_sal = SALARY_RANGES.get(job_title, (30000, 60000))
+        salary = min_sal + int(salary_draw * (max_sal - min_sal + 1))
+
+        # 30% chance of having a manager, who is an earlier employee
+        manager_id = None
+        if i > 0 and manager_draw < 0.3:
+            manager_id = 1 + int(manager_draw / 0.3 * i)
+
+        rows.append([i + 1, personal_number, job_title, skill_set, salary, department_name, manager_id])
+    return rows
+
+
+def pooled_shard(rng: random.Random, pools: ValuePools, table_name: str, start: int, stop: int,
+                 keys: list | None, context: dict) -> list[list]:
+    """Generate a shard of a large table without calling Faker per row."""
+    if table_name == 'person':
+        return pooled_person_rows(rng, pools, start, stop)
+    elif table_name == 'employee':
+        return pooled_employee_rows(rng, pools, start, stop, keys,
+                                    context['job_titles'], context['department_names'])
+    elif table_name == 'course_instance':
+        return [[instance_id, course_code, layout_version, num_students, study_period, study_year]
+                for (instance_id, course_code, layout_version, study_period, study_year), num_students
+                in zip(keys, draw_ints(rng, 10, 45, len(keys)))]
+    elif table_name == 'salary_history':
+        return [row for i, salary in zip(range(start, stop), keys)
+                for row in salary_history_rows(rng, i + 1, salary, context['latest_start'])]
+    elif table_name == 'planned_activity' and context.get('assigned'):
+        # Keys are (instance_id, teachers) pairs, each activity goes to one of the teachers
+        teaching_activities = context['teaching_activities']
+        counts = draw_ints(rng, 2, 4, len(keys))
+        triples = [(instance_id, rng.choice(teachers), activity_name)
+                   for (instance_id, teachers), count in zip(keys, counts)
+                   for activity_name in rng.sample(teaching_activities, min(count, len(teaching_activities)))]
+        return [[instance_id, emp_id, activity_name, hours]
+                for (instance_id, emp_id, activity_name), hours
+                in zip(triples, draw_ints(rng, 10, 80, len(triples)))]
+    elif table_name == 'planned_activity':
+        teaching_activities = context['teaching_activities']
+        counts = draw_ints(rng, 2, 4, len(keys))
+        pairs = [(instance_id, activity_name) for instance_id, count in zip(keys, counts)
+                 for activity_name in rng.sample(teaching_activities, min(count, len(teaching_activities)))]
+        return [[instance_id, activity_name, hours]
+                for (instance_id, activity_name), hours in zip(pairs, draw_ints(rng, 10, 80, len(pairs)))]
+    elif table_name == 'employee_course_instance':
+        employee_ids = range(1, context['num_employees'] + 1)
+        popularity = context['popularity']
+        counts = draw_ints(rng, 1, 3, len(keys))
+        return [[instance_id, emp_id] for instance_id, count in zip(keys, counts)
+                for emp_id in (popularity.sample(rng, count) if popularity is not None
+                               else rng.sample(employee_ids, min(count, len(employee_ids))))]
+    else:
+        raise ValueError(f"Table {table_name} is not generated in shards")
+
+
+# Faker instance reused by every shard generated in this process, and the
+# value pools to sample from instead when generating in pooled mode
+_shard_fake = None
+_shard_pools = None
+
+
+def _init_shard_worker(pools: ValuePools | None):
+    global _shard_pools
+    _shard_pools = pools
+
+
+def generate_shard(table_name: str, seed: int, start: int, stop: int,
+                   keys: list | None, context: dict) -> list[list]:
+    """
+    Generate the rows for row range [start, stop) of a large table.
+
+    For tables derived from an earlier table, keys holds that table's keys
+    for the range: personal numbers for employee, current salaries for
+    salary_history, instance keys for course_instance and instance IDs for
+    planned activities and assignments, or (instance_id, teachers) pairs for
+    v2 planned activities.
+    """
+    if _shard_pools is not None:
+        return pooled_shard(random.Random(seed), _shard_pools, table_name, start, stop, keys, context)
+
+    global _shard_fake
+    if _shard_fake is None:
+        _shard_fake = Faker('sv_SE')
+    fake = _shard_fake
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+
+    if table_name == 'person':
+        return [person_row(fake, i) for i in range(start, stop)]
+    elif table_name == 'employee':
+        return [employee_row(fake, rng, i, personal_number, context['job_titles'], context['department_names'])
+                for i, personal_number in zip(range(start, stop), keys)]
+    elif table_name == 'course_instance':
+        return [course_instance_row(rng, key) for key in keys]
+    elif table_name == 'salary_history':
+        return [row for i, salary in zip(range(start, stop), keys)
+                for row in salary_history_rows(rng, i + 1, salary, context['latest_start'])]
+    elif table_name == 'planned_activity' and context.get('assigned'):
+        return [row for instance_id, teachers in keys
+                for row in instance_planned_activities(rng, instance_id, context['teaching_activities'], teachers)]
+    elif table_name == 'planned_activity':
+        return [row for instance_id in keys
+                for row in instance_planned_activities(rng, instance_id, context['teaching_activities'])]
+    elif table_name == 'employee_course_instance':
+        employee_ids = range(1, context['num_employees'] + 1)
+        return [row for instance_id in keys
+                for row in instance_assignments(rng, instance_id, employee_ids, context['popularity'])]
+    else:
+        raise ValueError(f"Table {table_name} is not generated in shards")
+
+
+class ShardPool:
+    """
+    Generates the large tables in fixed-size row ranges across worker processes.
+
+    Each shard is seeded from the global seed, the table and the shard index,
+    and shards are yielded back in order, so the output is the same for a
+    given seed whatever the number of workers. In pooled mode, shards sample
+    from pools of Faker values drawn once instead of calling Faker per row.
+    """
+
+    def __init__(self, workers: int, seed: int, pooled: bool = False):
+        self.workers = workers
+        self.seed = seed
+        self.pools = build_value_pools(seed) if pooled else None
+        if workers > 1:
+            self._pool = multiprocessing.Pool(workers, _init_shard_worker, (self.pools,))
+        else:
+            self._pool = None
+            _init_shard_worker(self.pools)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._pool is not None:
+            self._pool.terminate()
+        else:
+            _init_shard_worker(None)
+
+    def rows(self, table_name: str, count: int, keys: list | None = None,
+             context: dict | None = None) -> Iterator[list]:
+        """Yield the rows of a large table, generated shard by shard."""
+        tasks = (
+            (table_name, shard_seed(self.seed, table_name, index), start, min(start + SHARD_ROWS, count),
+             keys[start:start + SHARD_ROWS] if keys is not None else None, context or {})
+            for index, start in enumerate(range(0, count, SHARD_ROWS))
+        )
+        if self._pool is None:
+            shards = (generate_shard(*task) for task in tasks)
+        else:
+            shards = self._ordered_results(tasks)
+
+        for shard in shards:
+            yield from shard
+
+    def _ordered_results(self, tasks: Iterable[tuple]) -> Iterator[list[list]]:
+        # Keep a bounded number of shards in flight so memory stays flat when
+        # the output is consumed more slowly than the workers produce it
+        pending = deque()
+        for task in tasks:
+            pending.append(self._pool.apply_async(generate_shard, task))
+            if len(pending) > 2 * self.workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def generate_tables(num_records: int = 50, seed: int = 42, shards: ShardPool | None = None,
+                    course_prefixes: Sequence[str] = COURSE_PREFIXES, years: range = STUDY_YEARS,
+                    profile: DistributionProfile = PROFILES['uniform'],
+                    keys: Keys | None = None, schema: str = 'v1') -> Iterator[Table]:
+    """
+    Generate fake data for all tables in the database, in dependency order.
+
+    Each table's rows are generated lazily and later tables reference keys
+    recorded while generating earlier ones, so every table's rows must be
+    consumed completely before advancing to the next table.
 
     Args:
         num_records: Number of records to generate for each main table
         seed: Random seed for reproducibility
+        shards: Pool generating the large tables in seeded shards, or None to
+            generate everything sequentially from the global seed
+        course_prefixes: Two-letter prefixes course codes are drawn from
+        years: Study years course instances are drawn from
+        profile: How instances and assignments are spread over study periods,
+            years and teachers
+        keys: Filled in with the keys of the generated rows, if given
+        schema: Schema version to generate for, one of SCHEMAS. v2 renames
+            columns, adds salary_history and plans activities only for the
+            teachers assigned to each instance
 
-    Returns:
-        SQL statements as a string
+    Yields:
+        Table objects with lazily generated rows
     """
     fake = Faker('sv_SE')  # Swedish locale for Swedish names, addresses, etc.
     Faker.seed(seed)
     random.seed(seed)
-
-    sql_statements = []
-    sql_statements.append("-- Fake data generated using Faker library")
-    sql_statements.append("-- Generated automatically for testing purposes")
-    sql_statements.append("")
-    sql_statements.append("-- Start transaction for atomicity")
-    sql_statements.append("BEGIN;")
-    sql_statements.append("")
-    sql_statements.append("-- Defer constraint checking until commit")
-    sql_statements.append("SET CONSTRAINTS ALL DEFERRED;")
-    sql_statements.append("")
-
-    # Clear existing data (in reverse dependency order)
-    sql_statements.append("-- Clear existing data")
-    sql_statements.append("TRUNCATE TABLE teacher_period_limit CASCADE;")
-    sql_statements.append("TRUNCATE TABLE employee_course_instance CASCADE;")
-    sql_statements.append("TRUNCATE TABLE planned_activity CASCADE;")
-    sql_statements.append("TRUNCATE TABLE course_instance CASCADE;")
-    sql_statements.append("TRUNCATE TABLE employee CASCADE;")
-    sql_statements.append("TRUNCATE TABLE department CASCADE;")
-    sql_statements.append("TRUNCATE TABLE teaching_activity CASCADE;")
-    sql_statements.append("TRUNCATE TABLE person CASCADE;")
-    sql_statements.append("TRUNCATE TABLE job_title CASCADE;")
-    sql_statements.append("TRUNCATE TABLE study_period CASCADE;")
-    sql_statements.append("TRUNCATE TABLE course_layout CASCADE;\n")
+    v2 = schema == 'v2'
 
     # Track generated IDs for foreign key relationships
-    course_layouts = []  # List of (course_code, layout_version) tuples
-    study_periods = []
+    keys = keys if keys is not None else Keys()
+    course_layouts = keys.course_layouts  # List of (course_code, layout_version) tuples
+    study_periods = keys.study_periods
     job_titles = []
     personal_numbers = []
-    employee_ids = []
+    employee_ids = keys.employee_ids
     department_names = []
-    teaching_activities = []
-    course_instances = []
+    teaching_activities = keys.teaching_activities
+    course_instances = keys.course_instances
+    salaries = []  # Current salary per employee, for v2 salary histories
+    assignments = []  # (instance_id, teachers) per instance, for v2 planned activities
 
     # 1. Generate course_layout (independent)
-    sql_statements.append("")
-    course_layout_count = max(10, num_records // 5)
-    sql_statements.append(f"-- Course layouts ({course_layout_count} rows)")
-    course_layout_rows = []
-    for i in range(max(10, num_records // 5)):
-        course_code = f"CS{fake.random_int(100, 999)}"
-        layout_version = 1  # Start with version 1 for each course
-        course_name = fake.catch_phrase()[:50]
-        min_students = random.randint(5, 15)
-        max_students = random.randint(min_students + 10, 50)
-        hp = random.choice([7.5, 15, 22.5, 30])
-
-        course_layouts.append((course_code, layout_version))
-        course_layout_rows.append([course_code, layout_version, course_name, min_students, max_students, hp])
-
-    sql_statements.append(generate_multi_row_insert(
+    layout_count = course_layout_count(num_records)
+
+    def course_layout_rows():
+        pools = shards.pools if shards is not None else None
+        for course_code, layout_version in allocate_layout_keys(random, layout_count, course_prefixes):
+            course_name = (random.choice(pools.catch_phrases) if pools else fake.catch_phrase())[:50]
+            min_students = random.randint(5, 15)
+            max_students = random.randint(min_students + 10, 50)
+            hp = random.choice([7.5, 15, 22.5, 30])
+
+            course_layouts.append((course_code, layout_version))
+            yield [course_code, layout_version, course_name, min_students, max_students, hp]
+
+    yield Table(
         'course_layout',
         ['course_code', 'layout_version', 'course_name', 'min_students', 'max_students', 'hp'],
-        course_layout_rows
-    ))
+        course_layout_rows(),
+        'Course layouts',
+        layout_count,
+    )
 
     # 2. Generate study_period (independent)
-    sql_statements.append("")
-    periods = [
-        ('P1', 'Period 1 (Sep-Oct)'),
-        ('P2', 'Period 2 (Nov-Jan)'),
-        ('P3', 'Period 3 (Jan-Mar)'),
-        ('P4', 'Period 4 (Mar-Jun)'),
-        ('H1', 'First half (Sep-Jan)'),
-        ('H2', 'Second half (Jan-Jun)'),
-        ('HT', 'Autumn term'),
-        ('VT', 'Spring term'),
-    ]
-    sql_statements.append(f"-- Study periods ({len(periods)} rows)")
-    study_period_rows = []
-    for code, factor in periods:
-        study_periods.append(code)
-        study_period_rows.append([code, factor])
-
-    sql_statements.append(generate_multi_row_insert(
-        'study_period',
-        ['code', 'factor'],
-        study_period_rows
-    ))
+    def study_period_rows():
+        for code, factor in STUDY_PERIODS:
+            study_periods.append(code)
+            yield [code, factor]
+
+    yield Table('study_period', ['code', 'description' if v2 else 'factor'], study_period_rows(),
+                'Study periods', len(STUDY_PERIODS))
 
     # 3. Generate job_title (independent)
-    sql_statements.append("")
     titles = [
         'Professor',
         'Associate Professor',
@@ -150,46 +972,34 @@ def generate_fake_data(num_records: int = 50, seed: int = 42) -> str:
         'Administrative Staff',
         'Department Head'
     ]
-    sql_statements.append(f"-- Job titles ({len(titles)} rows)")
-    job_title_rows = []
-    for title in titles:
-        job_titles.append(title)
-        job_title_rows.append([title])
-
-    sql_statements.append(generate_multi_row_insert(
-        'job_title',
-        ['job_title'],
-        job_title_rows
-    ))
+
+    def job_title_rows():
+        for title in titles:
+            job_titles.append(title)
+            yield [title]
+
+    yield Table('job_title', ['job_title'], job_title_rows(), 'Job titles', len(titles))
 
     # 4. Generate person (independent)
-    sql_statements.append("")
-    sql_statements.append(f"-- Persons ({num_records} rows)")
-    person_rows = []
-    for i in range(num_records):
-        # Swedish personnummer format: YYYYMMDDXXXX (12 characters)
-        # YYYYMMDD is full birth date, XXXX is a 4-digit serial number
-        # Stored as VARCHAR to properly represent this identifier
-        birth_date = fake.date_of_birth(minimum_age=22, maximum_age=70)
-        date_part = birth_date.strftime('%Y%m%d')  # YYYYMMDD (full year)
-        personal_number = f"{date_part}{i+1:04d}"  # e.g., '196203150001'
-        first_name = fake.first_name()
-        last_name = fake.last_name()
-        phone_number = fake.numerify('07########')  # Swedish mobile format
-        address = fake.street_address()[:100]
-        email = fake.email()
-
-        personal_numbers.append(personal_number)
-        person_rows.append([personal_number, first_name, last_name, phone_number, address, email])
-
-    sql_statements.append(generate_multi_row_insert(
+    def person_rows():
+        if shards is None:
+            rows = (person_row(fake, i) for i in range(num_records))
+        else:
+            rows = shards.rows('person', num_records)
+
+        for row in rows:
+            personal_numbers.append(row[0])
+            yield row
+
+    yield Table(
         'person',
-        ['personal_number', 'first_name', 'last_name', 'phone_number', 'adress', 'email'],
-        person_rows
-    ))
+        ['personal_number', 'first_name', 'last_name', 'phone_number', 'address' if v2 else 'adress', 'email'],
+        person_rows(),
+        'Persons',
+        num_records,
+    )
 
     # 5. Generate department (independent)
-    sql_statements.append("")
     dept_list = [
         'Computer Science',
         'Mathematics',
@@ -197,22 +1007,22 @@ def generate_fake_data(num_records: int = 50, seed: int = 42) -> str:
         'Electrical Engineering',
         'Software Engineering'
     ]
-    sql_statements.append(f"-- Departments ({len(dept_list)} rows)")
-    department_rows = []
-    for dept in dept_list:
-        department_names.append(dept)
-        # manager_id field exists but has no FK constraint in current schema
-        manager_id = random.randint(1, num_records)
-        department_rows.append([dept, manager_id])
-
-    sql_statements.append(generate_multi_row_insert(
-        'department',
-        ['department_name', 'manager_id'],
-        department_rows
-    ))
+
+    def department_rows():
+        for i, dept in enumerate(dept_list):
+            department_names.append(dept)
+            if v2:
+                # v2 checks at commit that managers belong to their department,
+                # so the first employees are placed in the departments they head
+                manager_id = i + 1 if i < num_records else None
+            else:
+                # manager_id field exists but has no FK constraint in current schema
+                manager_id = random.randint(1, num_records)
+            yield [dept, manager_id]
+
+    yield Table('department', ['department_name', 'manager_id'], department_rows(), 'Departments', len(dept_list))
 
     # 6. Generate teaching_activity (independent)
-    sql_statements.append("")
     activities = [
         ('Lecture', 1),
         ('Lab', 2),
@@ -222,167 +1032,521 @@ def generate_fake_data(num_records: int = 50, seed: int = 42) -> str:
         ('Exam grading', 1),
         ('Course administration', 1),
     ]
-    sql_statements.append(f"-- Teaching activities ({len(activities)} rows)")
-    teaching_activity_rows = []
-    for activity_name, factor in activities:
-        teaching_activities.append(activity_name)
-        teaching_activity_rows.append([activity_name, factor])
 
-    sql_statements.append(generate_multi_row_insert(
+    def teaching_activity_rows():
+        for activity_name, factor in activities:
+            teaching_activities.append(activity_name)
+            yield [activity_name, V2_ACTIVITY_FACTORS.get(activity_name, 1.0) if v2 else factor]
+
+    yield Table(
         'teaching_activity',
         ['activity_name', 'factor'],
-        teaching_activity_rows
-    ))
+        teaching_activity_rows(),
+        'Teaching activities',
+        len(activities),
+    )
 
     # 7. Generate employee (depends on job_title, department, person)
-    sql_statements.append("")
-    sql_statements.append(f"-- Employees ({num_records} rows)")
-    employee_rows = []
-    for i in range(num_records):
-        employee_id = i + 1
-        personal_number = personal_numbers[i]
-        job_title = random.choice(job_titles)
-
-        # Generate skill set based on job title
-        skills = []
-        if 'Professor' in job_title or 'Lecturer' in job_title:
-            skills = [fake.catch_phrase() for _ in range(random.randint(2, 5))]
-        skill_set = ', '.join(skills)[:500] if skills else None
-
-        # Salary based on job title
-        salary_ranges = {
-            'Professor': (70000, 90000),
-            'Associate Professor': (60000, 75000),
-            'Assistant Professor': (50000, 65000),
-            'Senior Lecturer': (55000, 70000),
-            'Lecturer': (45000, 60000),
-            'Teaching Assistant': (30000, 40000),
-            'Lab Assistant': (25000, 35000),
-            'Research Assistant': (35000, 45000),
-            'Administrative Staff': (35000, 50000),
-            'Department Head': (75000, 95000)
-        }
-        min_sal, max_sal = salary_ranges.get(job_title, (30000, 60000))
-        salary = random.randint(min_sal, max_sal)
-
-        department_name = random.choice(department_names)
-
-        # manager_id should be employee_id of a manager or NULL
-        # For simplicity, 30% chance of having a manager (references earlier employee)
-        if i > 0 and random.random() < 0.3:
-            manager_id = random.randint(1, i)  # Reference an existing employee
+    def employee_rows():
+        if shards is None:
+            rows = (employee_row(fake, random, i, personal_numbers[i], job_titles, department_names)
+                    for i in range(num_records))
         else:
-            manager_id = None
+            rows = shards.rows('employee', num_records, personal_numbers,
+                               {'job_titles': job_titles, 'department_names': department_names})
 
-        employee_ids.append(employee_id)
-        employee_rows.append([employee_id, personal_number, job_title, skill_set, salary,
-                             department_name, manager_id])
+        for i, row in enumerate(rows):
+            if v2:
+                if i < len(department_names):
+                    row[5] = department_names[i]
+                salaries.append(row[4])
+            employee_ids.append(row[0])
+            yield row
 
-    sql_statements.append(generate_multi_row_insert(
+    yield Table(
         'employee',
-        ['employee_id', 'personal_number', 'job_title', 'skill_set', 'salary',
-         'department_name', 'manager_id'],
-        employee_rows
-    ))
+        ['employee_id', 'personal_number', 'job_title', 'skill_set',
+         'current_salary' if v2 else 'salary', 'department_name', 'manager_id'],
+        employee_rows(),
+        'Employees',
+        num_records,
+    )
+
+    # 7b. Generate salary_history (v2 only, depends on employee)
+    if v2:
+        latest_start = date(years[-1], 12, 31)
+
+        def salary_history_table_rows():
+            if shards is None:
+                for employee_id, salary in zip(employee_ids, salaries):
+                    yield from salary_history_rows(random, employee_id, salary, latest_start)
+            else:
+                yield from shards.rows('salary_history', len(salaries), salaries, {'latest_start': latest_start})
+
+        # Each history ends in the employee's current_salary, so the per-row
+        # sync trigger is disabled rather than updating every employee again
+        yield Table(
+            'salary_history',
+            ['employee_id', 'salary', 'valid_from', 'valid_to'],
+            salary_history_table_rows(),
+            'Salary history',
+            before=["ALTER TABLE salary_history DISABLE TRIGGER trg_salary_history_sync_aiud;"],
+            after=["ALTER TABLE salary_history ENABLE TRIGGER trg_salary_history_sync_aiud;"],
+        )
 
     # 8. Generate course_instance (depends on course_layout, study_period)
-    sql_statements.append("")
-    course_instance_count = max(20, num_records // 2)
-    sql_statements.append(f"-- Course instances ({course_instance_count} rows)")
-    course_instance_rows = []
-    used_instance_ids = set()
-    for i in range(course_instance_count):
-        # Keep trying until we get a unique instance_id
-        max_attempts = 100
-        for attempt in range(max_attempts):
-            course_code, layout_version = random.choice(course_layouts)
-            study_period = random.choice(study_periods)
-            study_year = random.randint(2020, 2025)
-
-            # Instance ID format: CODECODEYY (e.g., CS101P124)
-            instance_id = f"{course_code}{study_period}{str(study_year)[-2:]}"
-
-            if instance_id not in used_instance_ids:
-                used_instance_ids.add(instance_id)
-                break
-        else:
-            # If we couldn't find a unique ID after max_attempts, skip this instance
-            continue
+    instance_count = course_instance_count(num_records)
 
-        # Get course layout to determine student limits
-        num_students = random.randint(10, 45)
+    def course_instance_rows():
+        # Keys are allocated up front without replacement, so shards never collide
+        keys = allocate_instance_keys(random, instance_count, course_layouts, study_periods, years, profile)
+        if shards is None:
+            rows = (course_instance_row(random, key) for key in keys)
+        else:
+            rows = shards.rows('course_instance', len(keys), keys)
 
-        course_instances.append(instance_id)
-        course_instance_rows.append([instance_id, course_code, layout_version, num_students,
-                                    study_period, study_year])
+        for row in rows:
+            course_instances.append(row[0])
+            yield row
 
-    sql_statements.append(generate_multi_row_insert(
+    yield Table(
         'course_instance',
         ['instance_id', 'course_code', 'layout_version', 'num_students',
          'study_period', 'study_year'],
-        course_instance_rows
-    ))
-
-    # 9. Generate planned_activity (depends on teaching_activity, course_instance)
-    sql_statements.append("")
-    # Count will be determined dynamically
-    planned_activity_rows = []
-    for course_inst in course_instances:
-        # Generate 2-4 unique activities per course instance
-        num_activities = random.randint(2, 4)
-        selected_activities = random.sample(teaching_activities, min(num_activities, len(teaching_activities)))
-
-        for activity_name in selected_activities:
-            planned_hours = random.randint(10, 80)
-            # Composite PK: (instance_id, activity_name)
-            planned_activity_rows.append([course_inst, activity_name, planned_hours])
-
-    sql_statements.append(f"-- Planned activities ({len(planned_activity_rows)} rows)")
-    sql_statements.append(generate_multi_row_insert(
+        course_instance_rows(),
+        'Course instances',
+        instance_count,
+    )
+
+    # 9. Generate planned_activity (depends on teaching_activity, course_instance,
+    # and in v2 on employee_course_instance)
+    def planned_activity_rows():
+        if shards is None and v2:
+            for course_inst, teachers in assignments:
+                yield from instance_planned_activities(random, course_inst, teaching_activities, teachers)
+        elif shards is None:
+            for course_inst in course_instances:
+                yield from instance_planned_activities(random, course_inst, teaching_activities)
+        else:
+            yield from shards.rows('planned_activity', len(course_instances),
+                                   assignments if v2 else course_instances,
+                                   {'teaching_activities': teaching_activities, 'assigned': v2})
+
+    planned_activity = Table(
         'planned_activity',
-        ['instance_id', 'activity_name', 'planned_hours'],
-        planned_activity_rows
-    ))
+        ['instance_id', 'employee_id', 'activity_name', 'planned_hours'] if v2
+        else ['instance_id', 'activity_name', 'planned_hours'],
+        planned_activity_rows(),
+        'Planned activities',
+    )
 
     # 10. Generate employee_course_instance (depends on employee, course_instance)
-    sql_statements.append("")
-    employee_course_rows = []
-    for course_inst in course_instances:
-        # Assign 1-3 employees to each course instance
-        num_employees = random.randint(1, 3)
-        assigned_employees = random.sample(employee_ids, min(num_employees, len(employee_ids)))
-
-        for emp_id in assigned_employees:
-            # Composite PK: (instance_id, employee_id)
-            employee_course_rows.append([course_inst, emp_id])
-
-    sql_statements.append(f"-- Employee-Course assignments ({len(employee_course_rows)} rows)")
-    sql_statements.append(generate_multi_row_insert(
+    def employee_course_rows():
+        popularity = None
+        if profile.teacher_zipf is not None:
+            popularity = ZipfSampler(len(employee_ids), profile.teacher_zipf, seed)
+
+        if shards is None:
+            rows = (row for course_inst in course_instances
+                    for row in instance_assignments(random, course_inst, employee_ids, popularity))
+        else:
+            rows = shards.rows('employee_course_instance', len(course_instances), course_instances,
+                               {'num_employees': len(employee_ids), 'popularity': popularity})
+        yield from record_assignments(rows, assignments) if v2 else rows
+
+    employee_course_instance = Table(
         'employee_course_instance',
         ['instance_id', 'employee_id'],
-        employee_course_rows
-    ))
+        employee_course_rows(),
+        'Employee-Course assignments',
+    )
+
+    # v2 references assignments from planned_activity, so they are loaded first
+    if v2:
+        yield employee_course_instance
+        yield planned_activity
+    else:
+        yield planned_activity
+        yield employee_course_instance
 
     # 11. Generate teacher_period_limit (depends on study_period)
-    sql_statements.append("")
-    teacher_period_limit_rows = []
-    for period_code in study_periods:
-        max_courses = random.randint(2, 5)  # Each teacher can teach 2-5 courses per period
-        teacher_period_limit_rows.append([period_code, max_courses])
-
-    sql_statements.append(f"-- Teacher period limits ({len(teacher_period_limit_rows)} rows)")
-    sql_statements.append(generate_multi_row_insert(
+    def teacher_period_limit_rows():
+        for period_code in study_periods:
+            max_courses = random.randint(2, 5)  # Each teacher can teach 2-5 courses per period
+            yield [period_code, max_courses]
+
+    yield Table(
         'teacher_period_limit',
         ['period_code', 'max_courses'],
-        teacher_period_limit_rows
-    ))
+        teacher_period_limit_rows(),
+        'Teacher period limits',
+        len(STUDY_PERIODS),
+    )
+
+
+def generate_append_tables(keys: Keys, count: int, seed: int = 42, years: range = STUDY_YEARS,
+                           profile: DistributionProfile = PROFILES['uniform'],
+                           schema: str = 'v1') -> Iterator[Table]:
+    """
+    Generate count new course instances, with their planned activities and
+    assignments, referencing the existing rows in keys.
+
+    Instance keys are allocated up front, so a ValueError for an exhausted
+    key space is raised before any table is produced. keys.course_instances
+    is extended with the new instance IDs as they are generated.
+    """
+    rng = random.Random(seed)
+    instance_keys = allocate_instance_keys(rng, count, keys.course_layouts, keys.study_periods, years,
+                                           profile, exclude=set(keys.course_instances))
+    new_instances = []
+    assignments = []
+    v2 = schema == 'v2'
+
+    def course_instance_rows():
+        for key in instance_keys:
+            row = course_instance_row(rng, key)
+            new_instances.append(row[0])
+            yield row
+
+    def planned_activity_rows():
+        if v2:
+            for course_inst, teachers in assignments:
+                yield from instance_planned_activities(rng, course_inst, keys.teaching_activities, teachers)
+        else:
+            for course_inst in new_instances:
+                yield from instance_planned_activities(rng, course_inst, keys.teaching_activities)
+
+    def employee_course_rows():
+        popularity = None
+        if profile.teacher_zipf is not None:
+            popularity = ZipfSampler(len(keys.employee_ids), profile.teacher_zipf, seed)
+        rows = (row for course_inst in new_instances
+                for row in instance_assignments(rng, course_inst, keys.employee_ids, popularity))
+        yield from record_assignments(rows, assignments) if v2 else rows
+        keys.course_instances.extend(new_instances)
+
+    def tables():
+        yield Table(
+            'course_instance',
+            ['instance_id', 'course_code', 'layout_version', 'num_students',
+             'study_period', 'study_year'],
+            course_instance_rows(),
+            'New course instances',
+            len(instance_keys),
+        )
+        planned_activity = Table(
+            'planned_activity',
+            ['instance_id', 'employee_id', 'activity_name', 'planned_hours'] if v2
+            else ['instance_id', 'activity_name', 'planned_hours'],
+            planned_activity_rows(),
+            'New planned activities',
+        )
+        employee_course_instance = Table(
+            'employee_course_instance',
+            ['instance_id', 'employee_id'],
+            employee_course_rows(),
+            'New Employee-Course assignments',
+        )
+        if v2:
+            yield employee_course_instance
+            yield planned_activity
+        else:
+            yield planned_activity
+            yield employee_course_instance
+
+    return tables()
+
+
+def churn_statements(rng: random.Random, course_instances: Sequence[str],
+                     updates: int, deletes: int) -> tuple[list[str], set[str]]:
+    """
+    Pick existing course instances for UPDATE and DELETE churn.
+
+    Updates shift the planned hours of an instance's activities. Deletes
+    remove an instance, and its planned activities and assignments through
+    ON DELETE CASCADE.
+
+    Returns:
+        The statements in random order, and the deleted instance IDs
+    """
+    if updates + deletes > len(course_instances):
+        raise ValueError(f"Cannot pick {updates + deletes} of {len(course_instances)} course instances for churn")
+
+    picked = rng.sample(course_instances, updates + deletes)
+    statements = []
+    for instance_id in picked[:updates]:
+        delta = rng.randint(-10, 10)
+        statements.append(f"UPDATE planned_activity SET planned_hours = GREATEST(planned_hours {delta:+d}, 0) "
+                          f"WHERE instance_id = {format_value(instance_id)};")
+    for instance_id in picked[updates:]:
+        statements.append(f"DELETE FROM course_instance WHERE instance_id = {format_value(instance_id)};")
+    rng.shuffle(statements)
+
+    return statements, set(picked[updates:])
+
+
+def read_keys(conn) -> Keys:
+    """Read the keys that appended rows can reference from the database."""
+    with conn.cursor() as cursor:
+        def column(query):
+            cursor.execute(query)
+            return [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("SELECT course_code, layout_version FROM course_layout ORDER BY 1, 2")
+        course_layouts = [tuple(row) for row in cursor.fetchall()]
+        return Keys(
+            course_layouts=course_layouts,
+            study_periods=column("SELECT code FROM study_period ORDER BY code"),
+            employee_ids=column("SELECT employee_id FROM employee ORDER BY employee_id"),
+            teaching_activities=column("SELECT activity_name FROM teaching_activity ORDER BY activity_name"),
+            course_instances=column("SELECT instance_id FROM course_instance ORDER BY instance_id"),
+        )
+
+
+def read_manifest(path: Path) -> tuple[Keys, range | None]:
+    """Read keys and study years from a manifest written by write_manifest()."""
+    data = json.loads(path.read_text())
+    data['course_layouts'] = [tuple(key) for key in data['course_layouts']]
+    # Manifests written before the years were recorded lack them
+    years = data.pop('years', None)
+    return Keys(**data), years and range(years[0], years[1] + 1)
+
+
+def write_manifest(path: Path, keys: Keys, years: range):
+    """Write keys and study years to a JSON manifest that later appends can read instead of the database."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({'years': [years[0], years[-1]], **asdict(keys)}) + '\n')
+
+
+def iter_sql(tables: Iterable[Table], chunk_rows: int = CHUNK_ROWS,
+             output_format: str = 'insert', batch_rows: int | None = None,
+             truncate: Sequence[str] = TRUNCATE_ORDER, statements: Sequence[str] = ()) -> Iterator[str]:
+    """
+    Yield a complete SQL load script for the given tables in pieces.
+
+    The tables in truncate are cleared first, in order, and any extra
+    statements run after the tables are loaded.
+    """
+    yield "-- Fake data generated using Faker library\n"
+    yield "-- Generated automatically for testing purposes\n"
+    yield "\n"
+    yield "-- Start transaction for atomicity\n"
+    yield "BEGIN;\n"
+    yield "\n"
+    yield "-- Defer constraint checking until commit\n"
+    yield "SET CONSTRAINTS ALL DEFERRED;\n"
+    yield "\n"
+
+    if truncate:
+        # Clear existing data (in reverse dependency order)
+        yield "-- Clear existing data\n"
+        for table_name in truncate:
+            yield f"TRUNCATE TABLE {table_name} CASCADE;\n"
+        yield "\n"
+
+    for table in tables:
+        count = f" ({table.count} rows)" if table.count is not None else ""
+        yield f"\n-- {table.label}{count}\n"
+        for statement in table.before:
+            yield statement + "\n"
+        if output_format == 'insert':
+            yield from iter_multi_row_insert(table.name, table.columns, table.rows, chunk_rows, batch_rows)
+        else:
+            csv = output_format == 'copy-csv'
+            yield from iter_copy(table.name, table.columns, table.rows, csv, chunk_rows)
+        yield "\n"
+        for statement in table.after:
+            yield statement + "\n"
+
+    if statements:
+        yield "\n-- Update/delete churn\n"
+        for statement in statements:
+            yield statement + "\n"
 
     # Commit transaction
-    sql_statements.append("")
-    sql_statements.append("-- Commit transaction")
-    sql_statements.append("COMMIT;")
+    yield "\n"
+    yield "-- Commit transaction\n"
+    yield "COMMIT;\n"
+
+
+def write_sql(out: TextIO, tables: Iterable[Table], chunk_rows: int = CHUNK_ROWS,
+              output_format: str = 'insert', batch_rows: int | None = None,
+              truncate: Sequence[str] = TRUNCATE_ORDER, statements: Sequence[str] = ()) -> int:
+    """
+    Stream a SQL load script to out, flushing after every chunk of rows.
+
+    Returns:
+        Number of INSERT or COPY statements written
+    """
+    count = 0
+    for piece in iter_sql(tables, chunk_rows, output_format, batch_rows, truncate, statements):
+        if piece.startswith(('INSERT INTO', 'COPY ')):
+            count += 1
+        out.write(piece)
+        out.flush()
+    return count
 
-    return '\n'.join(sql_statements)
+
+def load_tables(conn, tables: Iterable[Table], chunk_rows: int = CHUNK_ROWS,
+                truncate: Sequence[str] = TRUNCATE_ORDER, statements: Sequence[str] = ()) -> int:
+    """
+    Stream tables straight into the database with COPY, in a single transaction.
+
+    The tables in truncate are cleared first and any extra statements run
+    after the tables are loaded, as in the generated SQL script. Rows per
+    second are reported for each table as it finishes loading.
+
+    Returns:
+        Total number of rows loaded
+    """
+    total_rows = 0
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+            for table_name in truncate:
+                cursor.execute(f"TRUNCATE TABLE {table_name} CASCADE")
+
+            for table in tables:
+                rows = 0
+
+                def counted(chunks):
+                    # Text format escapes embedded newlines, so one line is one row
+                    nonlocal rows
+                    for chunk in chunks:
+                        rows += chunk.count('\n')
+                        yield chunk
+
+                start = time.perf_counter()
+                for statement in table.before:
+                    cursor.execute(statement)
+                data = counted(iter_copy_data(table.rows, chunk_rows=chunk_rows))
+                cursor.copy_expert(copy_statement(table.name, table.columns), ChunkReader(data))
+                for statement in table.after:
+                    cursor.execute(statement)
+                elapsed = time.perf_counter() - start
+
+                total_rows += rows
+                rate = rows / elapsed if elapsed > 0 else 0
+                print(f"  {table.name}: {rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)", file=sys.stderr)
+
+            for statement in statements:
+                cursor.execute(statement)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return total_rows
+
+
+def generate_fake_data(num_records: int = 50, seed: int = 42, output_format: str = 'insert') -> str:
+    """
+    Generate fake data for all tables in the database.
+
+    Args:
+        num_records: Number of records to generate for each main table
+        seed: Random seed for reproducibility
+        output_format: One of OUTPUT_FORMATS
+
+    Returns:
+        SQL statements as a string
+    """
+    return ''.join(iter_sql(generate_tables(num_records, seed), output_format=output_format))
+
+
+def course_prefix(value: str) -> str:
+    """Argument type for a two-letter course code prefix."""
+    if len(value) != 2 or not value.isalpha():
+        raise argparse.ArgumentTypeError(f"course prefix must be two letters: {value!r}")
+    return value.upper()
+
+
+def connect():
+    """Connect to the database from dbconfig, exiting on failure."""
+    import psycopg2
+
+    from dbconfig.pool import connect
+
+    try:
+        # A bulk load runs as long as it needs, whatever the session default
+        return connect('generate_fake_data', statement_timeout=0)
+    except psycopg2.Error as e:
+        print(f"Error connecting to database: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def load(conn, tables: Iterable[Table], chunk_rows: int, truncate: Sequence[str] = TRUNCATE_ORDER,
+         statements: Sequence[str] = ()):
+    """Load the tables with load_tables(), exiting if the load fails."""
+    import psycopg2
+
+    start = time.perf_counter()
+    try:
+        total_rows = load_tables(conn, tables, chunk_rows, truncate, statements)
+    except psycopg2.Error as e:
+        print(f"Error loading data, transaction rolled back: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {total_rows} rows in {elapsed:.2f}s", file=sys.stderr)
+
+
+def write(tables: Iterable[Table], output: Path, chunk_rows: int, output_format: str,
+          batch_rows: int | None, truncate: Sequence[str] = TRUNCATE_ORDER,
+          statements: Sequence[str] = ()):
+    """Write the SQL load script to output, or to stdout if output is -."""
+    if str(output) == '-':
+        count = write_sql(sys.stdout, tables, chunk_rows, output_format, batch_rows, truncate, statements)
+    else:
+        # Ensure output directory exists
+        output.parent.mkdir(parents=True, exist_ok=True)
+
+        with output.open('w') as out:
+            count = write_sql(out, tables, chunk_rows, output_format, batch_rows, truncate, statements)
+        print(f"Generated SQL file: {output}", file=sys.stderr)
+
+    print(f"Total statements: {count}", file=sys.stderr)
+
+
+def append(args: argparse.Namespace, years: range, profile: DistributionProfile):
+    """Append new rows that reference existing keys, with optional churn."""
+    conn = None
+    if args.manifest is not None and args.manifest.exists():
+        print(f"Reading existing keys from manifest: {args.manifest}", file=sys.stderr)
+        keys, _ = read_manifest(args.manifest)
+    else:
+        print("Reading existing keys from the database...", file=sys.stderr)
+        conn = connect()
+        keys = read_keys(conn)
+
+    try:
+        existing = list(keys.course_instances)
+        statements, deleted = churn_statements(random.Random(f"{args.seed}:churn"), existing,
+                                               args.updates, args.deletes)
+        tables = generate_append_tables(keys, args.append, args.seed, years, profile, args.schema)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Appending {args.append} course instances with {len(statements)} churn statements...",
+          file=sys.stderr)
+    try:
+        if args.load:
+            conn = conn or connect()
+            load(conn, tables, args.chunk_rows, truncate=(), statements=statements)
+        else:
+            write(tables, args.output, args.chunk_rows, args.format, args.batch_rows,
+                  truncate=(), statements=statements)
+    finally:
+        if conn is not None:
+            conn.close()
+
+    if args.manifest is not None:
+        keys.course_instances = [instance_id for instance_id in keys.course_instances
+                                 if instance_id not in deleted]
+        write_manifest(args.manifest, keys, years)
+        print(f"Manifest updated: {args.manifest}", file=sys.stderr)
 
 
 def main():
@@ -399,7 +1563,8 @@ def main():
         '-o', '--output',
         type=Path,
         default=Path('1_logical_and_physical_model/db/populate.sql'),
-        help='Output SQL file path (default: 1_logical_and_physical_model/db/populate.sql)'
+        help='Output SQL file path, or - for stdout '
+             '(default: 1_logical_and_physical_model/db/populate.sql)'
     )
     parser.add_argument(
         '-s', '--seed',
@@ -407,20 +1572,200 @@ def main():
         default=42,
         help='Random seed for reproducibility (default: 42)'
     )
+    parser.add_argument(
+        '-f', '--format',
+        choices=OUTPUT_FORMATS,
+        default='insert',
+        help='insert: multi-row INSERT statements; copy/copy-csv: COPY ... FROM STDIN '
+             'blocks in text or CSV format, to be loaded with psql -f (default: insert)'
+    )
+    parser.add_argument(
+        '--schema',
+        choices=SCHEMAS,
+        default='v1',
+        help='Schema version to generate for: v1 (db/v1/create.sql) or v2 (db/v2/create_v2.sql, '
+             'with salary histories and planned activities only for assigned teachers) (default: v1)'
+    )
+    parser.add_argument(
+        '--load',
+        action='store_true',
+        help='Load the data straight into the database from dbconfig with COPY, '
+             'in one transaction, instead of writing an SQL file'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        help='Generate the large tables in seeded shards of '
+             f'{SHARD_ROWS} rows across this many processes. Output is reproducible '
+             'for a given seed but differs from the default sequential generation'
+    )
+    parser.add_argument(
+        '--pooled',
+        action='store_true',
+        help=f'Sample names, addresses, email domains and catch phrases from pools of {POOL_SIZE} '
+             'values drawn once, with emails made from the names, and draw numeric columns in '
+             'batches. Implies sharded generation (with one worker unless --workers is given)'
+    )
+    parser.add_argument(
+        '--course-prefixes',
+        type=course_prefix,
+        nargs='+',
+        default=list(COURSE_PREFIXES),
+        help='Two-letter course code prefixes, each adding 900 course codes to the key space '
+             f'(default: {" ".join(COURSE_PREFIXES)})'
+    )
+    parser.add_argument(
+        '--years',
+        type=int,
+        nargs=2,
+        metavar=('FIRST', 'LAST'),
+        help='Range of study years for course instances, at most 100 years since instance '
+             'IDs use 2-digit years (default: the years recorded in the --append manifest, '
+             f'else {STUDY_YEARS.start} {STUDY_YEARS.stop - 1})'
+    )
+    parser.add_argument(
+        '-p', '--profile',
+        choices=PROFILES,
+        default='uniform',
+        # argparse formats help strings with %, so percent signs are doubled
+        help='Distribution profile for teachers, study periods and years: '
+             + '; '.join(f'{name}: {profile.description}'.replace('%', '%%')
+                         for name, profile in PROFILES.items())
+             + ' (default: uniform)'
+    )
+    parser.add_argument(
+        '--teacher-zipf',
+        type=float,
+        help="Override the profile's Zipf exponent for teacher popularity"
+    )
+    parser.add_argument(
+        '--current-year-share',
+        type=float,
+        help="Override the profile's share of course instances in the latest study year"
+    )
+    parser.add_argument(
+        '-a', '--append',
+        type=int,
+        metavar='N',
+        help='Instead of rebuilding every table, append N new course instances with their '
+             'planned activities and assignments, referencing existing rows. Existing keys '
+             'are read from --manifest if it exists, otherwise from the database'
+    )
+    parser.add_argument(
+        '--updates',
+        type=int,
+        default=0,
+        help='With --append, also update the planned hours of this many existing course instances'
+    )
+    parser.add_argument(
+        '--deletes',
+        type=int,
+        default=0,
+        help='With --append, also delete this many existing course instances'
+    )
+    parser.add_argument(
+        '-m', '--manifest',
+        type=Path,
+        help='JSON manifest of generated keys: written after a full generation, read and '
+             'updated by --append'
+    )
+    parser.add_argument(
+        '-b', '--batch-rows',
+        type=int,
+        help='Split each table into INSERT statements of at most this many rows, '
+             'to bound the size of each statement (default: one statement per table)'
+    )
+    parser.add_argument(
+        '--chunk-rows',
+        type=int,
+        default=CHUNK_ROWS,
+        help=f'Rows formatted and flushed to the output at a time (default: {CHUNK_ROWS})'
+    )
 
     args = parser.parse_args()
 
-    # Generate fake data
-    print(f"Generating {args.num_records} records with seed {args.seed}...")
-    sql_content = generate_fake_data(args.num_records, args.seed)
+    if args.years is None:
+        years = STUDY_YEARS
+        if args.append is not None and args.manifest is not None and args.manifest.exists():
+            years = read_manifest(args.manifest)[1] or years
+        args.years = [years[0], years[-1]]
+    first_year, last_year = args.years
+    if not 2000 < first_year <= last_year < first_year + 100:
+        parser.error('--years must be a range of at most 100 years after 2000')
+    years = range(first_year, last_year + 1)
+
+    if args.batch_rows is not None and args.batch_rows < 1:
+        parser.error('--batch-rows must be at least 1')
+    if args.batch_rows and (args.format != 'insert' or args.load):
+        parser.error('--batch-rows only applies to INSERT output; COPY streams rows without statement limits')
+
+    profile = PROFILES[args.profile]
+    if args.teacher_zipf is not None:
+        if args.teacher_zipf <= 0:
+            parser.error('--teacher-zipf must be positive')
+        profile = replace(profile, teacher_zipf=args.teacher_zipf)
+    if args.current_year_share is not None:
+        if not 0 <= args.current_year_share <= 1:
+            parser.error('--current-year-share must be between 0 and 1')
+        profile = replace(profile, current_year_share=args.current_year_share)
+
+    try:
+        check_key_space(args.num_records, args.course_prefixes, years, profile)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.append is not None:
+        if args.append < 1:
+            parser.error('--append must be at least 1')
+        if args.workers or args.pooled:
+            parser.error('--append does not use sharded generation')
+    elif args.updates or args.deletes:
+        parser.error('--updates and --deletes only apply with --append')
+
+    # Status messages go to stderr so the SQL can be piped from stdout
+    if args.append is not None:
+        append(args, years, profile)
+        return
+
+    print(f"Generating {args.num_records} records with seed {args.seed}...", file=sys.stderr)
+
+    keys = Keys() if args.manifest is not None else None
+    with ExitStack() as stack:
+        shards = None
+        if args.workers or args.pooled:
+            shards = stack.enter_context(ShardPool(args.workers or 1, args.seed, args.pooled))
+        tables = generate_tables(args.num_records, args.seed, shards, args.course_prefixes, years,
+                                 profile, keys, args.schema)
+        truncate = SCHEMAS[args.schema]
+
+        print(f"Distribution profile: {profile.name} ({profile.description})", file=sys.stderr)
+        if args.load:
+            conn = connect()
+            try:
+                load(conn, tables, args.chunk_rows, truncate)
+            finally:
+                conn.close()
+        else:
+            write(tables, args.output, args.chunk_rows, args.format, args.batch_rows, truncate)
 
-    # Ensure output directory exists
-    args.output.parent.mkdir(parents=True, exist_ok=True)
+    # Record how the data was shaped next to the SQL file it describes
+    if not args.load and str(args.output) != '-':
+        profile_path = args.output.with_suffix('.profile.json')
+        profile_path.write_text(json.dumps({
+            **asdict(profile),
+            'num_records': args.num_records,
+            'seed': args.seed,
+            'schema': args.schema,
+            'sharded': shards is not None,
+            'pooled': args.pooled,
+            'course_prefixes': args.course_prefixes,
+            'years': [first_year, last_year],
+        }, indent=2) + '\n')
+        print(f"Distribution profile written to: {profile_path}", file=sys.stderr)
 
-    # Write to file
-    args.output.write_text(sql_content)
-    print(f"Generated SQL file: {args.output}")
-    print(f"Total statements: {sql_content.count('INSERT INTO')}")
+    if keys is not None:
+        write_manifest(args.manifest, keys, years)
+        print(f"Manifest of generated keys written to: {args.manifest}", file=sys.stderr)
 
 
 if __name__ == '__main__':